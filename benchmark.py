@@ -0,0 +1,206 @@
+"""
+Benchmark offline del bot: corre las funciones reales de `streamlit_app`
+(analizar_filtro_precio, contextualizar_consulta, buscar_productos_vectorial,
+generar_respuesta_tecnica) sobre conversaciones guionizadas, con Groq,
+Supabase y (opcionalmente) el modelo de embeddings reemplazados por dobles
+locales deterministas (fakes.py).
+
+Reporta latencia por etapa, tokens por turno y recall@3, y compara contra una
+línea base guardada: si algo empeora más de la tolerancia, sale con código 1.
+
+    python benchmark.py                         # compara contra bench/linea_base.json
+    python benchmark.py --guardar-linea-base    # actualiza la línea base
+    python benchmark.py --ruta hibrido          # usa buscar_hibrido (SKU + especulación)
+    python benchmark.py --async                 # mismas etapas por el pipeline asíncrono
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+DIR_BENCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench")
+
+
+def _importar_app(args):
+    """Importa streamlit_app en modo 'bare' con SM_BACKEND=falso (sin servidor ni API keys)."""
+    os.environ["SM_BACKEND"] = "falso"
+    os.environ["SM_CATALOGO_FALSO"] = args.catalogo
+    os.environ["STREAMING_RESPUESTAS"] = "0"
+    os.environ["METRICAS_ARCHIVO"] = ""
+    os.environ["REGISTRO_CONSULTAS"] = ""  # sin precalentamiento: el benchmark mide cachés en frío
+    os.environ["FALSO_LATENCIA_DB"] = str(args.latencia_db)
+    os.environ["FALSO_LATENCIA_LLM"] = str(args.latencia_llm)
+    os.environ["FALSO_LATENCIA_TOKEN"] = str(args.latencia_token)
+    os.environ["FALSO_LATENCIA_EMBEDDING"] = str(args.latencia_embedding)
+    os.environ["PIPELINE_ASYNC"] = "1" if args.pipeline_async else "0"
+    os.environ["GROQ_RPM"] = os.environ["GROQ_TPM"] = "100000000"  # el gateway no debe hacer fila aquí
+    logging.disable(logging.WARNING)  # avisos de "bare mode" de Streamlit al importar el script
+    try:
+        import streamlit_app as app
+    finally:
+        logging.disable(logging.NOTSET)
+
+    if args.modelo_real:
+        import fakes
+        from embeddings import ModeloEmbeddings
+
+        modelo = ModeloEmbeddings(backend=os.getenv("EMBEDDINGS_BACKEND", "torch")).calentar()
+        app.client_db, client_ia, app.model_embedding = fakes.crear_clientes_falsos(args.catalogo, model=modelo)
+        app.client_ia = app.gateway.envolver(client_ia)
+    return app
+
+
+def _recall(esperados, productos, k=3):
+    if not esperados:
+        return None
+    obtenidos = {str(p.get("sku")) for p in productos[:k]}
+    return len(obtenidos & set(esperados)) / min(len(esperados), k)
+
+
+def correr(app, conversaciones, ruta):
+    import metricas
+    from cache_embeddings import CacheEmbeddings
+
+    app.cache_embeddings = CacheEmbeddings()  # caché fría en cada corrida: resultados comparables
+    turnos = []
+    for conversacion in conversaciones:
+        historial = [{"role": "assistant", "content": "Bienvenido a SM Automatización. ¿En qué podemos ayudarle hoy?"}]
+        for i, turno in enumerate(conversacion["turnos"]):
+            texto = turno["usuario"]
+            traza = metricas.iniciar_turno(conversacion=conversacion["nombre"], turno=i)
+            historial.append({"role": "user", "content": texto})
+            productos = []
+            if app.es_saludo_simple(texto):
+                resp = app.generar_charla_social(texto)
+            else:
+                with metricas.span("filtro_precio"):
+                    filtro = app.analizar_filtro_precio(texto)
+                if ruta == "hibrido":
+                    query, productos = app.buscar_hibrido(texto, historial, 3, filtro)
+                else:
+                    with metricas.span("contextualizar"):
+                        query = app.contextualizar_consulta(texto, historial)
+                    productos = app.buscar_productos_vectorial(query, 3, filtro)
+                resp = app.generar_respuesta_tecnica(query, productos)
+            historial.append({"role": "assistant", "content": resp})
+            registro = metricas.finalizar_turno(traza)
+            registro["recall@3"] = _recall(turno.get("esperados"), productos)
+            turnos.append(registro)
+    return turnos
+
+
+def resumir(turnos):
+    def pcts(valores):
+        valores = sorted(valores)
+        return {"p50_ms": round(statistics.median(valores), 2),
+                "p95_ms": round(valores[min(len(valores) - 1, int(0.95 * (len(valores) - 1) + 0.5))], 2)}
+
+    etapas = {}
+    for t in turnos:
+        for etapa, ms in t["etapas_ms"].items():
+            etapas.setdefault(etapa, []).append(ms)
+    tokens_prompt = [sum(v["prompt"] for v in t["tokens"].values()) for t in turnos]
+    tokens_completion = [sum(v["completion"] for v in t["tokens"].values()) for t in turnos]
+    recalls = [t["recall@3"] for t in turnos if t["recall@3"] is not None]
+    return {
+        "turnos": len(turnos),
+        "turno": pcts([t["total_ms"] for t in turnos]),
+        "etapas": {etapa: pcts(v) for etapa, v in sorted(etapas.items())},
+        "tokens_prompt_por_turno": round(statistics.fmean(tokens_prompt), 1),
+        "tokens_completion_por_turno": round(statistics.fmean(tokens_completion), 1),
+        "recall@3": round(statistics.fmean(recalls), 4) if recalls else None,
+        "errores": sum(len(t["errores"]) for t in turnos),
+    }
+
+
+def comparar(actual, base, tolerancia, holgura_ms=2.0):
+    """Lista de regresiones (texto) de `actual` respecto a `base`."""
+    regresiones = []
+
+    def latencia(nombre, a, b):
+        for q in ("p50_ms", "p95_ms"):
+            if q in a and q in b and a[q] > b[q] * (1 + tolerancia) + holgura_ms:
+                regresiones.append(f"{nombre} {q}: {a[q]} ms > {b[q]} ms (+{tolerancia:.0%})")
+
+    latencia("turno", actual["turno"], base["turno"])
+    for etapa, b in base.get("etapas", {}).items():
+        if etapa in actual["etapas"]:
+            latencia(etapa, actual["etapas"][etapa], b)
+    for clave in ("tokens_prompt_por_turno", "tokens_completion_por_turno"):
+        if actual[clave] > base[clave] * 1.05:
+            regresiones.append(f"{clave}: {actual[clave]} > {base[clave]} (+5%)")
+    if base.get("recall@3") is not None and (actual["recall@3"] or 0) < base["recall@3"] - 0.01:
+        regresiones.append(f"recall@3: {actual['recall@3']} < {base['recall@3']}")
+    if actual["errores"] > base.get("errores", 0):
+        regresiones.append(f"errores: {actual['errores']} > {base.get('errores', 0)}")
+    return regresiones
+
+
+def imprimir(resumen):
+    print(f"\nTurnos: {resumen['turnos']} · recall@3: {resumen['recall@3']} · errores: {resumen['errores']}")
+    print(f"Tokens por turno: prompt {resumen['tokens_prompt_por_turno']} · completion {resumen['tokens_completion_por_turno']}")
+    print(f"{'etapa':22s} {'p50 ms':>10s} {'p95 ms':>10s}")
+    print(f"{'turno':22s} {resumen['turno']['p50_ms']:10.2f} {resumen['turno']['p95_ms']:10.2f}")
+    for etapa, r in resumen["etapas"].items():
+        print(f"{etapa:22s} {r['p50_ms']:10.2f} {r['p95_ms']:10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del bot SM Automatización")
+    parser.add_argument("--conversaciones", default=os.path.join(DIR_BENCH, "conversaciones.json"))
+    parser.add_argument("--catalogo", default=os.path.join(DIR_BENCH, "catalogo.json"))
+    parser.add_argument("--linea-base", default=os.path.join(DIR_BENCH, "linea_base.json"))
+    parser.add_argument("--guardar-linea-base", action="store_true")
+    parser.add_argument("--salida", help="guarda el resumen y los registros por turno en este JSON")
+    parser.add_argument("--ruta", choices=("funciones", "hibrido"), default="funciones")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento de latencia permitido")
+    parser.add_argument("--async", dest="pipeline_async", action="store_true",
+                        help="corre las etapas por el pipeline asíncrono (PIPELINE_ASYNC=1)")
+    parser.add_argument("--modelo-real", action="store_true", help="usa all-MiniLM-L6-v2 en lugar del embedding falso")
+    parser.add_argument("--latencia-llm", type=float, default=0.25, help="segundos al primer token del LLM falso")
+    parser.add_argument("--latencia-token", type=float, default=0.004)
+    parser.add_argument("--latencia-db", type=float, default=0.05)
+    parser.add_argument("--latencia-embedding", type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    with open(args.conversaciones, encoding="utf-8") as f:
+        conversaciones = json.load(f)
+    app = _importar_app(args)
+    inicio = time.perf_counter()
+    turnos = correr(app, conversaciones, args.ruta)
+    resumen = resumir(turnos)
+    resumen["ruta"] = args.ruta
+    imprimir(resumen)
+    print(f"\nDuración total: {time.perf_counter() - inicio:.2f}s")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"resumen": resumen, "turnos": turnos}, f, ensure_ascii=False, indent=2)
+    if args.guardar_linea_base:
+        with open(args.linea_base, "w", encoding="utf-8") as f:
+            json.dump(resumen, f, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {args.linea_base}")
+        return 0
+    if not os.path.exists(args.linea_base):
+        print("Sin línea base: corre con --guardar-linea-base para crearla.")
+        return 0
+    with open(args.linea_base, encoding="utf-8") as f:
+        base = json.load(f)
+    if base.get("ruta", "funciones") != args.ruta:
+        print(f"La línea base es de la ruta '{base.get('ruta')}': no se compara.")
+        return 0
+    regresiones = comparar(resumen, base, args.tolerancia)
+    if regresiones:
+        print("\n❌ REGRESIONES contra la línea base:")
+        for r in regresiones:
+            print(f"  - {r}")
+        return 1
+    print("\n✅ Sin regresiones contra la línea base.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
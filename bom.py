@@ -0,0 +1,212 @@
+import re
+import unicodedata
+from dataclasses import dataclass, replace
+
+# --- MODO LISTA DE MATERIALES (BOM) ---
+# Los integradores pegan listas completas ("PLC, 3 sensores inductivos PNP,
+# fuente 24V 5A, relevadores"). Como consulta única, un solo vector con top 3
+# deja sin resultado a casi todas las partidas. Aquí el mensaje se separa en
+# partidas con cantidad; la app las vectoriza en una sola llamada a `encode`,
+# las busca en lote y responde con una cotización consolidada con subtotales.
+
+MAX_PARTIDAS = 30
+
+NUMEROS = {
+    "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7,
+    "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12, "quince": 15, "veinte": 20,
+}
+_UNIDADES_CANTIDAD = r"(?:x|pzas?|piezas?|pz|pcs|unidades|uds?|juegos?)"
+_UNIDADES_TECNICAS = (
+    r"(?:v|vac|vca|vdc|a|amp|amperes|ma|w|kw|kva|mm|cm|hz|rpm|kg|hp|awg|pulgadas|polos?|hilos?|pines|fases?|"
+    r"ohms?|bar|psi|nm)"
+)
+# Al inicio, los metros también son cantidad: el cable se vende por metro ("10 mts de cable calibre 18")
+_CANTIDAD_INICIAL = re.compile(
+    rf"^(?:(\d{{1,4}})\s*(?:{_UNIDADES_CANTIDAD}|m|mts|metros)?\.?|({'|'.join(NUMEROS)}))\s+(?!{_UNIDADES_TECNICAS}\b)"
+    rf"(?:(?:{_UNIDADES_CANTIDAD}|mts|metros)\.?\s+)?(?:de\s+)?",
+    re.IGNORECASE,
+)
+# Segmento que es solo especificación ("4 hilos", "220/440v", "1800 rpm"): califica a la partida anterior
+_ESPECIFICACION = re.compile(rf"^(?:\d+(?:[.,/]\d+)*\s*{_UNIDADES_TECNICAS}\b\.?\s*)+$", re.IGNORECASE)
+_LONGITUD = re.compile(r"^(\d{1,4})\s*(?:m|mts|metros)\.?$", re.IGNORECASE)
+_CANTIDAD_FINAL = re.compile(rf"\s*(?:\(\s*(\d{{1,4}})\s*\)|x\s*(\d{{1,4}})|(\d{{1,4}})\s*{_UNIDADES_CANTIDAD}\.?)\s*$", re.IGNORECASE)
+_ENTRADA = re.compile(
+    r"^(?:hola[,!.\s]*)?(?:(?:me\s+)?(?:cotiza(?:s|n)?(?:me)?|cot[ií]zame|necesito|busco|requiero|quiero|ocupo|"
+    r"me\s+interesa[n]?|lista\s+de\s+(?:materiales|partes)|bom)\b[\s:,-]*)+",
+    re.IGNORECASE,
+)
+_MARCADOR = re.compile(r"\b(?:bom|lista de materiales|lista de partes|cotiza\w*|cot[ií]za\w*|cotizaci[oó]n)\b", re.IGNORECASE)
+# Segmentos que califican al anterior ("..., que sea PNP", "..., con cable") en lugar de ser otra partida
+_CALIFICADOR = re.compile(r"^(?:que|con|sin|de|del|para|pero|o|en|cuando|porque|si|tipo|marca|como|y)\b", re.IGNORECASE)
+_SEPARADORES = re.compile(r"[\n;,•·]+|\s+\+\s+|(?:^|\s)-\s+")
+_CONJUNCION = re.compile(r"\s+(?:y|e)\s+")
+_CONJUNCION_CANTIDAD = re.compile(rf"\s+(?:y|e)\s+(?=(?:\d{{1,4}}|{'|'.join(NUMEROS)})\s)", re.IGNORECASE)
+
+
+def _singular(palabra):
+    """Plural español regular del sustantivo núcleo: sensores -> sensor, fuentes -> fuente, luces -> luz."""
+    if len(palabra) <= 4 or not palabra.isalpha() or not palabra.islower():
+        return palabra
+    if palabra.endswith("ces"):
+        return palabra[:-3] + "z"
+    if palabra.endswith("es") and palabra[-3] in "rlndj":
+        return palabra[:-2]
+    if palabra.endswith("s") and palabra[-2] in "aeiou":
+        return palabra[:-1]
+    return palabra
+
+
+@dataclass(frozen=True)
+class Partida:
+    cantidad: int
+    descripcion: str
+    explicita: bool = False  # la cantidad venía escrita ("3 sensores", "x2"), no es el 1 por defecto
+
+    @property
+    def consulta(self):
+        """Texto que se vectoriza: el catálogo nombra en singular ("Sensor inductivo", no "sensores")."""
+        nucleo, _, resto = self.descripcion.partition(" ")
+        return f"{_singular(nucleo)} {resto}".strip()
+
+
+def _sin_acentos(texto):
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def _partida(segmento):
+    texto = segmento.strip(" .:-*\t").strip()
+    cantidad, explicita = 1, False
+    inicial = _CANTIDAD_INICIAL.match(texto)
+    if inicial:
+        if inicial.group(1):
+            cantidad, explicita = int(inicial.group(1)), True
+        else:
+            palabra = inicial.group(2).lower()
+            cantidad, explicita = NUMEROS[palabra], palabra not in ("un", "uno", "una")  # "un PLC" es un artículo
+        texto = texto[inicial.end():]
+    else:
+        final = _CANTIDAD_FINAL.search(texto)
+        if final:
+            cantidad, explicita = int(next(g for g in final.groups() if g)), True
+            texto = texto[:final.start()]
+    texto = texto.strip(" .:-*\t")
+    return Partida(max(cantidad, 1), texto, explicita) if texto else None
+
+
+def _agregar_especificacion(partidas, segmento):
+    """
+    Si `segmento` solo trae número y unidad, lo pega a la última partida en vez
+    de abrir otra: "variador 2 hp, 220 v, 3 fases" es un producto. Los metros
+    sueltos son la cantidad del anterior ("cable calibre 18, 100 metros").
+    """
+    anterior = partidas[-1]
+    longitud = _LONGITUD.match(segmento)
+    if longitud and not anterior.explicita:
+        partidas[-1] = replace(anterior, cantidad=max(int(longitud.group(1)), 1), explicita=True)
+    elif longitud or _ESPECIFICACION.match(segmento):
+        partidas[-1] = replace(anterior, descripcion=f"{anterior.descripcion} {segmento}")
+    else:
+        return False
+    return True
+
+
+def separar_partidas(texto):
+    """Partidas del mensaje en orden; "a, b y c" se separa también en la conjunción final."""
+    cuerpo = texto.split(":", 1)[1] if ":" in texto and len(texto.split(":", 1)[0].split()) <= 6 else texto
+    cuerpo = _ENTRADA.sub("", cuerpo.strip())
+    segmentos = [s for s in _SEPARADORES.split(cuerpo) if s.strip()]
+    if len(segmentos) >= 2:
+        # La "y" separa en el último segmento de una enumeración ("PLC, sensor y fuente")...
+        segmentos[-1:] = _CONJUNCION.split(segmentos[-1])
+    # ...o cuando le sigue una cantidad ("tres relevadores y dos botones")
+    segmentos = [parte for s in segmentos for parte in _CONJUNCION_CANTIDAD.split(s)]
+    partidas = []
+    for segmento in segmentos:
+        if _CALIFICADOR.match(segmento.strip()) and partidas:
+            return []  # es una sola consulta con matices, no una lista
+        if partidas and _agregar_especificacion(partidas, segmento.strip(" .:-*\t")):
+            continue
+        partida = _partida(_ENTRADA.sub("", segmento.strip()))
+        if partida:
+            partidas.append(partida)
+    return partidas[:MAX_PARTIDAS]
+
+
+def detectar_lista(texto):
+    """Partidas si el mensaje parece lista de materiales, o None para seguir por la consulta normal."""
+    partidas = separar_partidas(texto)
+    if len(partidas) < 2:
+        return None
+    productos = [p for p in partidas if p.explicita or len(p.descripcion.split()) >= 2]
+    if _MARCADOR.search(_sin_acentos(texto)) or "\n" in texto.strip():
+        return partidas
+    if len(partidas) >= 3 and len(productos) >= 2:
+        return partidas
+    if sum(p.explicita for p in partidas) >= 2:
+        return partidas
+    return None
+
+
+# --- COTIZACIÓN ---
+
+def _precio(producto):
+    try:
+        return float(producto.get("precio")) if producto and producto.get("precio") is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def armar_cotizacion(partidas, resultados):
+    """`resultados[i]` son las filas encontradas para `partidas[i]`; se cotiza la primera (la más similar)."""
+    lineas, total, sin_precio, sin_resultado = [], 0.0, 0, []
+    for partida, filas in zip(partidas, resultados):
+        producto = filas[0] if filas else None
+        precio = _precio(producto)
+        subtotal = precio * partida.cantidad if precio is not None else None
+        if producto is None:
+            sin_resultado.append(partida.descripcion)
+        elif subtotal is None:
+            sin_precio += 1
+        else:
+            total += subtotal
+        lineas.append({"partida": partida, "producto": producto, "precio": precio, "subtotal": subtotal})
+    return {"lineas": lineas, "total": total, "sin_precio": sin_precio, "sin_resultado": sin_resultado}
+
+
+def _celda(texto):
+    return str(texto).replace("|", "/").replace("\n", " ")
+
+
+def _dinero(valor):
+    # "\$": sin escapar, st.markdown interpreta dos "$" en la misma línea como LaTeX
+    return f"\\${valor:,.2f}" if valor is not None else "—"
+
+
+def tabla_cotizacion(cotizacion):
+    """Tabla Markdown de la cotización con subtotales y total estimado."""
+    filas = [
+        "| # | Partida | Producto | SKU | Cant. | P. unitario | Subtotal |",
+        "|---|---|---|---|---:|---:|---:|",
+    ]
+    for i, linea in enumerate(cotizacion["lineas"], 1):
+        partida, producto = linea["partida"], linea["producto"]
+        if producto is None:
+            filas.append(f"| {i} | {_celda(partida.descripcion)} | _Sin coincidencia en catálogo_ | — | {partida.cantidad} | — | — |")
+            continue
+        nombre = _celda(producto.get("nombre") or "")
+        if producto.get("url_web"):
+            nombre = f"[{nombre}]({producto['url_web']})"
+        filas.append(
+            f"| {i} | {_celda(partida.descripcion)} | {nombre} | {_celda(producto.get('sku') or 'S/N')} | "
+            f"{partida.cantidad} | {_dinero(linea['precio'])} | {_dinero(linea['subtotal'])} |"
+        )
+    texto = "Cotización de su lista de materiales:\n\n" + "\n".join(filas)
+    texto += f"\n\n**Total estimado: {_dinero(cotizacion['total'])} MXN**"
+    notas = []
+    if cotizacion["sin_resultado"]:
+        notas.append(f"{len(cotizacion['sin_resultado'])} partida(s) sin coincidencia: indíquenos marca o número de parte.")
+    if cotizacion["sin_precio"]:
+        notas.append(f"{cotizacion['sin_precio']} partida(s) sin precio publicado: no se incluyen en el total.")
+    if notas:
+        texto += "\n\n" + "\n".join(f"- {n}" for n in notas)
+    return texto
@@ -0,0 +1,207 @@
+import fcntl
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# --- CACHÉ DE EMBEDDINGS EN DOS NIVELES ---
+# Nivel 1: LRU en memoria acotado por número de entradas y por bytes.
+# Nivel 2 (opcional): almacén en disco compartido entre procesos de Streamlit
+#   - vectores.f32 : filas float32 contiguas (se leen con memmap)
+#   - claves.jsonl : una clave por línea; la línea n corresponde a la fila n
+#   Acotado por `max_entradas`: al llenarse se compacta (reescritura de ambos
+#   archivos) conservando las claves usadas hace poco y las más nuevas.
+
+
+def normalizar_consulta(texto):
+    """Minúsculas, sin acentos y con espacios colapsados: 'Sensor  Inductivo' == 'sensor inductivo'."""
+    texto = unicodedata.normalize("NFD", texto.lower())
+    texto = "".join(c for c in texto if unicodedata.category(c) != "Mn")
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+class AlmacenDisco:
+    """Filas float32 mapeadas en memoria + índice de claves, con escritura bajo flock."""
+
+    def __init__(self, directorio, dimension=384, max_entradas=50000, conservar=0.75):
+        os.makedirs(directorio, exist_ok=True)
+        self.dimension = dimension
+        self.max_entradas = max_entradas
+        self.conservar = conservar  # fracción del tope que sobrevive a una compactación
+        self.ruta_vectores = os.path.join(directorio, "vectores.f32")
+        self.ruta_claves = os.path.join(directorio, "claves.jsonl")
+        self.ruta_candado = os.path.join(directorio, ".candado")
+        self.indice = {}
+        self._offset_claves = 0
+        self._inodo_claves = None
+        self._memmap = None
+        self._usadas = OrderedDict()  # claves leídas por este proceso, la más reciente al final
+        self._candado = threading.Lock()
+        self.compactaciones = 0
+
+    def _sincronizar(self):
+        """
+        Lee las claves que otros procesos hayan agregado desde la última vez. Si
+        otro proceso compactó (archivo de claves nuevo), vuelve a leer desde cero.
+        """
+        try:
+            estado = os.stat(self.ruta_claves)
+        except FileNotFoundError:
+            return
+        if estado.st_ino != self._inodo_claves or estado.st_size < self._offset_claves:
+            self.indice, self._offset_claves, self._inodo_claves, self._memmap = {}, 0, estado.st_ino, None
+        elif estado.st_size == self._offset_claves:
+            return
+        with open(self.ruta_claves, "rb") as f:
+            f.seek(self._offset_claves)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break  # línea a medio escribir por otro proceso
+                self.indice.setdefault(json.loads(linea), len(self.indice))
+                self._offset_claves += len(linea)
+        filas = len(self.indice)
+        self._memmap = np.memmap(self.ruta_vectores, dtype=np.float32, mode="r", shape=(filas, self.dimension)) if filas else None
+
+    def obtener(self, clave):
+        with self._candado:
+            if clave not in self.indice:
+                # Compartido: una compactación reemplaza los dos archivos y no debe verse a medias
+                with open(self.ruta_candado, "w") as candado:
+                    fcntl.flock(candado, fcntl.LOCK_SH)
+                    try:
+                        self._sincronizar()
+                    finally:
+                        fcntl.flock(candado, fcntl.LOCK_UN)
+            fila = self.indice.get(clave)
+            if fila is None:
+                return None
+            self._usadas[clave] = None
+            self._usadas.move_to_end(clave)
+            while len(self._usadas) > self.max_entradas:
+                self._usadas.popitem(last=False)
+            return np.array(self._memmap[fila])
+
+    def guardar(self, clave, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dimension,):
+            return
+        with self._candado, open(self.ruta_candado, "w") as candado:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+            try:
+                self._sincronizar()
+                if clave in self.indice:
+                    return
+                if len(self.indice) >= self.max_entradas:
+                    self._compactar()
+                # Primero el vector y después la clave: un lector nunca ve una clave sin su fila
+                with open(self.ruta_vectores, "ab") as f:
+                    f.seek(len(self.indice) * self.dimension * 4)
+                    f.truncate()
+                    f.write(vector.tobytes())
+                with open(self.ruta_claves, "ab") as f:
+                    f.write(json.dumps(clave, ensure_ascii=False).encode() + b"\n")
+                self._sincronizar()
+            finally:
+                fcntl.flock(candado, fcntl.LOCK_UN)
+
+    def _compactar(self):
+        """
+        Reescribe el almacén con `conservar * max_entradas` filas: primero las que
+        este proceso leyó hace poco, después las más nuevas. Se llama con el flock
+        exclusivo tomado; los otros procesos lo notan por el inodo del archivo de claves.
+        """
+        objetivo = int(self.max_entradas * self.conservar)
+        elegidas = [c for c in reversed(self._usadas) if c in self.indice][:objetivo]
+        vistas = set(elegidas)
+        for clave in sorted(self.indice, key=self.indice.get, reverse=True):
+            if len(elegidas) >= objetivo:
+                break
+            if clave not in vistas:
+                elegidas.append(clave)
+        filas = sorted(self.indice[c] for c in elegidas)  # conserva el orden de llegada
+        claves = sorted(elegidas, key=self.indice.get)
+        vectores = np.array(self._memmap[filas]) if filas else np.zeros((0, self.dimension), dtype=np.float32)
+        for ruta, contenido in ((self.ruta_vectores, vectores.tobytes()),
+                                (self.ruta_claves, b"".join(json.dumps(c, ensure_ascii=False).encode() + b"\n"
+                                                            for c in claves))):
+            with open(ruta + ".tmp", "wb") as f:
+                f.write(contenido)
+            os.replace(ruta + ".tmp", ruta)
+        self._usadas = OrderedDict((c, None) for c in self._usadas if c in vistas)
+        self._inodo_claves = None  # fuerza la relectura
+        self._sincronizar()
+        self.compactaciones += 1
+
+    def __len__(self):
+        return len(self.indice)
+
+
+class CacheEmbeddings:
+    """LRU en memoria delante de `encode`, con almacén en disco opcional detrás."""
+
+    def __init__(self, max_entradas=2048, max_bytes=16 * 1024 * 1024, almacen=None):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.almacen = almacen
+        self._lru = OrderedDict()
+        self._bytes = 0
+        self._candado = threading.Lock()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+
+    def obtener(self, texto):
+        clave = normalizar_consulta(texto)
+        with self._candado:
+            vector = self._lru.get(clave)
+            if vector is not None:
+                self._lru.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return vector
+        if self.almacen is not None:
+            vector = self.almacen.obtener(clave)
+            if vector is not None:
+                self._guardar_memoria(clave, vector)
+                with self._candado:
+                    self.aciertos_disco += 1
+                return vector
+        with self._candado:
+            self.fallos += 1
+        return None
+
+    def guardar(self, texto, vector):
+        clave = normalizar_consulta(texto)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._guardar_memoria(clave, vector)
+        if self.almacen is not None:
+            self.almacen.guardar(clave, vector)
+
+    def _guardar_memoria(self, clave, vector):
+        vector.setflags(write=False)  # se comparte entre sesiones: nadie debe mutarlo
+        with self._candado:
+            anterior = self._lru.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior.nbytes
+            self._lru[clave] = vector
+            self._bytes += vector.nbytes
+            while self._lru and (len(self._lru) > self.max_entradas or self._bytes > self.max_bytes):
+                _, expulsado = self._lru.popitem(last=False)
+                self._bytes -= expulsado.nbytes
+
+    def estadisticas(self):
+        with self._candado:
+            consultas = self.aciertos_memoria + self.aciertos_disco + self.fallos
+            return {
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "tasa_aciertos": (self.aciertos_memoria + self.aciertos_disco) / consultas if consultas else 0.0,
+                "entradas": len(self._lru),
+                "bytes": self._bytes,
+                "entradas_disco": len(self.almacen) if self.almacen is not None else 0,
+                "compactaciones_disco": self.almacen.compactaciones if self.almacen is not None else 0,
+            }
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from indice_local import id_producto
+
+# --- CACHÉ SEMÁNTICA DE RESPUESTAS ---
+# Evita repetir la completion de 70B para preguntas casi idénticas. Una entrada
+# sirve solo si:
+#   1. la consulta reescrita está a coseno >= umbral de la guardada, y
+#   2. la búsqueda devolvió exactamente los mismos productos con el mismo
+#      precio y las mismas URLs (la firma), así nunca se sirve un precio viejo.
+# Acotada por número de entradas (LRU) y por antigüedad (TTL).
+
+
+def firma_productos(productos):
+    """Identidad + datos visibles de cada producto; cualquier cambio invalida la entrada."""
+    return tuple(sorted(
+        (str(id_producto(p)), p.get("precio"), p.get("url_web"), p.get("url_imagen"))
+        for p in productos
+    ))
+
+
+class _Entrada:
+    __slots__ = ("vector", "firma", "respuesta", "creada")
+
+    def __init__(self, vector, firma, respuesta):
+        self.vector = vector
+        self.firma = firma
+        self.respuesta = respuesta
+        self.creada = time.monotonic()
+
+
+class CacheRespuestas:
+    def __init__(self, umbral=0.95, max_entradas=500, ttl=3600):
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # clave -> _Entrada (orden LRU)
+        self._por_productos = {}  # frozenset(ids) -> {claves}
+        self._siguiente = 0
+        self._candado = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidadas = 0
+
+    @staticmethod
+    def _ids(firma):
+        return frozenset(item[0] for item in firma)
+
+    @staticmethod
+    def _normalizar(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return
+        ids = self._ids(entrada.firma)
+        claves = self._por_productos.get(ids)
+        if claves is not None:
+            claves.discard(clave)
+            if not claves:
+                del self._por_productos[ids]
+
+    def buscar(self, vector, productos):
+        """Respuesta guardada para una consulta casi igual con los mismos productos, o None."""
+        if not productos:
+            return None
+        firma = firma_productos(productos)
+        q = self._normalizar(vector)
+        ahora = time.monotonic()
+        with self._candado:
+            mejor, mejor_sim = None, self.umbral
+            for clave in list(self._por_productos.get(self._ids(firma), ())):
+                entrada = self._entradas[clave]
+                if ahora - entrada.creada > self.ttl or entrada.firma != firma:
+                    # caducó, o cambió precio/URL de algún producto referenciado
+                    self._quitar(clave)
+                    self.invalidadas += 1
+                    continue
+                similitud = float(entrada.vector @ q)
+                if similitud >= mejor_sim:
+                    mejor, mejor_sim = clave, similitud
+            if mejor is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(mejor)
+            self.aciertos += 1
+            return self._entradas[mejor].respuesta
+
+    def guardar(self, vector, productos, respuesta):
+        if not productos or not respuesta:
+            return
+        firma = firma_productos(productos)
+        with self._candado:
+            clave = self._siguiente
+            self._siguiente += 1
+            self._entradas[clave] = _Entrada(self._normalizar(vector), firma, respuesta)
+            self._por_productos.setdefault(self._ids(firma), set()).add(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._quitar(next(iter(self._entradas)))
+
+    def invalidar_productos(self, ids):
+        """Descarta toda entrada que mencione alguno de estos productos (cambio de precio/URL)."""
+        ids = {str(i) for i in ids}
+        with self._candado:
+            for grupo in [g for g in self._por_productos if g & ids]:
+                for clave in list(self._por_productos.get(grupo, ())):
+                    self._quitar(clave)
+                    self.invalidadas += 1
+
+    def estadisticas(self):
+        with self._candado:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "invalidadas": self.invalidadas,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            }
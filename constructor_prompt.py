@@ -0,0 +1,172 @@
+import json
+import os
+import re
+
+from cache_embeddings import normalizar_consulta
+
+# --- INVENTARIO CON PRESUPUESTO DE TOKENS ---
+# Los tokens de entrada mandan en la latencia y en la cuota de Groq. El
+# inventario va en JSON compacto, sin campos que el modelo no usa, y las
+# descripciones se recortan a las frases que tienen que ver con la consulta
+# hasta que el prompt completo cabe en PRESUPUESTO_TOKENS_PROMPT. Si aun así
+# no cabe, salen los productos del final (los menos relevantes).
+
+PRESUPUESTO_TOKENS = int(os.getenv("PRESUPUESTO_TOKENS_PROMPT", "1200"))
+MAX_TOKENS_DESCRIPCION = 70  # ~250 caracteres, el corte que se usaba antes
+MIN_TOKENS_DESCRIPCION = 12  # con menos no alcanza ni para decir qué es
+TOKENS_POR_MENSAJE = 4  # rol y separadores del formato de chat
+
+_PIEZA = re.compile(r"[^\W\d_]+|\d+|[^\w\s]+|\s+")
+_FRASE = re.compile(r"(?<=[.;:!?])\s+|\n+|\s+[-•·]\s+")
+_PALABRA = re.compile(r"[a-z0-9]+")
+_VACIAS = frozenset(
+    "a al con de del el en es la las lo los o para por que se su sus un una y "
+    "busco ocupo necesito quiero tiene tienen hay".split()
+)
+
+_codificador = None
+
+
+def _tiktoken():
+    """cl100k_base si tiktoken está instalado (el vocabulario de Llama 3 parte de él); si no, False."""
+    global _codificador
+    if _codificador is None:
+        try:
+            import tiktoken
+            _codificador = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # sin paquete, o sin el archivo del vocabulario y sin red
+            _codificador = False
+    return _codificador
+
+
+def contar_tokens(texto):
+    """
+    Tokens de `texto` con el tokenizador local. Sin tiktoken, una aproximación
+    por piezas (palabras de ~4 letras por token, números de 3 dígitos,
+    puntuación pegada y espacios en bloque) que en español y JSON queda
+    a ±15% de cl100k.
+    """
+    codificador = _tiktoken()
+    if codificador:
+        return len(codificador.encode(texto, disallowed_special=()))
+    total = 0
+    for pieza in _PIEZA.findall(texto):
+        if pieza.isspace():
+            total += 1 if "\n" in pieza or len(pieza) > 1 else 0  # el espacio simple va pegado a la palabra
+        elif pieza.isdigit():
+            total += -(-len(pieza) // 3)
+        elif pieza[0].isalpha():
+            total += -(-len(pieza) // 4)
+        else:
+            total += -(-len(pieza) // 2)
+    return total
+
+
+def contar_tokens_mensajes(messages):
+    return sum(contar_tokens(m.get("content", "")) + TOKENS_POR_MENSAJE for m in messages)
+
+
+def terminos(texto):
+    """Palabras de la consulta que sirven para puntuar frases (sin acentos, sin vacías, sin plural)."""
+    salida = set()
+    for palabra in _PALABRA.findall(normalizar_consulta(texto)):
+        if palabra in _VACIAS or (len(palabra) < 2 and not palabra.isdigit()):
+            continue
+        salida.add(palabra[:-1] if len(palabra) > 4 and palabra.endswith("s") else palabra)
+    return salida
+
+
+def _recortar_palabras(texto, max_tokens):
+    palabras = texto.split()
+    while palabras and contar_tokens(" ".join(palabras)) > max_tokens:
+        palabras.pop()
+    return " ".join(palabras)
+
+
+def recortar_descripcion(descripcion, terminos_consulta, max_tokens):
+    """
+    La primera frase (dice qué es el producto; a lo más la mitad de `max_tokens`
+    si hay otras que importan) más las frases con más términos de la consulta,
+    en su orden original. Sin frases relevantes, el principio del texto.
+    """
+    descripcion = " ".join((descripcion or "").split())
+    if contar_tokens(descripcion) <= max_tokens:
+        return descripcion
+    frases = [f for f in _FRASE.split(descripcion) if f.strip()]
+    puntaje = {i: len(terminos(f) & terminos_consulta) for i, f in enumerate(frases) if i}
+    relevantes = sorted((i for i in puntaje if puntaje[i]), key=lambda i: (-puntaje[i], i))
+    if not relevantes:
+        return _recortar_palabras(descripcion, max_tokens)
+    elegidas = {0: _recortar_palabras(frases[0], max_tokens // 2)}
+    usados = contar_tokens(elegidas[0])
+    for i in relevantes:
+        costo = contar_tokens(frases[i]) + 1
+        if usados + costo <= max_tokens:
+            elegidas[i] = frases[i]
+            usados += costo
+    return " ".join(elegidas[i] for i in sorted(elegidas) if elegidas[i])
+
+
+def serializar(items):
+    """JSON compacto: sin sangría ni espacios y con acentos tal cual (\\u00f3 cuesta varios tokens)."""
+    return json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+
+
+def _armar(base, descripciones):
+    return serializar([{**item, "descripcion": texto} if texto else item for item, texto in zip(base, descripciones)])
+
+
+def _repartir(descripciones, terminos_consulta, restante):
+    """
+    Recorta cada descripción a su cuota del presupuesto que queda. Va en orden
+    de relevancia y el primero puede tomar el doble que el promedio; lo que un
+    producto no usa pasa a los siguientes.
+    """
+    costo_campo = contar_tokens(',"descripcion":""')
+    textos = []
+    for i, descripcion in enumerate(descripciones):
+        cuota = min(MAX_TOKENS_DESCRIPCION, 2 * restante // (len(descripciones) - i + 1) - costo_campo)
+        texto = recortar_descripcion(descripcion, terminos_consulta, cuota) if cuota >= MIN_TOKENS_DESCRIPCION else ""
+        if texto:
+            restante -= contar_tokens(texto) + costo_campo
+        textos.append(texto)
+    return textos
+
+
+def inventario(productos, consulta, tokens_fijos, presupuesto=None, campos_url=False):
+    """
+    (json, info) del inventario que cabe en `presupuesto` junto con `tokens_fijos`
+    (instrucciones, consulta y formato). `info` trae los tokens del inventario
+    sin recortar y recortado, y cuántos productos quedaron y con descripción.
+    """
+    presupuesto = PRESUPUESTO_TOKENS if presupuesto is None else presupuesto
+    terminos_consulta = terminos(consulta)
+    base = []
+    for p in productos:
+        item = {"nombre": p["nombre"], "precio": p["precio"], "sku": p.get("sku") or "S/N"}
+        if campos_url:
+            item.update({"url_link": p["url_web"], "url_foto": p["url_imagen"]})
+        base.append(item)
+    descripciones = [p.get("descripcion") for p in productos]
+
+    textos = [recortar_descripcion(d, terminos_consulta, MAX_TOKENS_DESCRIPCION) for d in descripciones]
+    texto = _armar(base, textos)
+    info = {"tokens_sin_recorte": contar_tokens(texto)}
+    disponible = presupuesto - tokens_fijos
+    n = len(base)
+    if info["tokens_sin_recorte"] > disponible:
+        # Sin descripciones primero; si ni así cabe, salen productos del final (queda al menos uno)
+        while n > 1 and contar_tokens(serializar(base[:n])) > disponible:
+            n -= 1
+        restante = disponible - contar_tokens(serializar(base[:n]))
+        for _ in range(3):  # el conteo por partes no es exacto: se ajusta con el total real
+            textos = _repartir(descripciones[:n], terminos_consulta, restante)
+            texto = _armar(base[:n], textos)
+            exceso = contar_tokens(texto) - disponible
+            if exceso <= 0:
+                break
+            restante -= exceso
+        else:
+            textos, texto = [], serializar(base[:n])
+    info.update({"tokens": contar_tokens(texto), "productos": n, "con_descripcion": sum(1 for t in textos if t)})
+    return texto, info
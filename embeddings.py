@@ -0,0 +1,135 @@
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# --- BACKEND DE EMBEDDINGS CON CARGA DIFERIDA ---
+# Importar sentence_transformers (y torch) y cargar el modelo toma segundos.
+# ModeloEmbeddings lo hace en un hilo de fondo: la página se pinta de inmediato
+# y solo quien llama a encode() espera (los saludos nunca lo hacen).
+#
+# Backends (mismo contrato: float32, (384,) por texto o (n, 384) por lista):
+#   torch     : SentenceTransformer normal
+#   int8      : torch con capas Linear cuantizadas dinámicamente a int8 (CPU)
+#   onnx      : ONNX Runtime (sentence-transformers >= 3.2 + optimum[onnxruntime])
+#   onnx-int8 : ONNX Runtime con los pesos int8 publicados en el repo del modelo
+
+MODELO = "all-MiniLM-L6-v2"
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+ARCHIVO_ONNX_INT8 = os.getenv("EMBEDDINGS_ONNX_ARCHIVO", "onnx/model_quint8_avx2.onnx")
+
+
+def _cargar_sentence_transformer(nombre, backend):
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(nombre)
+    if backend == "int8":
+        import torch
+
+        modelo = SentenceTransformer(nombre, device="cpu")
+        return torch.quantization.quantize_dynamic(modelo, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "onnx":
+        return SentenceTransformer(nombre, backend="onnx")
+    if backend == "onnx-int8":
+        return SentenceTransformer(nombre, backend="onnx", model_kwargs={"file_name": ARCHIVO_ONNX_INT8})
+    raise ValueError(f"Backend de embeddings desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+
+
+class ModeloEmbeddings:
+    """Envoltura con la interfaz `encode` de SentenceTransformer y carga en segundo plano."""
+
+    def __init__(self, backend="torch", nombre=MODELO, timeout=120):
+        self.backend = backend
+        self.nombre = nombre
+        self.timeout = timeout
+        self.tiempo_carga = None
+        self.tiempos_encode = deque(maxlen=1000)
+        self._modelo = None
+        self._error = None
+        self._listo = threading.Event()
+        self._hilo = None
+        self._candado = threading.Lock()
+
+    def calentar(self):
+        """Arranca la carga en un hilo de fondo (idempotente)."""
+        with self._candado:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._cargar, name="carga-embeddings", daemon=True)
+                self._hilo.start()
+        return self
+
+    def _cargar(self):
+        inicio = time.perf_counter()
+        try:
+            modelo = _cargar_sentence_transformer(self.nombre, self.backend)
+            modelo.encode("calentamiento")  # primera inferencia (inicializa kernels / sesión ONNX)
+            self._modelo = modelo
+        except Exception as e:
+            self._error = e
+        finally:
+            self.tiempo_carga = time.perf_counter() - inicio
+            self._listo.set()
+
+    def listo(self):
+        return self._listo.is_set() and self._error is None
+
+    def encode(self, textos, **kwargs):
+        self.calentar()
+        if not self._listo.wait(self.timeout):
+            raise TimeoutError(f"El modelo de embeddings no cargó en {self.timeout}s")
+        if self._error is not None:
+            raise RuntimeError(f"No se pudo cargar el modelo de embeddings ({self.backend}): {self._error}")
+        inicio = time.perf_counter()
+        vectores = self._modelo.encode(textos, convert_to_numpy=True, **kwargs)
+        self.tiempos_encode.append(time.perf_counter() - inicio)
+        return np.asarray(vectores, dtype=np.float32)
+
+    def estadisticas(self):
+        tiempos = list(self.tiempos_encode)
+        return {
+            "backend": self.backend,
+            "listo": self.listo(),
+            "tiempo_carga_s": self.tiempo_carga,
+            "encodes": len(tiempos),
+            "encode_p50_ms": statistics.median(tiempos) * 1000 if tiempos else None,
+            "encode_promedio_ms": statistics.fmean(tiempos) * 1000 if tiempos else None,
+        }
+
+
+def crear_modelo(backend="torch"):
+    """ModeloEmbeddings del backend indicado; "falso" da el doble determinista de fakes.py."""
+    if backend == "falso":
+        import fakes
+
+        return fakes.ModeloEmbeddingsFalso()
+    return ModeloEmbeddings(backend=backend)
+
+
+# --- COMPARATIVA DE BACKENDS ---
+# python embeddings.py torch int8 onnx onnx-int8
+if __name__ == "__main__":
+    import sys
+
+    consultas = ["PLC", "sensor inductivo", "fuente 24v", "contactor 3 polos 220v", "cable de control calibre 18",
+                 "variador de frecuencia 2hp", "relevador 24vdc", "botón paro de emergencia"]
+    referencia = nombre_referencia = None
+    for backend in sys.argv[1:] or ["torch"]:
+        modelo = ModeloEmbeddings(backend=backend).calentar()
+        try:
+            vectores = np.stack([modelo.encode(c) for _ in range(5) for c in consultas][-len(consultas):])
+        except Exception as e:
+            print(f"{backend:10s} no disponible: {e}")
+            continue
+        e = modelo.estadisticas()
+        linea = f"{backend:10s} arranque {e['tiempo_carga_s']:.2f}s · encode p50 {e['encode_p50_ms']:.2f} ms"
+        if referencia is None:
+            referencia, nombre_referencia = vectores, backend
+        else:
+            a = referencia / np.linalg.norm(referencia, axis=1, keepdims=True)
+            b = vectores / np.linalg.norm(vectores, axis=1, keepdims=True)
+            linea += f" · coseno mínimo vs {nombre_referencia}: {float((a * b).sum(axis=1).min()):.4f}"
+        print(linea)
@@ -0,0 +1,161 @@
+"""
+Recursos estáticos de la interfaz: CSS minificado, logo, avatares y el
+subconjunto de Inter se publican en ./static con el hash del contenido en el
+nombre (estilos.3f2a9c1b7d4e.css) y la app los referencia por
+app/static/... (server.enableStaticServing en .streamlit/config.toml). Cada
+rerun envía solo un <link> y URLs, no ~9 KB de CSS + ~13 KB de logo en base64;
+y el avatar ya no se pide a un CDN externo (ni la fuente, si hay una en fuentes/).
+
+    python estaticos.py          # construye y muestra el manifiesto (la app también lo hace al arrancar)
+
+Fuente: coloque Inter (.ttf/.otf/.woff2, idealmente la variable) en fuentes/.
+Con fontTools instalado se recorta a latín + signos del español y se guarda en
+woff2; sin fontTools se publica el .woff2 tal cual. Sin fuente, el CSS sigue
+importando Inter de Google Fonts.
+
+Las versiones que ya no están en el manifiesto se borran tras ESTATICOS_GRACIA_HORAS
+(24 por defecto) de haber sido reemplazadas: durante un despliegue escalonado las
+réplicas viejas siguen enlazando la hoja y el logo anteriores.
+
+Los nombres con hash nunca cambian de contenido: detrás de un proxy conviene
+servirlos como inmutables (Streamlit solo manda ETag/Last-Modified), p. ej. nginx:
+
+    location ~ ^/app/static/.+\\.[0-9a-f]{12}\\.\\w+$ {
+        proxy_pass http://127.0.0.1:8501;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+import style
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_ESTATICO = os.path.join(RAIZ, "static")  # Streamlit sirve ./static junto al script principal
+PREFIJO_URL = "app/static/"
+MANIFIESTO = "manifest.json"
+RETIRADOS = "retirados.json"  # archivo con hash -> cuándo dejó de estar en el manifiesto
+GRACIA_SEGUNDOS = float(os.getenv("ESTATICOS_GRACIA_HORAS", "24")) * 3600
+DIRECTORIO_FUENTES = os.path.join(RAIZ, "fuentes")
+# Latín básico + Latin-1 (acentos, ñ, ¿¡), comillas y guiones tipográficos, €, ™
+UNICODES_INTER = "U+0000-00FF,U+2013-2014,U+2018-201E,U+2022,U+2026,U+20AC,U+2122"
+_CON_HASH = re.compile(r"\.[0-9a-f]{12}\.\w+$")
+
+
+def _escribir_atomico(ruta, datos):
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(datos)
+    os.replace(temporal, ruta)  # atómico: otra réplica nunca lee un archivo a medias
+
+
+def _publicar(nombre, datos, extension, directorio):
+    """Escribe `nombre.<hash>.<ext>` si no existe y devuelve el nombre de archivo."""
+    archivo = f"{nombre}.{hashlib.sha256(datos).hexdigest()[:12]}.{extension}"
+    ruta = os.path.join(directorio, archivo)
+    if not os.path.exists(ruta):
+        _escribir_atomico(ruta, datos)
+    return archivo
+
+
+def _retirar(directorio, vigentes, gracia=GRACIA_SEGUNDOS):
+    """
+    Borra las versiones con hash que llevan más de `gracia` segundos fuera del
+    manifiesto; las recién reemplazadas quedan anotadas en RETIRADOS hasta entonces.
+    """
+    ruta = os.path.join(directorio, RETIRADOS)
+    try:
+        with open(ruta) as f:
+            retirados = json.load(f)
+    except (OSError, ValueError):
+        retirados = {}
+    ahora = time.time()
+    pendientes = {}
+    for archivo in os.listdir(directorio):
+        if not _CON_HASH.search(archivo) or archivo in vigentes:
+            continue
+        desde = retirados.get(archivo, ahora)
+        if ahora - desde < gracia:
+            pendientes[archivo] = desde
+            continue
+        try:
+            os.remove(os.path.join(directorio, archivo))
+        except FileNotFoundError:
+            pass  # otra réplica lo borró primero
+    _escribir_atomico(ruta, json.dumps(pendientes, indent=2).encode())
+
+
+def _fuente_inter():
+    """Bytes woff2 del subconjunto de Inter, o None si no hay fuente en fuentes/."""
+    candidatas = sorted(glob.glob(os.path.join(DIRECTORIO_FUENTES, "Inter*")))
+    if not candidatas:
+        return None
+    origen = next((c for c in candidatas if c.endswith(".woff2")), candidatas[0])
+    try:
+        from fontTools import subset
+    except ImportError:
+        if not origen.endswith(".woff2"):
+            return None  # sin fontTools no podemos convertir .ttf a woff2
+        with open(origen, "rb") as f:
+            return f.read()
+    import io
+
+    opciones = subset.Options()
+    opciones.flavor = "woff2"
+    opciones.layout_features = ["kern", "liga", "calt", "tnum"]
+    fuente = subset.load_font(origen, opciones)
+    recortador = subset.Subsetter(opciones)
+    recortador.populate(unicodes=subset.parse_unicodes(UNICODES_INTER))
+    recortador.subset(fuente)
+    salida = io.BytesIO()
+    subset.save_font(fuente, salida, opciones)
+    return salida.getvalue()
+
+
+def _leer(ruta):
+    with open(os.path.join(RAIZ, ruta), "rb") as f:
+        return f.read()
+
+
+def construir(directorio=DIRECTORIO_ESTATICO):
+    """
+    Publica los recursos y devuelve el manifiesto {nombre lógico: archivo con hash}.
+    Idempotente y barato si nada cambió; las versiones que ya no se referencian se
+    borran pasada la gracia (ver `_retirar`).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    manifiesto = {
+        "logo": _publicar("logo", _leer(style.LOGO_PATH_LOCAL), "png", directorio),
+        "avatar_usuario": _publicar("avatar-usuario", _leer(style.ICONO_USER), "svg", directorio),
+    }
+    manifiesto["avatar_bot"] = manifiesto["logo"]
+    fuente = _fuente_inter()
+    if fuente:
+        manifiesto["inter"] = _publicar("inter-latin", fuente, "woff2", directorio)
+    # La hoja vive en app/static/: la URL de la fuente es relativa a ella
+    css = style.minificar_css(style.css_premium(manifiesto.get("inter")))
+    manifiesto["css"] = _publicar("estilos", css.encode(), "css", directorio)
+
+    with open(os.path.join(directorio, MANIFIESTO), "w") as f:
+        json.dump(manifiesto, f, indent=2)
+    _retirar(directorio, set(manifiesto.values()))
+    return manifiesto
+
+
+def urls(manifiesto):
+    """Manifiesto -> URLs relativas que entiende el navegador (y st.chat_message como avatar)."""
+    return {nombre: PREFIJO_URL + archivo for nombre, archivo in manifiesto.items()}
+
+
+if __name__ == "__main__":
+    manifiesto = construir()
+    for nombre, archivo in manifiesto.items():
+        tamano = os.path.getsize(os.path.join(DIRECTORIO_ESTATICO, archivo))
+        print(f"{nombre:15s} {PREFIJO_URL + archivo}  ({tamano:,} bytes)")
+    if "inter" not in manifiesto:
+        print("Sin fuente Inter en fuentes/: el CSS la importa de Google Fonts.", file=sys.stderr)
@@ -0,0 +1,609 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+
+from indice_local import DIMENSION, IndiceLocal, texto_para_embedding
+from filtros import FiltroPrecio
+
+# --- DOBLES LOCALES DE LOS SERVICIOS EXTERNOS ---
+# Imitan la forma de las respuestas de Groq, Supabase y SentenceTransformer
+# para medir y probar sin API keys. Con SM_BACKEND=falso, `init_connections`
+# devuelve estos objetos en lugar de los clientes reales.
+
+RESPUESTA_DEMO = (
+    "Le recomiendo el siguiente sensor para su aplicación:\n\n"
+    '<div class="producto-card">\n'
+    '    <img src="https://example.com/sensor.png" class="producto-img">\n'
+    '    <div class="card-title">Sensor inductivo M12 PNP</div>\n'
+    '    <div class="sku-text">SKU: SI-M12-PNP</div>\n'
+    '    <div class="price-text">$450 MXN</div>\n'
+    '    <a href="https://example.com/sensor" target="_blank" class="btn-link">Ver Ficha Técnica</a>\n'
+    "</div>\n\n"
+    "¿Tienes alguna duda técnica sobre la conexión o voltaje?"
+)
+
+
+# Latencia relativa por modelo (el 8B instantáneo responde en una fracción del 70B)
+FACTOR_LATENCIA_MODELO = {"llama-3.1-8b-instant": 0.35}
+RPCS = ("buscar_productos", "buscar_productos_lote")
+MAX_LLAMADAS_REGISTRADAS = 1000  # la app corre con los falsos por horas: el registro guarda solo las últimas
+
+
+def _tokens(texto):
+    return re.findall(r"\S+\s*|\s+", texto)
+
+
+def _contar_tokens_prompt(messages):
+    return sum(len(_tokens(m.get("content", ""))) for m in messages)
+
+
+class _CompletionsFalsas:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def _preparar(self, messages, model, max_tokens, stream, kwargs):
+        c = self.cliente
+        c.llamadas.append({"messages": messages, "model": model, "max_tokens": max_tokens, "stream": stream, **kwargs})
+        texto = c.respuesta(messages, model) if callable(c.respuesta) else c.respuesta
+        tokens = _tokens(texto)
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        usage = SimpleNamespace(prompt_tokens=_contar_tokens_prompt(messages), completion_tokens=len(tokens))
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        factor = FACTOR_LATENCIA_MODELO.get(model, 1.0)
+        return tokens, usage, (c.latencia_primer_token * factor, c.latencia_por_token * factor)
+
+    @staticmethod
+    def _completion(tokens, model, usage):
+        mensaje = SimpleNamespace(role="assistant", content="".join(tokens))
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(message=mensaje, finish_reason="stop")], usage=usage)
+
+    @staticmethod
+    def _chunks(tokens, model, usage):
+        for token in tokens:
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(model=model, choices=[SimpleNamespace(delta=delta, finish_reason=None)], x_groq=None)
+        fin = SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")
+        yield SimpleNamespace(model=model, choices=[fin], x_groq=SimpleNamespace(usage=usage))
+
+    def create(self, messages, model, temperature=None, max_tokens=None, stream=False, **kwargs):
+        tokens, usage, (primer, por_token) = self._preparar(messages, model, max_tokens, stream, kwargs)
+        if stream:
+            return self._stream(tokens, model, usage, primer, por_token)
+        time.sleep(primer + por_token * len(tokens))
+        return self._completion(tokens, model, usage)
+
+    def _stream(self, tokens, model, usage, primer, por_token):
+        time.sleep(primer)
+        for i, chunk in enumerate(self._chunks(tokens, model, usage)):
+            if 0 < i < len(tokens):
+                time.sleep(por_token)
+            yield chunk
+
+
+class _CompletionsFalsasAsync(_CompletionsFalsas):
+    """Misma lógica que `_CompletionsFalsas` con esperas de asyncio (forma de `AsyncGroq`)."""
+
+    async def create(self, messages, model, temperature=None, max_tokens=None, stream=False, **kwargs):
+        tokens, usage, (primer, por_token) = self._preparar(messages, model, max_tokens, stream, kwargs)
+        if stream:
+            return self._stream(tokens, model, usage, primer, por_token)
+        await asyncio.sleep(primer + por_token * len(tokens))
+        return self._completion(tokens, model, usage)
+
+    async def _stream(self, tokens, model, usage, primer, por_token):
+        await asyncio.sleep(primer)
+        for i, chunk in enumerate(self._chunks(tokens, model, usage)):
+            if 0 < i < len(tokens):
+                await asyncio.sleep(por_token)
+            yield chunk
+
+
+class GroqFalso:
+    """
+    Cliente con la misma interfaz que `Groq` (chat.completions.create).
+    `respuesta` puede ser texto fijo o una función (messages, model) -> texto.
+    """
+
+    def __init__(self, respuesta=RESPUESTA_DEMO, latencia_primer_token=0.2, latencia_por_token=0.01):
+        self.respuesta = respuesta
+        self.latencia_primer_token = latencia_primer_token
+        self.latencia_por_token = latencia_por_token
+        self.llamadas = deque(maxlen=MAX_LLAMADAS_REGISTRADAS)
+        self.chat = SimpleNamespace(completions=_CompletionsFalsas(self))
+
+
+class GroqFalsoAsync(GroqFalso):
+    """Como `GroqFalso` pero con la interfaz de `AsyncGroq` (create es corrutina)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat = SimpleNamespace(completions=_CompletionsFalsasAsync(self))
+
+
+class ServidorGroqFalso:
+    """
+    Servidor HTTP local con la API de Groq (`POST /openai/v1/chat/completions`,
+    JSON o SSE con stream=true), para probar clientes reales (`Groq(base_url=...)`)
+    y el gateway: limita a `rpm` peticiones por minuto respondiendo 429 con
+    Retry-After, y `fallar_proximas(n)` fuerza 429 en las siguientes n.
+    """
+
+    def __init__(self, respuesta=None, rpm=None, latencia=0.05, host="127.0.0.1", puerto=0):
+        self.respuesta = respuesta or respuesta_llm_falsa
+        self.rpm = rpm
+        self.latencia = latencia
+        self.peticiones = 0
+        self.rechazos = 0
+        self._forzar_429 = 0
+        self._ventana = deque()
+        self._candado = threading.Lock()
+        self._servidor = ThreadingHTTPServer((host, puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self.url = f"http://{host}:{self._servidor.server_address[1]}"
+
+    def fallar_proximas(self, n):
+        with self._candado:
+            self._forzar_429 += n
+
+    def _admitir(self):
+        """None si se atiende, o los segundos de Retry-After si toca 429."""
+        with self._candado:
+            self.peticiones += 1
+            ahora = time.monotonic()
+            while self._ventana and ahora - self._ventana[0] > 60:
+                self._ventana.popleft()
+            if self._forzar_429:
+                self._forzar_429 -= 1
+            elif self.rpm is None or len(self._ventana) < self.rpm:
+                self._ventana.append(ahora)
+                return None
+            else:
+                self.rechazos += 1
+                return max(60 - (ahora - self._ventana[0]), 0.1)
+            self.rechazos += 1
+            return 0.1
+
+    def _manejador(self):
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _json(self, estado, cuerpo, encabezados=()):
+                datos = json.dumps(cuerpo).encode()
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                for nombre, valor in encabezados:
+                    self.send_header(nombre, valor)
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_POST(self):
+                peticion = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": f"ruta no soportada: {self.path}"}})
+                    return
+                espera = servidor._admitir()
+                if espera is not None:
+                    self._json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                               "code": "rate_limit_exceeded"}},
+                               [("retry-after", f"{espera:.2f}")])
+                    return
+                time.sleep(servidor.latencia)
+                messages, model = peticion["messages"], peticion["model"]
+                tokens = _tokens(servidor.respuesta(messages, model))[:peticion.get("max_tokens") or None]
+                usage = {"prompt_tokens": _contar_tokens_prompt(messages), "completion_tokens": len(tokens)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                base = {"id": f"chatcmpl-{servidor.peticiones}", "created": int(time.time()), "model": model}
+                if not peticion.get("stream"):
+                    self._json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}]})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                chunk = {**base, "object": "chat.completion.chunk"}
+                for token in tokens:
+                    evento = {**chunk, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(evento)}\n\n".encode())
+                fin = {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                       "x_groq": {"id": base["id"], "usage": usage}}
+                self.wfile.write(f"data: {json.dumps(fin)}\n\ndata: [DONE]\n\n".encode())
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Manejador
+
+    def iniciar(self):
+        threading.Thread(target=self._servidor.serve_forever, name="groq-falso", daemon=True).start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+class ServidorImagenesFalso:
+    """
+    Origen HTTP local de imágenes de producto (`GET /<nombre>.jpg|.png`) a resolución
+    completa, con ETag / If-None-Match -> 304 como el sitio de la tienda. Rutas que
+    empiezan con "falta" dan 404; `cambiar(nombre)` publica otra versión (otro ETag).
+    """
+
+    def __init__(self, tamano=(1600, 1200), latencia=0.0, host="127.0.0.1", puerto=0):
+        self.tamano = tamano
+        self.latencia = latencia
+        self.peticiones = 0
+        self.no_modificadas = 0
+        self._versiones = {}
+        self._imagenes = {}
+        self._candado = threading.Lock()
+        self._servidor = ThreadingHTTPServer((host, puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self.url = f"http://{host}:{self._servidor.server_address[1]}"
+
+    def cambiar(self, nombre):
+        with self._candado:
+            self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+
+    def _imagen(self, nombre):
+        """(bytes, etag) deterministas por nombre y versión: degradado con ruido, pesado como una foto real."""
+        from PIL import Image
+
+        with self._candado:
+            version = self._versiones.get(nombre, 0)
+            if (nombre, version) in self._imagenes:
+                return self._imagenes[nombre, version]
+        semilla = int.from_bytes(hashlib.blake2b(f"{nombre}:{version}".encode(), digest_size=4).digest(), "little")
+        ancho, alto = self.tamano
+        rng = np.random.default_rng(semilla)
+        base = np.linspace(0, 255, ancho, dtype=np.float32)[None, :, None] * rng.random(3, dtype=np.float32)
+        pixeles = np.clip(base + rng.normal(0, 40, (alto, ancho, 3)), 0, 255).astype(np.uint8)
+        salida = io.BytesIO()
+        formato = "PNG" if nombre.endswith(".png") else "JPEG"
+        Image.fromarray(pixeles).save(salida, formato, **({"quality": 90} if formato == "JPEG" else {}))
+        datos = salida.getvalue()
+        resultado = (datos, f'"{hashlib.blake2b(datos, digest_size=8).hexdigest()}"')
+        with self._candado:
+            self._imagenes[nombre, version] = resultado
+        return resultado
+
+    def _manejador(self):
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with servidor._candado:
+                    servidor.peticiones += 1
+                time.sleep(servidor.latencia)
+                nombre = self.path.lstrip("/").split("?")[0]
+                if nombre.startswith("falta"):
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                datos, etag = servidor._imagen(nombre)
+                if self.headers.get("If-None-Match") == etag:
+                    with servidor._candado:
+                        servidor.no_modificadas += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png" if nombre.endswith(".png") else "image/jpeg")
+                self.send_header("Content-Length", str(len(datos)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args):
+                pass
+
+        return Manejador
+
+    def iniciar(self):
+        threading.Thread(target=self._servidor.serve_forever, name="imagenes-falso", daemon=True).start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+RUTA_REESCRITURAS_FALSAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench", "conversaciones.json")
+_reescrituras = None
+
+
+def reescrituras_guionizadas(ruta=None):
+    """
+    {(mensaje previo, mensaje actual) normalizados: reescritura de referencia}
+    desde los turnos de bench/conversaciones.json que traen "reescritura".
+    """
+    from cache_embeddings import normalizar_consulta
+
+    global _reescrituras
+    if _reescrituras is None or ruta is not None:
+        tabla = {}
+        try:
+            with open(ruta or os.getenv("SM_REESCRITURAS_FALSAS", RUTA_REESCRITURAS_FALSAS), encoding="utf-8") as f:
+                conversaciones = json.load(f)
+        except OSError:
+            conversaciones = []
+        for conversacion in conversaciones:
+            previo = ""
+            for turno in conversacion["turnos"]:
+                if turno.get("reescritura") and previo:
+                    tabla[normalizar_consulta(previo), normalizar_consulta(turno["usuario"])] = turno["reescritura"]
+                if turno["usuario"] != previo:
+                    previo = turno["usuario"]
+        _reescrituras = tabla
+    return _reescrituras
+
+
+def respuesta_llm_falsa(messages, model):
+    """
+    Respuesta determinista según el tipo de prompt que manda la app:
+    reescritura -> la de referencia del guion (o la consulta tal cual, sin
+    pasar por el router local: así el benchmark sí distingue LLM de router) ·
+    respuesta técnica -> SKUs del inventario (o tarjetas HTML en modo llm) ·
+    cualquier otro -> saludo.
+    """
+    from cache_embeddings import normalizar_consulta
+
+    sistema = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    if "TU MISIÓN: Generar la frase de búsqueda" in sistema:
+        m = re.search(r'Contexto: "(.*?)"\. Usuario: "(.*?)"', sistema, re.DOTALL)
+        if not m:
+            return ""
+        clave = (normalizar_consulta(m.group(1)), normalizar_consulta(m.group(2)))
+        return reescrituras_guionizadas().get(clave, m.group(2))
+    if "INVENTARIO:" in sistema:
+        skus = re.findall(r'"sku":\s*"([^"]+)"', sistema)
+        if "FORMATO VISUAL OBLIGATORIO" in sistema:
+            nombres = re.findall(r'"nombre":\s*"([^"]+)"', sistema)
+            tarjetas = "".join(
+                f'<div class="producto-card"><img src="https://example.com/{sku}.png" class="producto-img">'
+                f'<div class="card-title">{nombre}</div><div class="sku-text">SKU: {sku}</div>'
+                f'<div class="price-text">$0 MXN</div><a href="https://example.com/{sku}" target="_blank" '
+                f'class="btn-link">Ver Ficha Técnica</a></div>\n'
+                for sku, nombre in zip(skus, nombres)
+            )
+            return "Estas son las opciones que mejor se ajustan a lo que busca:\n\n" + tarjetas
+        return ("Estas son las opciones que mejor se ajustan a lo que busca. "
+                f"La primera es la más adecuada para uso industrial.\n<!-- SKUS: {', '.join(skus)} -->")
+    return "¡Hola! Bienvenido a SM Automatización. ¿En qué le puedo apoyar?"
+
+
+class ModeloEmbeddingsFalso:
+    """
+    Embeddings deterministas sin torch: palabras y trigramas de caracteres
+    proyectados por hash a DIMENSION dimensiones. Textos con palabras en común
+    quedan cerca, suficiente para medir recall y latencias del pipeline.
+    """
+
+    def __init__(self, dimension=DIMENSION, latencia=0.0):
+        self.dimension = dimension
+        self.latencia = latencia
+        self.backend = "falso"
+
+    def _vector(self, texto):
+        from cache_embeddings import normalizar_consulta
+
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for palabra in re.findall(r"\w+", normalizar_consulta(texto)):
+            rasgos = [(palabra, 1.0)] + [(palabra[i:i + 3], 0.3) for i in range(max(len(palabra) - 2, 1))]
+            for rasgo, peso in rasgos:
+                h = int.from_bytes(hashlib.blake2b(rasgo.encode(), digest_size=8).digest(), "little")
+                vector[h % self.dimension] += peso if (h >> 32) & 1 else -peso
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def encode(self, textos, **kwargs):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if isinstance(textos, str):
+            return self._vector(textos)
+        return np.stack([self._vector(t) for t in textos]) if textos else np.zeros((0, self.dimension), np.float32)
+
+    def calentar(self):
+        return self
+
+    def listo(self):
+        return True
+
+    def estadisticas(self):
+        return {"backend": self.backend, "listo": True}
+
+
+class _ConsultaFalsa:
+    """Subconjunto del query builder de supabase-py que usa la app."""
+
+    def __init__(self, supabase, tabla):
+        self.supabase = supabase
+        self.tabla = tabla
+        self.columnas = None
+        self.condiciones = []
+        self.ordenes = []
+        self.rango = None
+        self.filas_upsert = None
+
+    def select(self, columnas="*"):
+        self.columnas = None if columnas == "*" else [c.strip() for c in columnas.split(",")]
+        return self
+
+    def gt(self, columna, valor):
+        self.condiciones.append(lambda f: f.get(columna) is not None and f.get(columna) > valor)
+        return self
+
+    def gte(self, columna, valor):
+        self.condiciones.append(lambda f: f.get(columna) is not None and f.get(columna) >= valor)
+        return self
+
+    def eq(self, columna, valor):
+        self.condiciones.append(lambda f: f.get(columna) == valor)
+        return self
+
+    def in_(self, columna, valores):
+        valores = set(valores)
+        self.condiciones.append(lambda f: f.get(columna) in valores)
+        return self
+
+    def order(self, columna, desc=False):
+        self.ordenes.append((columna, desc))
+        return self
+
+    def range(self, desde, hasta):
+        self.rango = (desde, hasta)
+        return self
+
+    def upsert(self, filas, on_conflict="id"):
+        self.filas_upsert = (filas, on_conflict)
+        return self
+
+    def execute(self):
+        s = self.supabase
+        time.sleep(s.latencia)
+        if self.filas_upsert is not None:
+            filas, clave = self.filas_upsert
+            s.upsert_filas(self.tabla, filas, clave)
+            return SimpleNamespace(data=filas)
+        filas = [f for f in s.tablas.get(self.tabla, []) if all(c(f) for c in self.condiciones)]
+        for columna, desc in reversed(self.ordenes):
+            filas.sort(key=lambda f: (f.get(columna) is None, f.get(columna)), reverse=desc)
+        if self.rango:
+            filas = filas[self.rango[0]:self.rango[1] + 1]
+        if self.columnas:
+            filas = [{c: f.get(c) for c in self.columnas} for f in filas]
+        return SimpleNamespace(data=[dict(f) for f in filas])
+
+
+class SupabaseFalso:
+    """
+    Cliente con `rpc('buscar_productos', ...)` y `table(...)` sobre un catálogo en
+    memoria. El RPC se resuelve con IndiceLocal, que replica la semántica SQL.
+    """
+
+    def __init__(self, productos, model, latencia=0.0):
+        self.latencia = latencia
+        self.model = model
+        self.tablas = {"productos": []}
+        self.indice = IndiceLocal(dimension=model.dimension if hasattr(model, "dimension") else DIMENSION)
+        self.llamadas_rpc = deque(maxlen=MAX_LLAMADAS_REGISTRADAS)
+        self.upsert_filas("productos", productos, "id")
+
+    def upsert_filas(self, tabla, filas, clave="id"):
+        """Como un upsert de PostgREST: las columnas que no vienen conservan su valor (incluido `embedding`)."""
+        destino = self.tablas.setdefault(tabla, [])
+        existentes = {f.get(clave): f for f in destino}
+        combinadas = []
+        for fila in filas:
+            previa = existentes.get(fila.get(clave))
+            if previa is None:
+                previa = existentes[fila.get(clave)] = {}
+                destino.append(previa)
+            previa.update(fila)
+            combinadas.append(previa)
+        if tabla != "productos":
+            return
+        faltantes = [f for f in combinadas if f.get("embedding") is None]
+        if faltantes:
+            vectores = self.model.encode([texto_para_embedding(f) for f in faltantes])
+            for fila, vector in zip(faltantes, vectores):
+                fila["embedding"] = vector.tolist()
+        self.indice.upsert(combinadas)
+
+    def table(self, tabla):
+        return _ConsultaFalsa(self, tabla)
+
+    def _buscar(self, nombre, parametros):
+        if nombre not in RPCS:
+            raise ValueError(f"RPC desconocido: {nombre}")
+        self.llamadas_rpc.append(parametros)
+        if nombre == "buscar_productos_lote":
+            resultados = self.indice.buscar_lote(parametros["query_embeddings"], parametros["match_threshold"],
+                                                 parametros["match_count"])
+            return [dict({k: v for k, v in f.items() if k != "actualizado_en"}, partida=i)
+                    for i, filas in enumerate(resultados) for f in filas]
+        filtro = FiltroPrecio(
+            precio_min=parametros.get("precio_min"), precio_max=parametros.get("precio_max"),
+            precio_objetivo=parametros.get("precio_objetivo"), orden=parametros.get("orden"),
+        )
+        filas = self.indice.buscar(parametros["query_embedding"], parametros["match_threshold"],
+                                   parametros["match_count"], filtro)
+        return [{k: v for k, v in f.items() if k != "actualizado_en"} for f in filas]
+
+    def rpc(self, nombre, parametros):
+        def ejecutar():
+            time.sleep(self.latencia)
+            return SimpleNamespace(data=self._buscar(nombre, parametros))  # `_buscar` valida el nombre
+        return SimpleNamespace(execute=ejecutar)
+
+    def transporte_async(self):
+        """Transporte httpx que atiende `POST /rest/v1/rpc/<nombre>` como PostgREST, sin red."""
+        async def manejar(peticion):
+            ruta = peticion.url.path
+            if peticion.method != "POST" or not ruta.startswith("/rest/v1/rpc/"):
+                return httpx.Response(404, json={"message": f"ruta no soportada: {ruta}"})
+            await asyncio.sleep(self.latencia)
+            try:
+                filas = self._buscar(ruta.rsplit("/", 1)[-1], json.loads(peticion.content))
+            except ValueError as e:
+                return httpx.Response(404, json={"message": str(e)})
+            return httpx.Response(200, json=filas)
+        return httpx.MockTransport(manejar)
+
+
+RUTA_CATALOGO_FALSO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench", "catalogo.json")
+
+
+def crear_clientes_falsos(ruta_catalogo=None, latencia_db=None, latencia_llm=None, latencia_token=None,
+                          latencia_embedding=None, model=None):
+    """
+    (client_db, client_ia, model_embedding) locales, con la forma de `init_connections`.
+    Las latencias por defecto salen de FALSO_LATENCIA_DB / _LLM / _TOKEN / _EMBEDDING (segundos).
+    """
+    def entorno(nombre, valor, defecto):
+        return float(os.getenv(nombre, defecto)) if valor is None else valor
+
+    if model is None:
+        model = ModeloEmbeddingsFalso(latencia=entorno("FALSO_LATENCIA_EMBEDDING", latencia_embedding, "0.005"))
+    with open(ruta_catalogo or os.getenv("SM_CATALOGO_FALSO", RUTA_CATALOGO_FALSO), encoding="utf-8") as f:
+        productos = json.load(f)
+    client_db = SupabaseFalso(productos, model, latencia=entorno("FALSO_LATENCIA_DB", latencia_db, "0.05"))
+    client_ia = GroqFalso(
+        respuesta=respuesta_llm_falsa,
+        latencia_primer_token=entorno("FALSO_LATENCIA_LLM", latencia_llm, "0.25"),
+        latencia_por_token=entorno("FALSO_LATENCIA_TOKEN", latencia_token, "0.004"),
+    )
+    return client_db, client_ia, model
+
+
+def crear_clientes_falsos_async(client_db, client_ia):
+    """
+    (http_db, groq_async) con la forma de `pipeline_async.crear_clientes_async`,
+    sobre el mismo catálogo y las mismas latencias que los clientes síncronos falsos.
+    """
+    http_db = httpx.AsyncClient(base_url="http://supabase.falso/rest/v1", transport=client_db.transporte_async())
+    groq_async = GroqFalsoAsync(respuesta=client_ia.respuesta, latencia_primer_token=client_ia.latencia_primer_token,
+                                latencia_por_token=client_ia.latencia_por_token)
+    return http_db, groq_async
@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+
+POOL_CANDIDATOS = 50  # filas más similares sobre las que se aplica el orden por precio
+
+# --- FILTRO DE PRECIO ESTRUCTURADO ---
+# Lo produce `analizar_filtro_precio` y viaja hasta el RPC `buscar_productos`
+# (ver supabase/buscar_productos.sql) o hasta el índice local, para que el
+# filtrado y el orden ocurran junto al índice y no sobre 12 filas en Python.
+
+
+@dataclass(frozen=True)
+class FiltroPrecio:
+    precio_min: float = None
+    precio_max: float = None
+    precio_objetivo: float = None
+    tolerancia: float = None  # p.ej. 0.3 = ventana de ±30% alrededor de precio_objetivo
+    orden: str = None  # 'asc', 'desc', 'cercania' o None (por similitud)
+
+    def __bool__(self):
+        return any(v is not None for v in (self.precio_min, self.precio_max, self.precio_objetivo, self.orden))
+
+    def rango(self):
+        """Rango efectivo [min, max]; el objetivo se convierte en una ventana con tolerancia."""
+        minimo, maximo = self.precio_min, self.precio_max
+        if self.precio_objetivo is not None and self.tolerancia is not None:
+            bajo = self.precio_objetivo * (1 - self.tolerancia)
+            alto = self.precio_objetivo * (1 + self.tolerancia)
+            minimo = bajo if minimo is None else max(minimo, bajo)
+            maximo = alto if maximo is None else min(maximo, alto)
+        return minimo, maximo
+
+    def a_parametros_rpc(self):
+        """Parámetros extra del RPC extendido `buscar_productos`."""
+        minimo, maximo = self.rango()
+        return {
+            "precio_min": minimo,
+            "precio_max": maximo,
+            "precio_objetivo": self.precio_objetivo,
+            "orden": self.orden,
+            "pool_count": POOL_CANDIDATOS,
+        }
+
+    def admite(self, precio):
+        minimo, maximo = self.rango()
+        if precio is None:
+            return minimo is None and maximo is None
+        return (minimo is None or precio >= minimo) and (maximo is None or precio <= maximo)
+
+    def ordenar(self, filas):
+        """Orden final; empates (y orden=None) se resuelven por similitud, como en SQL. Sin precio va al final."""
+        def clave(p):
+            precio = p.get("precio")
+            similitud = -p.get("similarity", 0.0)
+            if precio is None or self.orden not in ("asc", "desc", "cercania"):
+                return (precio is None, 0.0, similitud)
+            if self.orden == "asc":
+                return (False, precio, similitud)
+            if self.orden == "desc":
+                return (False, -precio, similitud)
+            return (False, abs(precio - (self.precio_objetivo or 0)), similitud)
+        return sorted(filas, key=clave)
@@ -0,0 +1,361 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import metricas
+
+# --- GATEWAY DEL PROCESO HACIA GROQ ---
+# Todas las llamadas `chat.completions.create` de la app pasan por aquí:
+#   1. Single-flight: peticiones idénticas (no stream) en vuelo al mismo tiempo
+#      se resuelven con UNA llamada upstream; las demás esperan su resultado.
+#   2. Cubetas de tokens por minuto (peticiones y tokens) compartidas por todas
+#      las sesiones: si no hay cupo, la llamada hace fila en vez de provocar 429.
+#   3. Reintento con backoff exponencial con jitter ante 429 / 503, respetando
+#      Retry-After cuando Groq lo manda.
+# `envolver(cliente)` / `envolver_async(cliente)` devuelven un objeto con la
+# misma forma del cliente (`.chat.completions.create`), así las llamadas no cambian.
+# `create` acepta además `despacho=Despacho(...)`: el llamador se entera de cuándo
+# salió su petición de la fila, puede abandonarla mientras espera y puede pedir
+# que no se coalesca (una cobertura idéntica al primario no debe esperar al primario).
+
+ESTADOS_REINTENTABLES = (429, 503)
+
+
+class LimiteExcedido(Exception):
+    """La fila del limitador superaría `espera_cola_max`: se falla rápido en vez de colgar el turno."""
+
+
+class PeticionAbandonada(Exception):
+    """El llamador abandonó la petición mientras hacía fila: no se mandó."""
+
+
+class Despacho:
+    """Enlace entre un llamador y su petición dentro del gateway."""
+
+    def __init__(self, coalescer=True):
+        self.coalescer = coalescer
+        self.instante = None  # time.monotonic() al salir de la fila hacia Groq
+        self.abandonada = threading.Event()
+
+    def abandonar(self):
+        self.abandonada.set()
+
+
+class CubetaTokens:
+    """
+    Cubeta que se rellena a `por_segundo` hasta `capacidad`. `reservar` nunca
+    bloquea: descuenta (puede quedar en deuda) y devuelve cuánto esperar, así
+    las reservas hacen fila en orden de llegada.
+    """
+
+    def __init__(self, capacidad, por_segundo):
+        self.capacidad = float(capacidad)
+        self.por_segundo = float(por_segundo)
+        self.nivel = self.capacidad
+        self._t = time.monotonic()
+        self._candado = threading.Lock()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.nivel = min(self.capacidad, self.nivel + (ahora - self._t) * self.por_segundo)
+        self._t = ahora
+
+    def reservar(self, n):
+        n = min(float(n), self.capacidad)
+        with self._candado:
+            self._rellenar()
+            self.nivel -= n
+            return 0.0 if self.nivel >= 0 else -self.nivel / self.por_segundo
+
+    def devolver(self, n):
+        with self._candado:
+            self._rellenar()
+            self.nivel = min(self.capacidad, self.nivel + n)
+
+
+def estimar_tokens(peticion):
+    """Cota gruesa para el limitador: ~4 caracteres por token de prompt + max_tokens."""
+    caracteres = sum(len(m.get("content") or "") for m in peticion.get("messages", ()))
+    return caracteres // 4 + (peticion.get("max_tokens") or 0)
+
+
+def _clave(peticion):
+    # el timeout de cada llamador no cambia la respuesta: no separa peticiones idénticas
+    texto = json.dumps({k: v for k, v in peticion.items() if k != "timeout"}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(texto.encode(), digest_size=16).hexdigest()
+
+
+def _estado_http(error):
+    estado = getattr(error, "status_code", None)
+    if estado is None and getattr(error, "response", None) is not None:
+        estado = getattr(error.response, "status_code", None)
+    return estado
+
+
+def _retry_after(error):
+    respuesta = getattr(error, "response", None)
+    try:
+        return float(respuesta.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class GatewayLLM:
+    def __init__(self, rpm=30, tpm=12000, rafaga=None, reintentos=4, espera_base=0.5, espera_max=8.0,
+                 espera_cola_max=20.0):
+        """`rafaga`: peticiones que pueden salir de golpe (por defecto, el minuto completo: rpm)."""
+        self.peticiones = CubetaTokens(rafaga or rpm, rpm / 60)
+        self.tokens = CubetaTokens(tpm, tpm / 60)
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.espera_cola_max = espera_cola_max
+        self._en_vuelo = {}  # clave -> concurrent.futures.Future (llamadas síncronas)
+        self._en_vuelo_async = {}  # clave -> _Vuelo (llamadas desde el event loop)
+        self._candado = threading.Lock()
+        self.llamadas = 0
+        self.coalescidas = 0
+        self.reintentos_hechos = 0
+        self.rechazadas = 0
+        self.abandonadas = 0
+        self.segundos_en_fila = 0.0
+
+    def envolver(self, cliente):
+        return SimpleNamespace(chat=SimpleNamespace(completions=_Completions(self, cliente)), cliente=cliente)
+
+    def envolver_async(self, cliente):
+        return SimpleNamespace(chat=SimpleNamespace(completions=_CompletionsAsync(self, cliente)), cliente=cliente)
+
+    # --- Limitador y reintentos (comunes a ambos caminos) ---
+
+    def _turno(self, estimado):
+        """Segundos a esperar antes de llamar; LimiteExcedido si la fila es demasiado larga."""
+        espera = max(self.peticiones.reservar(1), self.tokens.reservar(estimado))
+        if espera > self.espera_cola_max:
+            self._devolver(estimado)
+            with self._candado:
+                self.rechazadas += 1
+            raise LimiteExcedido(f"fila del limitador de {espera:.1f}s")
+        if espera > 0:
+            with self._candado:
+                self.segundos_en_fila += espera
+            metricas.registrar_duracion("fila_llm", espera)
+        return espera
+
+    def _devolver(self, estimado):
+        self.peticiones.devolver(1)
+        self.tokens.devolver(estimado)
+
+    def _abandonada(self, estimado):
+        """Quien hacía fila ya no la quiere: su cupo vuelve a la cubeta y no se llama a Groq."""
+        self._devolver(estimado)
+        with self._candado:
+            self.abandonadas += 1
+        metricas.METRICAS.incrementar("llm_abandonadas")
+        return PeticionAbandonada("abandonada en la fila del limitador")
+
+    def _espera_reintento(self, error, intento):
+        """Segundos antes del siguiente intento, o None si el error no se reintenta."""
+        if _estado_http(error) not in ESTADOS_REINTENTABLES or intento >= self.reintentos:
+            return None
+        with self._candado:
+            self.reintentos_hechos += 1
+        metricas.METRICAS.incrementar("llm_reintentos")
+        tope = min(self.espera_max, self.espera_base * 2 ** intento)
+        return max(random.uniform(0, tope), _retry_after(error) or 0.0)  # full jitter
+
+    def _ajustar(self, estimado, respuesta):
+        """Devuelve a la cubeta lo que se reservó de más según el `usage` real."""
+        usage = getattr(respuesta, "usage", None)
+        real = getattr(usage, "total_tokens", None)
+        if real is not None and estimado > real:
+            self.tokens.devolver(estimado - real)
+
+    def _contar_llamada(self):
+        with self._candado:
+            self.llamadas += 1
+
+    def _contar_coalescida(self):
+        with self._candado:
+            self.coalescidas += 1
+        metricas.METRICAS.incrementar("llm_coalescidas")
+
+    # --- Camino síncrono ---
+
+    def _llamar(self, cliente, peticion, despacho=None):
+        estimado = estimar_tokens(peticion)
+        intento = 0
+        while True:
+            espera = self._turno(estimado)
+            if despacho is None:
+                time.sleep(espera)
+            elif despacho.abandonada.wait(espera):
+                raise self._abandonada(estimado)
+            _despachar(despacho)
+            self._contar_llamada()
+            try:
+                respuesta = cliente.chat.completions.create(**peticion)
+            except Exception as e:
+                espera = self._espera_reintento(e, intento)
+                if espera is None:
+                    raise
+                intento += 1
+                time.sleep(espera)
+                continue
+            if not peticion.get("stream"):
+                self._ajustar(estimado, respuesta)
+            return respuesta
+
+    def crear(self, cliente, peticion, despacho=None):
+        if peticion.get("stream") or (despacho is not None and not despacho.coalescer):
+            return self._llamar(cliente, peticion, despacho)  # un stream no se comparte entre sesiones
+        clave = _clave(peticion)
+        with self._candado:
+            futuro = self._en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = self._en_vuelo[clave] = Future()
+        if not lider:
+            self._contar_coalescida()
+            _despachar(despacho)
+            try:
+                return futuro.result()
+            except PeticionAbandonada:
+                return self.crear(cliente, peticion, despacho)  # el líder se fue antes de salir de la fila
+        try:
+            respuesta = self._llamar(cliente, peticion, despacho)
+            futuro.set_result(respuesta)
+            return respuesta
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._candado:
+                del self._en_vuelo[clave]
+
+    # --- Camino asíncrono (AsyncGroq) ---
+
+    async def _llamar_async(self, cliente, peticion, despacho=None):
+        estimado = estimar_tokens(peticion)
+        intento = 0
+        while True:
+            try:
+                await asyncio.sleep(self._turno(estimado))
+            except asyncio.CancelledError:
+                self._abandonada(estimado)  # aquí abandonar es cancelar la tarea
+                raise
+            _despachar(despacho)
+            self._contar_llamada()
+            try:
+                respuesta = await cliente.chat.completions.create(**peticion)
+            except Exception as e:
+                espera = self._espera_reintento(e, intento)
+                if espera is None:
+                    raise
+                intento += 1
+                await asyncio.sleep(espera)
+                continue
+            if not peticion.get("stream"):
+                self._ajustar(estimado, respuesta)
+            return respuesta
+
+    async def crear_async(self, cliente, peticion, despacho=None):
+        if peticion.get("stream") or (despacho is not None and not despacho.coalescer):
+            return await self._llamar_async(cliente, peticion, despacho)
+        clave = _clave(peticion)
+        vuelo = self._en_vuelo_async.get(clave)
+        if vuelo is None:
+            # La llamada upstream es su propia tarea: cancelar a un llamador (p. ej. el
+            # primario que perdió contra la cobertura) no la cancela para los demás
+            vuelo = self._en_vuelo_async[clave] = _Vuelo(asyncio.ensure_future(self._llamar_async(cliente, peticion, despacho)))
+            vuelo.tarea.add_done_callback(lambda tarea: self._aterrizar(clave, vuelo))
+        else:
+            self._contar_coalescida()
+            _despachar(despacho)
+        vuelo.interesados += 1
+        try:
+            return await asyncio.shield(vuelo.tarea)
+        finally:
+            vuelo.interesados -= 1
+            if not vuelo.interesados and not vuelo.tarea.done():
+                self._aterrizar(clave, vuelo)
+                vuelo.tarea.cancel()  # nadie espera ya la respuesta: se abandona (o se corta) la llamada
+
+    def _aterrizar(self, clave, vuelo):
+        if self._en_vuelo_async.get(clave) is vuelo:
+            del self._en_vuelo_async[clave]
+        if vuelo.tarea.done() and not vuelo.tarea.cancelled():
+            vuelo.tarea.exception()  # marcada como leída aunque nadie más esperara
+
+    def estadisticas(self):
+        with self._candado:
+            return {
+                "llamadas_upstream": self.llamadas,
+                "coalescidas": self.coalescidas,
+                "reintentos": self.reintentos_hechos,
+                "rechazadas_por_fila": self.rechazadas,
+                "abandonadas_en_fila": self.abandonadas,
+                "segundos_en_fila": round(self.segundos_en_fila, 3),
+            }
+
+
+class _Vuelo:
+    """Llamada upstream compartida del camino asíncrono y cuántos llamadores la esperan."""
+
+    def __init__(self, tarea):
+        self.tarea = tarea
+        self.interesados = 0
+
+
+def _despachar(despacho):
+    if despacho is not None and despacho.instante is None:
+        despacho.instante = time.monotonic()
+
+
+class _Completions:
+    def __init__(self, gateway, cliente):
+        self.gateway = gateway
+        self.cliente = cliente
+
+    def create(self, despacho=None, **peticion):
+        return self.gateway.crear(self.cliente, peticion, despacho)
+
+
+class _CompletionsAsync(_Completions):
+    async def create(self, despacho=None, **peticion):
+        return await self.gateway.crear_async(self.cliente, peticion, despacho)
+
+
+if __name__ == "__main__":
+    # Demo contra el servidor HTTP falso: 40 sesiones mandan el mismo prompt y 20
+    # mandan prompts distintos; el limitador deja salir 5 de golpe y luego 10/s,
+    # y el servidor responde 429 a las primeras 3 peticiones.
+    from concurrent.futures import ThreadPoolExecutor
+
+    from groq import Groq
+
+    import fakes
+
+    servidor = fakes.ServidorGroqFalso(latencia=0.3).iniciar()
+    servidor.fallar_proximas(3)
+    gateway = GatewayLLM(rpm=600, tpm=1000000, rafaga=5, espera_base=0.2)
+    cliente = gateway.envolver(Groq(api_key="falso", base_url=servidor.url, max_retries=0))
+
+    def llamar(i):
+        contenido = "hola" if i < 40 else f"pregunta {i}"
+        r = cliente.chat.completions.create(messages=[{"role": "user", "content": contenido}],
+                                            model="llama-3.1-8b-instant", max_tokens=20)
+        return r.choices[0].message.content
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(60) as pool:
+        respuestas = list(pool.map(llamar, range(60)))
+    print(f"60 llamadas en {time.perf_counter() - inicio:.2f}s")
+    print("gateway:", gateway.estadisticas())
+    print("servidor:", {"peticiones": servidor.peticiones, "rechazos_429": servidor.rechazos})
+    servidor.detener()
@@ -0,0 +1,92 @@
+import json
+import zlib
+
+# --- HISTORIAL COMPACTO DE LA SESIÓN ---
+# Antes cada rerun repintaba `st.session_state.messages` completo, con el HTML
+# de todas las tarjetas. Aquí cada turno guarda solo el texto y referencias a
+# los productos mostrados (los datos de cada producto se guardan una vez por
+# sesión); los turnos viejos se comprimen con zlib y, si la sesión pasa de
+# `max_bytes`, se descartan los más antiguos. La UI pinta solo los últimos N.
+
+CAMPOS_TARJETA = ("id", "nombre", "sku", "precio", "url_web", "url_imagen")
+
+
+def _clave_producto(producto):
+    # mismo producto con otro precio o URL = otra entrada: cada turno conserva lo que se mostró
+    return "|".join(str(producto.get(c)) for c in ("id", "sku", "precio", "url_web", "url_imagen"))
+
+
+class Historial:
+    def __init__(self, sin_comprimir=12, max_bytes=256 * 1024):
+        self.sin_comprimir = sin_comprimir
+        self.max_bytes = max_bytes
+        self._turnos = []  # [rol, dict | bytes zlib, tamaño en bytes]
+        self._productos = {}  # clave -> datos de tarjeta
+        self._referencias = {}  # clave -> turnos que lo citan
+        self._bytes = 0
+        self.descartados = 0
+
+    def __len__(self):
+        return len(self._turnos)
+
+    def agregar(self, rol, texto, productos=None):
+        claves = []
+        for p in productos or ():
+            clave = _clave_producto(p)
+            if clave not in self._productos:
+                self._productos[clave] = {c: p.get(c) for c in CAMPOS_TARJETA}
+                self._bytes += len(json.dumps(self._productos[clave], ensure_ascii=False, default=str))
+            self._referencias[clave] = self._referencias.get(clave, 0) + 1
+            claves.append(clave)
+        datos = {"texto": texto, "productos": claves}
+        tamano = len(texto.encode()) + 16 * len(claves)
+        self._turnos.append([rol, datos, tamano])
+        self._bytes += tamano
+        self._comprimir_viejos()
+        self._recortar()
+
+    def _comprimir_viejos(self):
+        limite = len(self._turnos) - self.sin_comprimir
+        for turno in self._turnos[:max(limite, 0)]:
+            if isinstance(turno[1], dict):
+                comprimido = zlib.compress(json.dumps(turno[1], ensure_ascii=False).encode(), 6)
+                self._bytes += len(comprimido) - turno[2]
+                turno[1], turno[2] = comprimido, len(comprimido)
+
+    def _recortar(self):
+        while self._bytes > self.max_bytes and len(self._turnos) > 1:
+            _, datos, tamano = self._turnos.pop(0)
+            self._bytes -= tamano
+            self.descartados += 1
+            for clave in self._datos(datos)["productos"]:
+                self._referencias[clave] -= 1
+                if not self._referencias[clave]:
+                    del self._referencias[clave]
+                    producto = self._productos.pop(clave)
+                    self._bytes -= len(json.dumps(producto, ensure_ascii=False, default=str))
+
+    @staticmethod
+    def _datos(datos):
+        return datos if isinstance(datos, dict) else json.loads(zlib.decompress(datos))
+
+    def ultimos(self, n):
+        """Los últimos `n` turnos como {"role", "content", "productos": [datos de tarjeta]}."""
+        salida = []
+        for rol, datos, _ in self._turnos[-n:] if n else []:
+            datos = self._datos(datos)
+            salida.append({"role": rol, "content": datos["texto"],
+                           "productos": [self._productos[c] for c in datos["productos"]]})
+        return salida
+
+    def mensajes_para_contexto(self, n=8):
+        """Últimos mensajes como {"role", "content"}: la forma que espera contextualizar_consulta."""
+        return [{"role": t["role"], "content": t["content"]} for t in self.ultimos(n)]
+
+    def estadisticas(self):
+        return {
+            "turnos": len(self._turnos),
+            "comprimidos": sum(1 for t in self._turnos if not isinstance(t[1], dict)),
+            "productos": len(self._productos),
+            "bytes": self._bytes,
+            "descartados": self.descartados,
+        }
@@ -0,0 +1,319 @@
+"""
+Índice aproximado (IVF) para catálogos de 100k+ SKUs.
+
+El barrido exacto de IndiceLocal (y del RPC) multiplica la consulta contra
+todas las filas float32: 1.5 KB por producto en RAM y latencia lineal. Aquí:
+
+- k-means esférico reparte los vectores en `n_listas` listas (IVF); una consulta
+  solo recorre las `n_sondeo` listas con centroide más cercano.
+- En RAM cada vector es un código int8 (384 B, escala por dimensión) o binario
+  (signo por dimensión, 48 B, distancia Hamming).
+- Los `recalificar` mejores candidatos se vuelven a puntuar con los vectores
+  float32 exactos, que pueden vivir en disco (np.memmap): solo se leen esas filas.
+- Filtro de precio antes de puntuar; si deja pocos candidatos se sondean más listas.
+
+Mismo contrato que IndiceLocal.buscar / buscar_lote (y que el RPC `buscar_productos`).
+
+    python indice_ann.py                         # catálogo sintético de 100k, reporta memoria / latencia / recall
+    python indice_ann.py --snapshot indice.npz   # con un snapshot real de IndiceLocal
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from filtros import POOL_CANDIDATOS
+from indice_local import IndiceLocal, _a_vector, _normalizar_filas, _precios
+
+CODIFICACIONES = ("int8", "binario")
+_BLOQUE = 16384  # filas por bloque al asignar/cuantizar: acota la memoria temporal
+_BITS_POR_BYTE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def _contar_bits(bytes_):
+    """Bits encendidos por byte: np.bitwise_count (NumPy >= 2.0) o tabla de 256 entradas."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bytes_)
+    return _BITS_POR_BYTE[bytes_]
+
+
+def kmeans_esferico(matriz, k, iteraciones=10, muestra=None, semilla=0):
+    """Centroides unitarios (k, d) entrenados sobre una muestra de filas normalizadas."""
+    rng = np.random.default_rng(semilla)
+    n = len(matriz)
+    datos = np.asarray(matriz[np.sort(rng.choice(n, size=min(n, muestra or k * 64), replace=False))], dtype=np.float32)
+    centroides = datos[rng.choice(len(datos), size=k, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = np.argmax(datos @ centroides.T, axis=1)
+        orden = np.argsort(asignacion, kind="stable")
+        conteos = np.bincount(asignacion, minlength=k)
+        sumas = np.zeros_like(centroides)
+        llenos = conteos > 0
+        inicios = np.concatenate([[0], np.cumsum(conteos)[:-1]])[llenos]
+        sumas[llenos] = np.add.reduceat(datos[orden], inicios, axis=0)
+        sumas[~llenos] = datos[rng.choice(len(datos), size=int((~llenos).sum()))]  # listas vacías: reubicar
+        centroides = _normalizar_filas(sumas)
+    return centroides
+
+
+def _asignar(matriz, centroides):
+    return np.concatenate([np.argmax(np.asarray(matriz[i:i + _BLOQUE]) @ centroides.T, axis=1)
+                           for i in range(0, len(matriz), _BLOQUE)]) if len(matriz) else np.zeros(0, np.int64)
+
+
+def guardar_exactos(matriz, ruta):
+    """Escribe los vectores float32 a disco y devuelve un memmap de solo lectura (para recalificar)."""
+    salida = np.lib.format.open_memmap(ruta, mode="w+", dtype=np.float32, shape=matriz.shape)
+    for i in range(0, len(matriz), _BLOQUE):
+        salida[i:i + _BLOQUE] = matriz[i:i + _BLOQUE]
+    salida.flush()
+    del salida
+    return np.load(ruta, mmap_mode="r")
+
+
+class IndiceANN:
+    def __init__(self, codificacion="int8", n_listas=None, n_sondeo=16, recalificar=100, semilla=0):
+        if codificacion not in CODIFICACIONES:
+            raise ValueError(f"Codificación desconocida: {codificacion} (opciones: {', '.join(CODIFICACIONES)})")
+        self.codificacion = codificacion
+        self.n_listas = n_listas
+        self.n_sondeo = n_sondeo
+        self.recalificar = recalificar
+        self.semilla = semilla
+        self.productos = []
+        self.version = None  # versión de IndiceLocal de la que se construyó
+        self.segundos_construccion = None
+        self._vista = None
+
+    def __len__(self):
+        return len(self.productos)
+
+    # --- CONSTRUCCIÓN ---
+
+    def construir(self, matriz, productos, exactos=None, centroides=None, version=None):
+        """
+        `matriz`: vectores normalizados (n, d). `exactos`: de donde se recalifica (por
+        defecto `matriz`; puede ser un memmap). `centroides` de una construcción anterior
+        evitan reentrenar k-means cuando solo cambiaron algunas filas.
+        """
+        inicio = time.perf_counter()
+        n = len(matriz)
+        k = max(1, min(self.n_listas or int(np.sqrt(n)), n))
+        # Los centroides previos sirven mientras el catálogo no cambie de escala (~sqrt(n) listas)
+        if centroides is not None and centroides.shape[1] == matriz.shape[1] and k / 2 <= len(centroides) <= min(2 * k, n):
+            k = len(centroides)
+        else:
+            centroides = kmeans_esferico(matriz, k, semilla=self.semilla) if n else np.zeros((0, matriz.shape[1]), np.float32)
+        asignacion = _asignar(matriz, centroides)
+        orden = np.argsort(asignacion, kind="stable").astype(np.int32)
+        inicios = np.concatenate([[0], np.cumsum(np.bincount(asignacion, minlength=k))]).astype(np.int64)
+
+        if self.codificacion == "int8":
+            escala = np.max(np.abs(matriz), axis=0) / 127 if n else np.ones(matriz.shape[1], np.float32)
+            escala[escala == 0] = 1.0
+            codigos = np.empty(matriz.shape, dtype=np.int8)
+        else:
+            escala = None
+            codigos = np.empty((n, (matriz.shape[1] + 7) // 8), dtype=np.uint8)
+        for i in range(0, n, _BLOQUE):
+            filas = np.asarray(matriz[orden[i:i + _BLOQUE]])
+            if escala is not None:
+                codigos[i:i + _BLOQUE] = np.clip(np.rint(filas / escala), -127, 127)
+            else:
+                codigos[i:i + _BLOQUE] = np.packbits(filas > 0, axis=1)
+
+        self.productos = productos
+        self.version = version
+        # Intercambio atómico, como en IndiceLocal: las búsquedas en curso ven la versión anterior
+        self._vista = {
+            "centroides": centroides.astype(np.float32), "inicios": inicios, "orden": orden, "codigos": codigos,
+            "escala": None if escala is None else escala.astype(np.float32),
+            "precios": _precios(productos)[orden], "exactos": matriz if exactos is None else exactos,
+            "productos": productos,
+        }
+        self.segundos_construccion = time.perf_counter() - inicio
+        return self
+
+    @property
+    def centroides(self):
+        return None if self._vista is None else self._vista["centroides"]
+
+    @classmethod
+    def desde_indice(cls, indice, centroides=None, **opciones):
+        """Índice derivado de un IndiceLocal: recalifica contra su matriz (sin copiarla)."""
+        matriz, productos, _ = indice._vista
+        return cls(**opciones).construir(matriz, productos, centroides=centroides, version=indice.version)
+
+    @classmethod
+    def desde_snapshot(cls, ruta, ruta_exactos=None, **opciones):
+        """
+        Desde un snapshot .npz de IndiceLocal. Con `ruta_exactos` los float32 quedan en
+        disco (memmap) y en RAM solo códigos, listas y precios.
+        """
+        with np.load(ruta, allow_pickle=False) as datos:
+            matriz = _normalizar_filas(datos["embeddings"].astype(np.float32))
+            productos = json.loads(str(datos["metadatos"]))
+        exactos = guardar_exactos(matriz, ruta_exactos) if ruta_exactos else None
+        indice = cls(**opciones).construir(matriz, productos, exactos)
+        del matriz  # con memmap, la copia en RAM se libera aquí
+        return indice
+
+    # --- BÚSQUEDA ---
+
+    def _candidatos(self, vista, similitud_listas, n_sondeo, filtro, necesarios):
+        """Posiciones (en orden IVF) de las listas sondeadas que pasan el filtro de precio."""
+        k = len(vista["centroides"])
+        minimo, maximo = filtro.rango() if filtro else (None, None)
+        while True:
+            n_sondeo = min(n_sondeo, k)
+            listas = np.argpartition(-similitud_listas, n_sondeo - 1)[:n_sondeo] if n_sondeo < k else np.arange(k)
+            inicios, fines = vista["inicios"][listas], vista["inicios"][listas + 1]
+            tamanos = fines - inicios
+            # Rangos [inicio, fin) concatenados sin bucle de Python
+            posiciones = np.repeat(inicios - np.concatenate([[0], np.cumsum(tamanos)[:-1]]), tamanos) + np.arange(tamanos.sum())
+            if minimo is not None or maximo is not None:
+                precios = vista["precios"][posiciones]
+                validos = np.ones(len(posiciones), dtype=bool)
+                if minimo is not None:
+                    validos &= precios >= minimo
+                if maximo is not None:
+                    validos &= precios <= maximo
+                posiciones = posiciones[validos]
+            # Un filtro estricto deja pocas filas en las listas cercanas: se amplía el sondeo
+            if len(posiciones) >= necesarios or n_sondeo >= k:
+                return posiciones
+            n_sondeo *= 2
+
+    def _puntuar(self, vista, q, posiciones):
+        codigos = vista["codigos"][posiciones]
+        if vista["escala"] is not None:
+            return codigos.astype(np.float32) @ (q * vista["escala"])
+        bits_q = np.packbits(q > 0)
+        return -_contar_bits(codigos ^ bits_q).sum(axis=1, dtype=np.int32)  # menos bits distintos = más similar
+
+    def buscar_lote(self, query_embeddings, match_threshold=0.25, match_count=3, filtro=None, n_sondeo=None):
+        vista = self._vista
+        if vista is None or not self.productos or match_count <= 0 or not len(query_embeddings):
+            return [[] for _ in query_embeddings]
+        consultas = _normalizar_filas(np.stack([_a_vector(q) for q in query_embeddings]))
+        similitud_listas = consultas @ vista["centroides"].T
+        limite = max(POOL_CANDIDATOS, match_count) if filtro and filtro.orden else match_count
+        recalificar = max(self.recalificar, limite)
+        resultados = []
+        for q, sims in zip(consultas, similitud_listas):
+            posiciones = self._candidatos(vista, sims, n_sondeo or self.n_sondeo, filtro, recalificar)
+            if len(posiciones) > recalificar:
+                aproximadas = self._puntuar(vista, q, posiciones)
+                posiciones = posiciones[np.argpartition(-aproximadas, recalificar - 1)[:recalificar]]
+            ids = np.sort(vista["orden"][posiciones])  # orden ascendente: lecturas secuenciales en el memmap
+            exactas = np.asarray(vista["exactos"][ids], dtype=np.float32) @ q
+            productos = [vista["productos"][i] for i in ids]
+            # El precio ya se filtró; IndiceLocal aplica umbral, top y orden por precio igual que el RPC
+            resultados.append(IndiceLocal._seleccionar(exactas, exactas >= match_threshold, limite, match_count,
+                                                       productos, filtro))
+        return resultados
+
+    def buscar(self, query_embedding, match_threshold=0.25, match_count=3, filtro=None):
+        return self.buscar_lote([query_embedding], match_threshold, match_count, filtro)[0]
+
+    def memoria(self):
+        """Bytes en RAM por vector (códigos + lista IVF + precio) y si los exactos están en disco."""
+        vista = self._vista
+        n = max(len(self.productos), 1)
+        ram = vista["codigos"].nbytes + vista["orden"].nbytes + vista["precios"].nbytes
+        en_disco = isinstance(vista["exactos"], np.memmap)
+        return {
+            "codificacion": self.codificacion,
+            "listas": len(vista["centroides"]),
+            "bytes_por_vector": ram / n + (0 if en_disco else vista["exactos"].shape[1] * 4),
+            "bytes_codigo": vista["codigos"].shape[1],
+            "centroides_bytes": vista["centroides"].nbytes,
+            "exactos_en_disco": en_disco,
+        }
+
+
+# --- BENCHMARK: memoria / latencia / recall contra el barrido exacto ---
+
+def _catalogo_sintetico(n, dimension=384, familias=None, semilla=0):
+    """Vectores agrupados en familias (como un catálogo real: variantes de un mismo producto)."""
+    rng = np.random.default_rng(semilla)
+    familias = familias or max(n // 50, 1)
+    centros = rng.standard_normal((familias, dimension)).astype(np.float32)
+    matriz = np.empty((n, dimension), dtype=np.float32)
+    for i in range(0, n, _BLOQUE):
+        m = min(_BLOQUE, n - i)
+        matriz[i:i + m] = centros[rng.integers(0, familias, m)] + rng.standard_normal((m, dimension)).astype(np.float32) * 1.0
+    productos = [{"id": i, "precio": float(p)} for i, p in enumerate(np.round(rng.lognormal(7, 1, n), 2))]
+    return _normalizar_filas(matriz), productos
+
+
+def _medir(buscar, consultas, exactos, k):
+    tiempos, aciertos = [], 0
+    for q, esperados in zip(consultas, exactos):
+        inicio = time.perf_counter()
+        filas = buscar(q)
+        tiempos.append(time.perf_counter() - inicio)
+        aciertos += len({f["id"] for f in filas} & esperados)
+    tiempos = np.array(tiempos) * 1000
+    return {"p50_ms": float(np.percentile(tiempos, 50)), "p95_ms": float(np.percentile(tiempos, 95)),
+            "recall": aciertos / max(sum(len(e) for e in exactos), 1)}
+
+
+def main(argv=None):
+    import argparse
+    import tempfile
+
+    from filtros import FiltroPrecio
+
+    parser = argparse.ArgumentParser(description="Índice IVF int8/binario vs barrido exacto")
+    parser.add_argument("--snapshot", help="snapshot .npz de IndiceLocal (por defecto, catálogo sintético)")
+    parser.add_argument("--n", type=int, default=100_000, help="productos del catálogo sintético")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10, help="recall@k")
+    args = parser.parse_args(argv)
+
+    if args.snapshot:
+        with np.load(args.snapshot, allow_pickle=False) as datos:
+            matriz = _normalizar_filas(datos["embeddings"].astype(np.float32))
+            productos = json.loads(str(datos["metadatos"]))
+    else:
+        matriz, productos = _catalogo_sintetico(args.n)
+    rng = np.random.default_rng(1)
+    # Consultas: productos del catálogo con ruido (como una descripción parecida, no idéntica)
+    consultas = matriz[rng.integers(0, len(matriz), args.consultas)]
+    consultas = _normalizar_filas(consultas + rng.standard_normal(consultas.shape).astype(np.float32) * 0.03)
+    filtro = FiltroPrecio(precio_max=float(np.median([p.get("precio") or 0 for p in productos])) / 2)
+
+    exacto = IndiceLocal()
+    exacto.matriz, exacto.productos = matriz, productos
+    exacto._vista = (matriz, productos, _precios(productos))
+    esperados = [{f["id"] for f in exacto.buscar(q, -1, args.k)} for q in consultas]
+    esperados_filtro = [{f["id"] for f in exacto.buscar(q, -1, args.k, filtro)} for q in consultas]
+
+    print(f"{len(matriz):,} vectores de {matriz.shape[1]} dim · {args.consultas} consultas · recall@{args.k}")
+    print(f"{'modo':34s} {'B/vector':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'recall':>7s} {'p50 filtro':>11s} {'recall filtro':>14s}")
+
+    def linea(nombre, bytes_vector, buscar):
+        libre = _medir(lambda q: buscar(q, None), consultas, esperados, args.k)
+        filtrado = _medir(lambda q: buscar(q, filtro), consultas, esperados_filtro, args.k)
+        print(f"{nombre:34s} {bytes_vector:9.0f} {libre['p50_ms']:8.2f} {libre['p95_ms']:8.2f} {libre['recall']:7.3f} "
+              f"{filtrado['p50_ms']:11.2f} {filtrado['recall']:14.3f}")
+
+    linea("exacto float32 (IndiceLocal)", matriz.shape[1] * 4 + 8, lambda q, f: exacto.buscar(q, -1, args.k, f))
+    with tempfile.TemporaryDirectory() as directorio:
+        exactos_disco = guardar_exactos(matriz, os.path.join(directorio, "exactos.npy"))
+        for codificacion in CODIFICACIONES:
+            centroides = None
+            for n_sondeo in (4, 8, 16, 32, 64):
+                indice = IndiceANN(codificacion, n_sondeo=n_sondeo)
+                indice.construir(matriz, productos, exactos_disco, centroides)
+                centroides = indice.centroides  # mismas listas para todos los n_sondeo
+                memoria = indice.memoria()
+                linea(f"IVF {codificacion} + float32 en disco, sondeo {n_sondeo:2d}", memoria["bytes_por_vector"],
+                      lambda q, f: indice.buscar(q, -1, args.k, f))
+            print(f"  ({memoria['listas']} listas, construcción {indice.segundos_construccion:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import bisect
+import re
+from collections import defaultdict
+
+from indice_local import id_producto
+
+# --- ÍNDICE LÉXICO DE SKU / NÚMEROS DE PARTE ---
+# La similitud vectorial es mala para códigos alfanuméricos ("6ES7 214-1AG40").
+# Este índice resuelve códigos por coincidencia exacta, por prefijo y, para
+# códigos mal escritos, por trigramas. Se construye con `sku` y `nombre`.
+
+UMBRAL_CONFIANZA = 0.9  # a partir de aquí se salta reescritura y embedding
+MIN_LARGO_CODIGO = 4
+MIN_LARGO_PREFIJO = 5
+UMBRAL_TRIGRAMAS = 0.5
+PESO_NOMBRE = 0.8  # un código citado en el nombre ("S7-1200") lo comparten varios productos
+
+_PALABRA = re.compile(r"[A-Za-z0-9]+(?:[-./][A-Za-z0-9]+)*")
+# Número + unidad ("220V", "24VDC", "1HP", "5A", "220/440V"): es especificación, no número de parte
+_MAGNITUD = re.compile(
+    r"^\d+(?:[.,/]\d+)*(?:v|vac|vca|vdc|a|ma|w|kw|kva|hp|hz|rpm|mm|cm|m|mts|awg|kg|nm|psi|bar|ohms?)$",
+    re.IGNORECASE,
+)
+
+
+def normalizar_codigo(texto):
+    """'6ES7 214-1AG40' -> '6ES72141AG40'."""
+    return re.sub(r"[^A-Z0-9]", "", texto.upper())
+
+
+def _parece_codigo(token):
+    if _MAGNITUD.match(token):
+        return False
+    norm = normalizar_codigo(token)
+    return len(norm) >= MIN_LARGO_CODIGO and any(c.isdigit() for c in norm) and any(c.isalpha() for c in norm)
+
+
+def detectar_codigos(texto):
+    """
+    Tokens con pinta de número de parte (letras + dígitos), más las uniones de
+    tokens contiguos ("6ES7" + "214-1AG40"), del más largo al más corto. Las
+    magnitudes ("24VDC", "1HP") no cuentan ni se unen a un código.
+    """
+    tokens = [m.group() for m in _PALABRA.finditer(texto)]
+    candidatos = set()
+    for i, token in enumerate(tokens):
+        if _MAGNITUD.match(token):
+            continue
+        if not _parece_codigo(token) and not (any(c.isdigit() for c in token) and re.search(r"[-./]", token)):
+            continue
+        candidatos.add(normalizar_codigo(token))
+        # Une con vecinos que también tengan dígitos (códigos escritos con espacios)
+        unido = token
+        for siguiente in tokens[i + 1:i + 3]:
+            if not any(c.isdigit() for c in siguiente) or _MAGNITUD.match(siguiente):
+                break
+            unido += siguiente
+            candidatos.add(normalizar_codigo(unido))
+    return sorted((c for c in candidatos if _parece_codigo(c)), key=len, reverse=True)
+
+
+def _trigramas(codigo):
+    relleno = f"  {codigo} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+class IndiceLexico:
+    """Exacto (dict), prefijo (lista ordenada + bisect) y difuso (trigramas) sobre códigos del catálogo."""
+
+    def __init__(self, productos):
+        self.productos = {}
+        self.exacto = defaultdict(dict)  # codigo -> {id: peso}
+        trigramas = defaultdict(set)
+        for producto in productos:
+            pid = id_producto(producto)
+            self.productos[pid] = producto
+            codigos = {c: PESO_NOMBRE for c in detectar_codigos(producto.get("nombre") or "")}
+            if producto.get("sku"):
+                codigos[normalizar_codigo(str(producto["sku"]))] = 1.0
+            for codigo, peso in codigos.items():
+                if len(codigo) < MIN_LARGO_CODIGO:
+                    continue
+                self.exacto[codigo][pid] = max(peso, self.exacto[codigo].get(pid, 0.0))
+                for t in _trigramas(codigo):
+                    trigramas[t].add(codigo)
+        self.trigramas = dict(trigramas)
+        self.ordenados = sorted(self.exacto)
+
+    def __len__(self):
+        return len(self.exacto)
+
+    def _por_prefijo(self, codigo):
+        i = bisect.bisect_left(self.ordenados, codigo)
+        while i < len(self.ordenados) and self.ordenados[i].startswith(codigo):
+            yield self.ordenados[i]
+            i += 1
+
+    def _difusos(self, codigo):
+        propios = _trigramas(codigo)
+        conteo = defaultdict(int)
+        for t in propios:
+            for otro in self.trigramas.get(t, ()):
+                conteo[otro] += 1
+        for otro, comunes in conteo.items():
+            jaccard = comunes / (len(propios) + len(_trigramas(otro)) - comunes)
+            if jaccard >= UMBRAL_TRIGRAMAS:
+                yield otro, jaccard
+
+    def buscar(self, texto, limite=3):
+        """
+        Retorna [(producto, puntaje)] ordenado por puntaje:
+        exacto 1.0 · prefijo único y largo 0.95 (si no, según cuánto cubre) · difuso ≤ 0.85.
+        Los códigos que solo aparecen en el nombre pesan PESO_NOMBRE.
+        """
+        puntajes = {}
+
+        def anotar(codigo, puntaje):
+            for pid, peso in self.exacto[codigo].items():
+                if puntaje * peso > puntajes.get(pid, 0.0):
+                    puntajes[pid] = puntaje * peso
+
+        for codigo in detectar_codigos(texto):
+            if codigo in self.exacto:
+                anotar(codigo, 1.0)
+                continue
+            if len(codigo) >= MIN_LARGO_PREFIJO:
+                completos = list(self._por_prefijo(codigo))
+                for completo in completos:
+                    unico_y_largo = len(completos) == 1 and len(codigo) >= 8
+                    anotar(completo, 0.95 if unico_y_largo else 0.95 * len(codigo) / len(completo))
+            for otro, jaccard in self._difusos(codigo):
+                anotar(otro, 0.85 * jaccard)
+
+        mejores = sorted(puntajes.items(), key=lambda par: par[1], reverse=True)[:limite]
+        return [(self.productos[pid], puntaje) for pid, puntaje in mejores]
+
+
+def fusionar(lexicos, vectoriales, peso_lexico=0.5, limite=3):
+    """
+    Mezcla [(producto, puntaje_lexico)] con filas del RPC (`similarity`).
+    Puntaje final = peso·léxico + (1-peso)·similitud; se conserva `similarity`.
+    El léxico sube a los que ya trajo el RPC; uno que el RPC no trajo (sin
+    similitud que lo respalde) solo entra con puntaje >= UMBRAL_CONFIANZA.
+    """
+    combinados = {}
+    for producto in vectoriales:
+        pid = id_producto(producto)
+        combinados[pid] = [producto, 0.0, producto.get("similarity", 0.0)]
+    for producto, puntaje in lexicos:
+        pid = id_producto(producto)
+        if pid in combinados:
+            combinados[pid][1] = puntaje
+        elif puntaje >= UMBRAL_CONFIANZA:
+            combinados[pid] = [producto, puntaje, 0.0]
+    ordenados = sorted(combinados.values(), key=lambda c: peso_lexico * c[1] + (1 - peso_lexico) * c[2], reverse=True)
+    return [producto for producto, _, _ in ordenados[:limite]]
@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from filtros import POOL_CANDIDATOS
+
+# --- ÍNDICE VECTORIAL LOCAL ---
+# Espejo en memoria del catálogo de Supabase. Reproduce la semántica del RPC
+# `buscar_productos` (similitud coseno >= match_threshold, máximo match_count
+# filas ordenadas de mayor a menor similitud) con un producto matriz-vector.
+
+DIMENSION = 384  # all-MiniLM-L6-v2
+CAMPOS_PRODUCTO = ("id", "nombre", "descripcion", "sku", "precio", "url_web", "url_imagen")
+SOLAPE_SEGUNDOS = 120  # `now()` marca el inicio de la transacción: una que confirma tarde queda atrás de la marca
+
+
+def texto_para_embedding(producto):
+    """Texto del producto que se convierte en vector (misma fórmula en ingesta, fixtures y pruebas)."""
+    return f"{producto.get('nombre') or ''}. {producto.get('descripcion') or ''}".strip()
+
+
+def id_producto(producto):
+    """Clave del producto en los índices: su `id`, o el `sku` si no trae id (None cuenta como ausente)."""
+    pid = producto.get("id")
+    return producto.get("sku") if pid is None else pid
+
+
+def _a_vector(valor):
+    """Acepta listas o el texto '[0.1,0.2,...]' que devuelve PostgREST para pgvector."""
+    if isinstance(valor, str):
+        valor = json.loads(valor)
+    return np.asarray(valor, dtype=np.float32)
+
+
+def _normalizar_filas(matriz):
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def _precios(productos):
+    """Columna de precios para filtrar vectorizado (NaN si falta)."""
+    return np.array([p.get("precio") if p.get("precio") is not None else np.nan for p in productos], dtype=np.float64)
+
+
+def _restar_segundos(marca, segundos):
+    """Marca ISO de PostgREST menos `segundos` (la misma marca si no se puede leer)."""
+    try:
+        fecha = datetime.fromisoformat(str(marca).replace("Z", "+00:00"))
+    except ValueError:
+        return marca
+    return (fecha - timedelta(seconds=segundos)).isoformat()
+
+
+def leer_paginado(consulta, tamano_pagina=1000):
+    """PostgREST corta en 1000 filas: pide páginas con .range() hasta agotar. `consulta()` crea la consulta base."""
+    filas = []
+    while True:
+        pagina = consulta().range(len(filas), len(filas) + tamano_pagina - 1).execute().data or []
+        filas.extend(pagina)
+        if len(pagina) < tamano_pagina:
+            return filas
+
+
+class IndiceLocal:
+    """Índice NumPy de embeddings + metadatos, con refresco incremental."""
+
+    def __init__(self, dimension=DIMENSION, intervalo_refresco=300, intervalo_reconciliacion=900):
+        self.dimension = dimension
+        self.intervalo_refresco = intervalo_refresco
+        self.intervalo_reconciliacion = intervalo_reconciliacion
+        self.matriz = np.zeros((0, dimension), dtype=np.float32)
+        self.productos = []
+        self.posiciones = {}  # id -> fila
+        self.marca_actualizacion = None  # último `actualizado_en` visto
+        self._mtime_snapshot = None
+        self._ultimo_refresco = 0.0
+        self._ultima_reconciliacion = None
+        self._candado = threading.Lock()
+        self.version = 0  # cambia con cada upsert/eliminar (para índices derivados)
+        self._suscriptores = []  # funciones(ids) avisadas cuando cambia precio/URL o se elimina un producto
+        self._vista = (self.matriz, self.productos, _precios(self.productos))  # lectura consistente sin candado
+
+    def __len__(self):
+        return len(self.productos)
+
+    def suscribir(self, funcion):
+        self._suscriptores.append(funcion)
+
+    def _avisar(self, ids):
+        if ids:
+            for funcion in self._suscriptores:
+                funcion(ids)
+
+    # --- CARGA Y ACTUALIZACIÓN ---
+
+    def upsert(self, filas):
+        """Inserta o reemplaza productos. Cada fila trae sus metadatos y `embedding`."""
+        nuevos = {}  # id -> (meta, vector), conserva el orden de llegada
+        cambiados = set()
+        with self._candado:
+            matriz = self.matriz.copy()
+            productos = list(self.productos)
+            posiciones = dict(self.posiciones)
+            for fila in filas:
+                vector = _a_vector(fila["embedding"])
+                if vector.shape != (self.dimension,):
+                    raise ValueError(f"Embedding de {vector.shape[0]} dimensiones, se esperaban {self.dimension}")
+                meta = {k: v for k, v in fila.items() if k != "embedding"}
+                pid = id_producto(meta)
+                if pid in posiciones:
+                    i = posiciones[pid]
+                    matriz[i] = _normalizar_filas(vector[None, :])[0]
+                    if any(productos[i].get(k) != meta.get(k) for k in ("precio", "url_web", "url_imagen")):
+                        cambiados.add(pid)
+                    productos[i] = meta
+                else:
+                    nuevos[pid] = (meta, vector)
+                marca = meta.get("actualizado_en")
+                if marca and (self.marca_actualizacion is None or marca > self.marca_actualizacion):
+                    self.marca_actualizacion = marca
+            if nuevos:
+                for pid in nuevos:
+                    posiciones[pid] = len(productos)
+                    productos.append(nuevos[pid][0])
+                vectores = np.stack([vector for _, vector in nuevos.values()])
+                matriz = np.vstack([matriz, _normalizar_filas(vectores)])
+            # Intercambio atómico: las búsquedas en curso siguen viendo la versión anterior
+            self.matriz, self.productos, self.posiciones = matriz, productos, posiciones
+            self._vista = (matriz, productos, _precios(productos))
+            self.version += 1
+        self._avisar(cambiados)
+        return len(filas)
+
+    def eliminar(self, ids):
+        ids = set(ids)
+        with self._candado:
+            conservar = [i for i, p in enumerate(self.productos) if id_producto(p) not in ids]
+            self.matriz = self.matriz[conservar]
+            self.productos = [self.productos[i] for i in conservar]
+            self.posiciones = {id_producto(p): i for i, p in enumerate(self.productos)}
+            self._vista = (self.matriz, self.productos, _precios(self.productos))
+            self.version += 1
+        self._avisar(ids)
+
+    def cargar_snapshot(self, ruta):
+        """
+        Carga un snapshot .npz (`embeddings`, `metadatos` en JSON).
+        Solo relee el archivo si cambió desde la última carga.
+        """
+        if not ruta or not os.path.exists(ruta):
+            return 0
+        mtime = os.path.getmtime(ruta)
+        if mtime == self._mtime_snapshot:
+            return 0
+        with np.load(ruta, allow_pickle=False) as datos:
+            embeddings = datos["embeddings"].astype(np.float32)
+            metadatos = json.loads(str(datos["metadatos"]))
+        filas = [dict(meta, embedding=vec) for meta, vec in zip(metadatos, embeddings)]
+        self.upsert(filas)
+        self._mtime_snapshot = mtime
+        return len(filas)
+
+    def guardar_snapshot(self, ruta):
+        matriz, productos, _ = self._vista
+        temporal = ruta + ".tmp.npz"
+        np.savez(temporal, embeddings=matriz, metadatos=np.array(json.dumps(productos, ensure_ascii=False)))
+        os.replace(temporal, ruta)
+
+    def actualizar_desde_supabase(self, client_db, tabla="productos", columna_cambio="actualizado_en"):
+        """
+        Trae las filas modificadas desde la última marca vista, con SOLAPE_SEGUNDOS
+        de ventana hacia atrás; las que ya se tenían con la misma marca se ignoran.
+        """
+        marca = self.marca_actualizacion
+        def consulta():
+            q = client_db.table(tabla).select(",".join(CAMPOS_PRODUCTO + ("embedding", columna_cambio)))
+            if marca:
+                q = q.gte(columna_cambio, _restar_segundos(marca, SOLAPE_SEGUNDOS))
+            return q.order(columna_cambio).order("id")
+        filas = leer_paginado(consulta)
+        _, productos, _ = self._vista
+        posiciones = self.posiciones
+        nuevas = []
+        for fila in filas:
+            fila["actualizado_en"] = fila.pop(columna_cambio, None)
+            i = posiciones.get(id_producto(fila))
+            if i is None or i >= len(productos) or productos[i].get("actualizado_en") != fila["actualizado_en"]:
+                nuevas.append(fila)
+        return self.upsert(nuevas) if nuevas else 0
+
+    def reconciliar_con_supabase(self, client_db, tabla="productos"):
+        """
+        Quita del índice los productos que ya no están en la tabla: un borrado no
+        deja marca que el sondeo incremental pueda ver. Solo lee la columna `id`.
+        """
+        marca = self.marca_actualizacion
+        vigentes = {f["id"] for f in leer_paginado(lambda: client_db.table(tabla).select("id").order("id"))}
+        _, productos, _ = self._vista
+        # Lo que llegó después de leer los ids (otra sesión refrescando) no se toca
+        sobrantes = [p["id"] for p in productos
+                     if p.get("id") is not None and p["id"] not in vigentes
+                     and (marca is None or not p.get("actualizado_en") or p["actualizado_en"] <= marca)]
+        if sobrantes:
+            self.eliminar(sobrantes)
+        return len(sobrantes)
+
+    def refrescar(self, ruta_snapshot=None, client_db=None, forzar=False):
+        """
+        Refresco incremental con límite de frecuencia (`intervalo_refresco`); con
+        Supabase, además, reconciliación de bajas cada `intervalo_reconciliacion`.
+        """
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_refresco < self.intervalo_refresco:
+            return 0
+        self._ultimo_refresco = ahora
+        cambios = self.cargar_snapshot(ruta_snapshot)
+        if client_db is not None:
+            cambios += self.actualizar_desde_supabase(client_db)
+            if (forzar or self._ultima_reconciliacion is None
+                    or ahora - self._ultima_reconciliacion >= self.intervalo_reconciliacion):
+                self._ultima_reconciliacion = ahora
+                cambios += self.reconciliar_con_supabase(client_db)
+        return cambios
+
+    # --- BÚSQUEDA ---
+
+    def buscar(self, query_embedding, match_threshold=0.25, match_count=3, filtro=None):
+        """
+        Mismo contrato que el RPC `buscar_productos`: lista de dicts con `similarity`.
+        Con `filtro` (FiltroPrecio) replica el RPC extendido: rango de precio antes
+        del top por similitud y orden por precio dentro de POOL_CANDIDATOS filas.
+        """
+        return self.buscar_lote([query_embedding], match_threshold, match_count, filtro)[0]
+
+    def buscar_lote(self, query_embeddings, match_threshold=0.25, match_count=3, filtro=None):
+        """Varias consultas con un solo producto matriz-matriz; una lista de filas por consulta."""
+        matriz, productos, precios = self._vista
+        if not productos or match_count <= 0 or not len(query_embeddings):
+            return [[] for _ in query_embeddings]
+        consultas = np.stack([_a_vector(q) for q in query_embeddings])
+        similitudes = _normalizar_filas(consultas) @ matriz.T
+        base = np.ones(len(productos), dtype=bool)
+        limite = match_count
+        if filtro:
+            minimo, maximo = filtro.rango()
+            if minimo is not None:
+                base &= precios >= minimo
+            if maximo is not None:
+                base &= precios <= maximo
+            if filtro.orden:
+                limite = max(POOL_CANDIDATOS, match_count)
+        return [self._seleccionar(fila, base & (fila >= match_threshold), limite, match_count, productos, filtro)
+                for fila in similitudes]
+
+    @staticmethod
+    def _seleccionar(similitudes, validos, limite, match_count, productos, filtro):
+        candidatos = np.flatnonzero(validos)
+        if candidatos.size > limite:
+            mejores = np.argpartition(-similitudes[candidatos], limite - 1)[:limite]
+            candidatos = candidatos[mejores]
+        orden = candidatos[np.argsort(-similitudes[candidatos], kind="stable")]
+        filas = [dict(productos[i], similarity=float(similitudes[i])) for i in orden]
+        if filtro and filtro.orden:
+            filas = filtro.ordenar(filas)
+        return filas[:match_count]
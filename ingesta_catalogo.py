@@ -0,0 +1,208 @@
+"""
+Ingesta incremental del catálogo: lee un export de productos (CSV o JSONL con
+nombre, descripcion, sku, precio, url_web, url_imagen y opcionalmente id),
+calcula el hash del texto que se vectoriza y solo codifica las filas nuevas o
+con texto distinto, en lotes grandes y repartidas entre procesos. Escribe
+upserts masivos a Supabase o a un snapshot .npz de IndiceLocal.
+
+Un cambio de solo precio o URL se sube sin tocar el modelo.
+
+    python ingesta_catalogo.py productos.csv                       # a Supabase (SUPABASE_URL / SUPABASE_KEY)
+    python ingesta_catalogo.py productos.jsonl --snapshot indice.npz
+    python ingesta_catalogo.py productos.csv --procesos 4 --simular
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from embeddings import MODELO, crear_modelo
+from indice_local import CAMPOS_PRODUCTO, DIMENSION, IndiceLocal, leer_paginado, texto_para_embedding
+
+CAMPOS_DATOS = tuple(c for c in CAMPOS_PRODUCTO if c != "id")
+COLUMNA_HASH = "hash_embedding"
+
+
+def hash_embedding(producto, modelo=MODELO):
+    """Huella del texto vectorizado (y del modelo): si no cambia, el vector guardado sigue valiendo."""
+    return hashlib.sha256(f"{modelo}\n{texto_para_embedding(producto)}".encode()).hexdigest()[:32]
+
+
+def _limpiar(fila):
+    producto = {c: (fila.get(c) if fila.get(c) != "" else None) for c in CAMPOS_PRODUCTO if c in fila}
+    if producto.get("precio") is not None:
+        producto["precio"] = float(str(producto["precio"]).replace(",", "").replace("$", ""))
+    if producto.get("id") is not None:
+        producto["id"] = int(producto["id"])
+    else:
+        producto.pop("id", None)  # id vacío: la fila se identifica por la clave (sku), no por un None compartido
+    return producto
+
+
+def leer_export(ruta):
+    """Filas del CSV / JSONL normalizadas a CAMPOS_PRODUCTO."""
+    with open(ruta, encoding="utf-8-sig", newline="") as f:
+        if ruta.endswith((".jsonl", ".ndjson")):
+            filas = [json.loads(linea) for linea in f if linea.strip()]
+        elif ruta.endswith(".json"):
+            filas = json.load(f)
+        else:
+            filas = list(csv.DictReader(f))
+    return [_limpiar(fila) for fila in filas]
+
+
+# --- CODIFICACIÓN EN LOTES Y PROCESOS ---
+
+_modelo_trabajador = None
+
+
+def _iniciar_trabajador(backend, hilos):
+    global _modelo_trabajador
+    try:
+        import torch
+
+        torch.set_num_threads(hilos)  # sin esto cada proceso intenta usar todos los núcleos
+    except ImportError:
+        pass
+    _modelo_trabajador = crear_modelo(backend)
+
+
+def _codificar_lote(args):
+    textos, tamano_lote = args
+    return _modelo_trabajador.encode(textos, batch_size=tamano_lote)
+
+
+def codificar(textos, backend="torch", procesos=1, tamano_lote=256):
+    """Matriz (n, DIMENSION) float32; con procesos > 1 reparte bloques entre procesos."""
+    if not textos:
+        return np.zeros((0, DIMENSION), dtype=np.float32)
+    if procesos <= 1:
+        return np.asarray(crear_modelo(backend).encode(textos, batch_size=tamano_lote), dtype=np.float32)
+    bloque = max(tamano_lote, -(-len(textos) // (procesos * 4)))  # varios bloques por proceso: reparto parejo
+    bloques = [(textos[i:i + bloque], tamano_lote) for i in range(0, len(textos), bloque)]
+    hilos = max(1, (os.cpu_count() or procesos) // procesos)
+    with ProcessPoolExecutor(procesos, initializer=_iniciar_trabajador, initargs=(backend, hilos)) as pool:
+        return np.vstack([np.asarray(m, dtype=np.float32) for m in pool.map(_codificar_lote, bloques)])
+
+
+# --- PLAN INCREMENTAL ---
+
+def planear(productos, previos, clave):
+    """
+    Clasifica cada fila contra lo ya publicado (`previos`: clave -> fila con hash_embedding):
+    `codificar` (nueva o texto distinto), `datos` (solo precio/URL/sku...) o sin cambios.
+    """
+    unicos = {}
+    for p in productos:
+        if p.get(clave) is None:
+            raise ValueError(f"Fila sin '{clave}': {p.get('nombre')!r}")
+        unicos[p[clave]] = dict(p, **{COLUMNA_HASH: hash_embedding(p)})  # si se repite, gana la última
+    plan = {"codificar": [], "datos": [], "sin_cambios": 0}
+    for pid, p in unicos.items():
+        previo = previos.get(pid)
+        if previo is None or previo.get(COLUMNA_HASH) != p[COLUMNA_HASH]:
+            plan["codificar"].append(p)
+        elif any(previo.get(c) != p.get(c) for c in CAMPOS_DATOS if c in p):
+            plan["datos"].append(p)
+        else:
+            plan["sin_cambios"] += 1
+    return plan
+
+
+# --- DESTINOS ---
+
+class DestinoSupabase:
+    def __init__(self, client_db, tabla="productos", clave="id", tamano_upsert=500):
+        self.client_db = client_db
+        self.tabla = tabla
+        self.clave = clave
+        self.tamano_upsert = tamano_upsert
+
+    def previos(self):
+        columnas = ",".join(dict.fromkeys((self.clave,) + CAMPOS_PRODUCTO + (COLUMNA_HASH,)))
+        filas = leer_paginado(lambda: self.client_db.table(self.tabla).select(columnas).order(self.clave))
+        return {f[self.clave]: f for f in filas}
+
+    def escribir(self, filas_con_vector, filas_datos):
+        # Los upserts de solo datos no mandan `embedding`: PostgREST conserva el vector guardado
+        for filas in (filas_con_vector, filas_datos):
+            for i in range(0, len(filas), self.tamano_upsert):
+                self.client_db.table(self.tabla).upsert(filas[i:i + self.tamano_upsert], on_conflict=self.clave).execute()
+
+
+class DestinoSnapshot:
+    def __init__(self, ruta, clave="id"):
+        self.ruta = ruta
+        self.clave = clave
+        self.indice = IndiceLocal()
+        self.indice.cargar_snapshot(ruta)
+
+    def previos(self):
+        return {p.get(self.clave): p for p in self.indice.productos}
+
+    def escribir(self, filas_con_vector, filas_datos):
+        matriz, productos, _ = self.indice._vista
+        por_clave = {p.get(self.clave): i for i, p in enumerate(productos)}
+        filas = list(filas_con_vector)
+        for p in filas_datos:
+            previo = productos[por_clave[p[self.clave]]]
+            filas.append(dict(previo, **p, embedding=matriz[por_clave[p[self.clave]]]))
+        if filas:
+            self.indice.upsert(filas)
+        os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+        self.indice.guardar_snapshot(self.ruta)
+
+
+def ingerir(productos, destino, clave="id", backend="torch", procesos=1, tamano_lote=256, simular=False):
+    inicio = time.perf_counter()
+    plan = planear(productos, destino.previos(), clave)
+    resumen = {"leidas": len(productos), "codificadas": len(plan["codificar"]),
+               "solo_datos": len(plan["datos"]), "sin_cambios": plan["sin_cambios"], "segundos_encode": 0.0}
+    if simular:
+        return resumen
+    t = time.perf_counter()
+    vectores = codificar([texto_para_embedding(p) for p in plan["codificar"]], backend, procesos, tamano_lote)
+    resumen["segundos_encode"] = round(time.perf_counter() - t, 3)
+    if len(vectores) and vectores.shape[1] != DIMENSION:
+        raise ValueError(f"El modelo produjo {vectores.shape[1]} dimensiones, el índice usa {DIMENSION}")
+    con_vector = [dict(p, embedding=v.tolist()) for p, v in zip(plan["codificar"], vectores)]
+    destino.escribir(con_vector, plan["datos"])
+    resumen["segundos_total"] = round(time.perf_counter() - inicio, 3)
+    return resumen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingesta incremental de embeddings del catálogo")
+    parser.add_argument("export", help="CSV, JSONL o JSON con los productos")
+    parser.add_argument("--snapshot", help="escribe a este .npz de IndiceLocal en lugar de Supabase")
+    parser.add_argument("--tabla", default=os.getenv("TABLA_PRODUCTOS", "productos"))
+    parser.add_argument("--clave", choices=("id", "sku"), help="columna de conflicto (por defecto id si todas las filas lo traen)")
+    parser.add_argument("--backend", default="torch", help="torch (vectores idénticos a la app), int8, onnx, onnx-int8 o falso")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos de codificación (núcleos de CPU)")
+    parser.add_argument("--lote", type=int, default=256, help="textos por llamada a encode")
+    parser.add_argument("--simular", action="store_true", help="solo reporta qué se codificaría y subiría")
+    args = parser.parse_args(argv)
+
+    productos = leer_export(args.export)
+    clave = args.clave or ("id" if all(p.get("id") is not None for p in productos) else "sku")
+    if args.snapshot:
+        destino = DestinoSnapshot(args.snapshot, clave)
+    else:
+        from dotenv import load_dotenv
+        from supabase import create_client
+
+        load_dotenv()
+        destino = DestinoSupabase(create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")), args.tabla, clave)
+    resumen = ingerir(productos, destino, clave, args.backend, args.procesos, args.lote, args.simular)
+    print(json.dumps(resumen, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- TRAZAS POR TURNO Y MÉTRICAS POR ETAPA ---
+# Cada turno del chat abre una Traza; las etapas (reescritura, embedding,
+# búsqueda, generación...) se miden con `span(...)`. Al cerrar el turno se
+# escribe un registro JSONL (archivo rotativo) y se alimentan los percentiles
+# por etapa que se ven en el panel admin o en el endpoint estilo Prometheus.
+
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+
+
+class Traza:
+    def __init__(self, **atributos):
+        self.id = uuid.uuid4().hex[:12]
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self.atributos = dict(atributos)
+        self.etapas = defaultdict(float)  # segundos acumulados por etapa
+        self.tokens = defaultdict(lambda: {"prompt": 0, "completion": 0})
+        self.cache = defaultdict(lambda: {"aciertos": 0, "fallos": 0})
+        self.errores = []
+        self._candado = threading.Lock()
+
+    def sumar_etapa(self, nombre, segundos):
+        with self._candado:
+            self.etapas[nombre] += segundos
+
+    def registro(self):
+        with self._candado:
+            return {
+                "turno": self.id,
+                "ts": round(self.inicio, 3),
+                **self.atributos,
+                "total_ms": round((time.perf_counter() - self._t0) * 1000, 2),
+                "etapas_ms": {k: round(v * 1000, 2) for k, v in self.etapas.items()},
+                "tokens": dict(self.tokens),
+                "cache": dict(self.cache),
+                "errores": list(self.errores),
+            }
+
+
+class Metricas:
+    """Agregados del proceso: ventanas de duraciones por etapa y contadores."""
+
+    def __init__(self, ventana=5000):
+        self.duraciones = defaultdict(lambda: deque(maxlen=ventana))
+        self.contadores = defaultdict(int)
+        self.acumulados = defaultdict(lambda: [0, 0.0])  # etapa -> [n, segundos] desde el arranque (no la ventana)
+        self._candado = threading.Lock()
+        self._log = None
+
+    def configurar_archivo(self, ruta, max_bytes=10 * 1024 * 1024, respaldos=5):
+        """JSONL con rotación por tamaño (turnos.jsonl, turnos.jsonl.1, ...)."""
+        if self._log is not None or not ruta:
+            return
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        log = logging.getLogger(f"sm.metricas.{ruta}")
+        log.setLevel(logging.INFO)
+        log.propagate = False
+        manejador = logging.handlers.RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=respaldos, encoding="utf-8")
+        manejador.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(manejador)
+        self._log = log
+
+    def _observar(self, etapa, segundos):
+        self.duraciones[etapa].append(segundos)
+        acumulado = self.acumulados[etapa]
+        acumulado[0] += 1
+        acumulado[1] += segundos
+
+    def observar(self, etapa, segundos):
+        with self._candado:
+            self._observar(etapa, segundos)
+
+    def incrementar(self, contador, n=1):
+        with self._candado:
+            self.contadores[contador] += n
+
+    def cerrar_traza(self, traza):
+        registro = traza.registro()
+        with self._candado:
+            self._observar("turno", registro["total_ms"] / 1000)
+            for etapa, ms in registro["etapas_ms"].items():
+                self._observar(etapa, ms / 1000)
+            self.contadores["turnos"] += 1
+            for etapa, t in registro["tokens"].items():
+                self.contadores[f"tokens_prompt:{etapa}"] += t["prompt"]
+                self.contadores[f"tokens_completion:{etapa}"] += t["completion"]
+            for nombre, c in registro["cache"].items():
+                self.contadores[f"cache_aciertos:{nombre}"] += c["aciertos"]
+                self.contadores[f"cache_fallos:{nombre}"] += c["fallos"]
+            for error in registro["errores"]:
+                self.contadores[f"errores:{error['etapa']}"] += 1
+        if self._log is not None:
+            self._log.info(json.dumps(registro, ensure_ascii=False, default=str))
+        return registro
+
+    def resumen(self):
+        """{etapa: {n, p50_ms, p95_ms, p99_ms}}"""
+        with self._candado:
+            ventanas = {k: sorted(v) for k, v in self.duraciones.items() if v}
+        return {etapa: {"n": len(v), **{f"p{q}_ms": round(percentil(v, q) * 1000, 2) for q in (50, 95, 99)}}
+                for etapa, v in sorted(ventanas.items())}
+
+    def texto_prometheus(self):
+        """Cuantiles de la ventana; `_sum` y `_count` acumulados desde el arranque, como pide el formato."""
+        lineas = ["# TYPE sm_etapa_segundos summary"]
+        with self._candado:
+            acumulados = {etapa: tuple(a) for etapa, a in self.acumulados.items()}
+            contadores = dict(self.contadores)
+        for etapa, r in self.resumen().items():
+            for q in (50, 95, 99):
+                lineas.append(f'sm_etapa_segundos{{etapa="{etapa}",quantile="0.{q}"}} {r[f"p{q}_ms"] / 1000:.6f}')
+            n, segundos = acumulados.get(etapa, (r["n"], 0.0))
+            lineas.append(f'sm_etapa_segundos_sum{{etapa="{etapa}"}} {segundos:.6f}')
+            lineas.append(f'sm_etapa_segundos_count{{etapa="{etapa}"}} {n}')
+        familias = defaultdict(list)
+        for clave, valor in sorted(contadores.items()):
+            nombre, _, etiqueta = clave.partition(":")
+            familias[nombre].append((etiqueta, valor))
+        for nombre, series in sorted(familias.items()):
+            lineas.append(f"# TYPE sm_{nombre}_total counter")
+            for etiqueta, valor in series:
+                etiquetas = f'{{etapa="{etiqueta}"}}' if etiqueta else ""
+                lineas.append(f"sm_{nombre}_total{etiquetas} {valor}")
+        return "\n".join(lineas) + "\n"
+
+
+def percentil(ordenados, q):
+    if not ordenados:
+        return 0.0
+    i = min(len(ordenados) - 1, max(0, int(round(q / 100 * (len(ordenados) - 1)))))
+    return ordenados[i]
+
+
+METRICAS = Metricas()
+
+
+# --- API PARA INSTRUMENTAR ---
+
+def iniciar_turno(**atributos):
+    traza = Traza(**atributos)
+    _traza_actual.set(traza)
+    return traza
+
+
+def finalizar_turno(traza=None):
+    traza = traza or _traza_actual.get()
+    if traza is None:
+        return None
+    _traza_actual.set(None)
+    return METRICAS.cerrar_traza(traza)
+
+
+def traza_actual():
+    return _traza_actual.get()
+
+
+@contextmanager
+def span(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_duracion(etapa, time.perf_counter() - inicio)
+
+
+def registrar_duracion(etapa, segundos):
+    if segundos is None:
+        return
+    traza = _traza_actual.get()
+    if traza is not None:
+        traza.sumar_etapa(etapa, segundos)
+    else:
+        METRICAS.observar(etapa, segundos)
+
+
+def registrar_tokens(etapa, usage):
+    """Acepta el `usage` de Groq (prompt_tokens / completion_tokens)."""
+    traza = _traza_actual.get()
+    if traza is None or usage is None:
+        return
+    with traza._candado:
+        traza.tokens[etapa]["prompt"] += getattr(usage, "prompt_tokens", 0) or 0
+        traza.tokens[etapa]["completion"] += getattr(usage, "completion_tokens", 0) or 0
+
+
+def registrar_cache(nombre, acierto):
+    traza = _traza_actual.get()
+    if traza is None:
+        METRICAS.incrementar(f"cache_{'aciertos' if acierto else 'fallos'}:{nombre}")
+        return
+    with traza._candado:
+        traza.cache[nombre]["aciertos" if acierto else "fallos"] += 1
+
+
+def registrar_error(etapa, error):
+    traza = _traza_actual.get()
+    if traza is None:
+        METRICAS.incrementar(f"errores:{etapa}")
+        return
+    with traza._candado:
+        traza.errores.append({"etapa": etapa, "tipo": type(error).__name__, "mensaje": str(error)[:300]})
+
+
+def anotar(clave, valor):
+    traza = _traza_actual.get()
+    if traza is not None:
+        with traza._candado:
+            traza.atributos[clave] = valor
+
+
+def con_contexto(funcion):
+    """Envuelve `funcion` para que corra en otro hilo con la traza del turno actual."""
+    contexto = contextvars.copy_context()
+    return lambda *args, **kwargs: contexto.run(funcion, *args, **kwargs)
+
+
+# --- ENDPOINT ESTILO PROMETHEUS ---
+
+def iniciar_servidor_prometheus(puerto, host="127.0.0.1"):
+    """Sirve METRICAS en http://host:puerto/metrics desde un hilo daemon."""
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = METRICAS.texto_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    return servidor
@@ -0,0 +1,286 @@
+"""
+Miniaturas locales de las imágenes de producto. Cada tarjeta mostraba
+`url_imagen` directo del sitio de la tienda a resolución completa (varios MB
+por respuesta; un origen lento frena la página). Aquí cada imagen se descarga
+una vez, se convierte a WebP al tamaño de `.producto-img` y se sirve desde
+app/static/miniaturas/.
+
+- Clave: URL + ETag (o Last-Modified, o hash del contenido si el origen no manda
+  ninguno). Un sidecar <hash de la URL>.json guarda el ETag vigente; pasado
+  `revalidar_cada` se revalida con If-None-Match en segundo plano.
+- LRU en disco acotado por bytes y compartido por todos los procesos: el orden
+  es el mtime de cada miniatura (se renueva al usarla).
+- Nunca bloquea el render: si la miniatura no está, se pide en segundo plano y la
+  tarjeta usa la URL original esa vez.
+
+    python miniaturas.py     # demo contra un origen HTTP local (fakes.ServidorImagenesFalso)
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import metricas
+
+TAMANO = (320, 232)  # caja de contenido de .producto-img (~160x116 px) a densidad 2x
+CALIDAD_WEBP = 75
+MAX_BYTES_ORIGEN = 10 * 1024 * 1024
+_TOCAR_CADA = 60  # segundos: no reescribir el mtime en cada render
+
+
+def _hash(texto, n=24):
+    return hashlib.sha256(texto.encode()).hexdigest()[:n]
+
+
+def convertir_a_webp(datos, tamano=TAMANO, calidad=CALIDAD_WEBP):
+    """Bytes de imagen (JPEG, PNG, WebP, GIF...) -> WebP que cabe en `tamano`, respetando proporción y EXIF."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(datos)) as imagen:
+        imagen.draft("RGB", (tamano[0] * 2, tamano[1] * 2))  # JPEG: decodifica ya reducido (mucho más rápido)
+        imagen = ImageOps.exif_transpose(imagen)
+        transparente = imagen.mode in ("RGBA", "LA") or (imagen.mode == "P" and "transparency" in imagen.info)
+        imagen = imagen.convert("RGBA" if transparente else "RGB")
+        imagen.thumbnail(tamano, Image.LANCZOS)
+        salida = io.BytesIO()
+        imagen.save(salida, "WEBP", quality=calidad, method=4)
+    return salida.getvalue()
+
+
+class CacheMiniaturas:
+    def __init__(self, directorio, prefijo_url="app/static/miniaturas/", max_bytes=64 * 1024 * 1024,
+                 tamano=TAMANO, calidad=CALIDAD_WEBP, revalidar_cada=24 * 3600, reintentar_fallo=600,
+                 hilos=4, timeout=5.0, cliente=None):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.prefijo_url = prefijo_url
+        self.max_bytes = max_bytes
+        self.tamano = tamano
+        self.calidad = calidad
+        self.revalidar_cada = revalidar_cada
+        self.reintentar_fallo = reintentar_fallo
+        self.cliente = cliente or httpx.Client(timeout=timeout, follow_redirects=True,
+                                               limits=httpx.Limits(max_connections=hilos * 2))
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="miniaturas")
+        self._candado = threading.Lock()
+        self._meta = {}  # url -> sidecar leído (evita abrir el .json en cada render)
+        self._en_vuelo = {}  # url -> Future: una descarga por URL aunque la pidan varias sesiones
+        self._fallos = {}  # url -> momento del último fallo
+        self._tocado = {}  # archivo -> último utime
+        self._bytes = self._medir()
+        self.aciertos = self.fallos = self.descargas = self.no_modificadas = self.errores = 0
+        self.bytes_origen = self.bytes_miniaturas = 0
+
+    # --- CONSULTA (camino del render) ---
+
+    def url(self, url_origen):
+        """URL local de la miniatura si ya existe; si no, la agenda y devuelve `url_origen`."""
+        if not url_origen or not url_origen.startswith(("http://", "https://")):
+            return url_origen
+        meta = self._leer_meta(url_origen)
+        ruta = os.path.join(self.directorio, meta["archivo"]) if meta else None
+        if ruta and os.path.exists(ruta):
+            self._tocar(meta["archivo"], ruta)
+            if time.time() - meta.get("validado", 0) > self.revalidar_cada:
+                self._agendar(url_origen)
+            with self._candado:
+                self.aciertos += 1
+            metricas.registrar_cache("miniatura", True)
+            return self.prefijo_url + meta["archivo"]
+        self._agendar(url_origen)
+        with self._candado:
+            self.fallos += 1
+        metricas.registrar_cache("miniatura", False)
+        return url_origen
+
+    def precargar(self, urls):
+        """Agenda las descargas en cuanto se conocen los productos (antes de generar la respuesta)."""
+        for url_origen in urls:
+            if url_origen and url_origen.startswith(("http://", "https://")):
+                meta = self._leer_meta(url_origen)
+                if not meta or not os.path.exists(os.path.join(self.directorio, meta["archivo"])):
+                    self._agendar(url_origen)
+
+    def esperar(self, timeout=None):
+        """Espera las descargas en vuelo (demos y pruebas)."""
+        with self._candado:
+            futuros = list(self._en_vuelo.values())
+        for futuro in futuros:
+            futuro.result(timeout)
+
+    # --- DESCARGA Y CONVERSIÓN (en segundo plano) ---
+
+    def _agendar(self, url_origen):
+        with self._candado:
+            if url_origen in self._en_vuelo:
+                return
+            if time.monotonic() - self._fallos.get(url_origen, -1e9) < self.reintentar_fallo:
+                return
+            futuro = self._ejecutor.submit(self._traer, url_origen)
+            self._en_vuelo[url_origen] = futuro
+        futuro.add_done_callback(lambda _: self._terminar(url_origen))
+
+    def _terminar(self, url_origen):
+        with self._candado:
+            self._en_vuelo.pop(url_origen, None)
+
+    def _traer(self, url_origen):
+        meta = self._leer_meta(url_origen)
+        encabezados = {}
+        if meta and os.path.exists(os.path.join(self.directorio, meta["archivo"])):
+            if meta.get("etag"):
+                encabezados["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                encabezados["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with self.cliente.stream("GET", url_origen, headers=encabezados) as respuesta:
+                if respuesta.status_code == 304:
+                    self._escribir_meta(url_origen, dict(meta, validado=time.time()))
+                    with self._candado:
+                        self.no_modificadas += 1
+                    return
+                respuesta.raise_for_status()
+                datos = bytearray()
+                for bloque in respuesta.iter_bytes():
+                    datos += bloque
+                    if len(datos) > MAX_BYTES_ORIGEN:
+                        raise ValueError(f"imagen de más de {MAX_BYTES_ORIGEN // (1024 * 1024)} MB")
+                etag, last_modified = respuesta.headers.get("etag"), respuesta.headers.get("last-modified")
+            miniatura = convertir_a_webp(bytes(datos), self.tamano, self.calidad)
+        except Exception as e:
+            with self._candado:
+                self._fallos[url_origen] = time.monotonic()
+                self.errores += 1
+            metricas.registrar_error("miniatura", e)
+            return
+
+        version = etag or last_modified or hashlib.sha256(datos).hexdigest()
+        archivo = f"{_hash(url_origen + chr(10) + version, 32)}.webp"
+        self._escribir_atomico(os.path.join(self.directorio, archivo), miniatura)
+        anterior = meta.get("archivo") if meta else None
+        self._escribir_meta(url_origen, {"url": url_origen, "etag": etag, "last_modified": last_modified,
+                                         "archivo": archivo, "validado": time.time()})
+        if anterior and anterior != archivo:
+            self._borrar(anterior)
+        with self._candado:
+            self.descargas += 1
+            self.bytes_origen += len(datos)
+            self.bytes_miniaturas += len(miniatura)
+            self._bytes += len(miniatura)
+            excedido = self._bytes > self.max_bytes
+        if excedido:
+            self._recortar()
+
+    # --- ALMACÉN EN DISCO ---
+
+    def _ruta_meta(self, url_origen):
+        return os.path.join(self.directorio, f"{_hash(url_origen)}.json")
+
+    def _leer_meta(self, url_origen):
+        meta = self._meta.get(url_origen)
+        if meta is None:
+            try:
+                with open(self._ruta_meta(url_origen)) as f:
+                    meta = json.load(f)  # la pudo escribir otro proceso
+            except (OSError, ValueError):
+                return None
+            self._meta[url_origen] = meta
+        return meta
+
+    def _escribir_meta(self, url_origen, meta):
+        self._escribir_atomico(self._ruta_meta(url_origen), json.dumps(meta).encode())
+        self._meta[url_origen] = meta
+
+    @staticmethod
+    def _escribir_atomico(ruta, datos):
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+
+    def _tocar(self, archivo, ruta):
+        ahora = time.monotonic()
+        if ahora - self._tocado.get(archivo, -1e9) > _TOCAR_CADA:
+            self._tocado[archivo] = ahora
+            try:
+                os.utime(ruta)  # el mtime es el "último uso" del LRU
+            except OSError:
+                pass
+
+    def _borrar(self, archivo):
+        try:
+            tamano = os.path.getsize(os.path.join(self.directorio, archivo))
+            os.remove(os.path.join(self.directorio, archivo))
+        except OSError:
+            return
+        with self._candado:
+            self._bytes -= tamano
+
+    def _medir(self):
+        return sum(e.stat().st_size for e in os.scandir(self.directorio) if e.name.endswith(".webp"))
+
+    def _recortar(self):
+        """Borra las miniaturas menos usadas (mtime más viejo) hasta quedar en el 90% del tope."""
+        with self._candado:
+            entradas = sorted((e.stat().st_mtime, e.stat().st_size, e.name)
+                              for e in os.scandir(self.directorio) if e.name.endswith(".webp"))
+            total = sum(tamano for _, tamano, _ in entradas)  # incluye lo que escribieron otros procesos
+            for _, tamano, nombre in entradas:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except OSError:
+                    continue
+                total -= tamano
+            self._bytes = total
+        # Los sidecars huérfanos no estorban: al no existir la miniatura, la URL se vuelve a pedir
+
+    def estadisticas(self):
+        with self._candado:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+                "descargas": self.descargas,
+                "no_modificadas": self.no_modificadas,
+                "errores": self.errores,
+                "en_vuelo": len(self._en_vuelo),
+                "bytes_disco": self._bytes,
+                "bytes_origen": self.bytes_origen,
+                "bytes_miniaturas": self.bytes_miniaturas,
+            }
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from fakes import ServidorImagenesFalso
+
+    origen = ServidorImagenesFalso(latencia=0.2).iniciar()
+    urls = [f"{origen.url}/producto-{i}.jpg" for i in range(6)]
+    with tempfile.TemporaryDirectory() as directorio:
+        cache = CacheMiniaturas(directorio, max_bytes=60 * 1024, revalidar_cada=0)
+        inicio = time.perf_counter()
+        primera = [cache.url(u) for u in urls]  # render sin esperar: URLs originales
+        print(f"Primer render: {time.perf_counter() - inicio:.3f}s, {sum(u.startswith('app/') for u in primera)}/6 locales")
+        cache.esperar()
+        segunda = [cache.url(u) for u in urls]
+        print(f"Segundo render: {sum(u.startswith('app/') for u in segunda)}/6 locales")
+        cache.esperar()  # revalidar_cada=0: cada acierto revalida con If-None-Match -> 304
+        origen.cambiar("producto-0.jpg")
+        cache.url(urls[0])
+        cache.esperar()
+        print(f"Tras cambiar producto-0 en el origen: {cache.url(urls[0]) != segunda[0]} (nuevo ETag -> nueva miniatura)")
+        e = cache.estadisticas()
+        print(f"Origen: {e['bytes_origen'] / e['descargas'] / 1024:.0f} KB por imagen -> "
+              f"miniatura {e['bytes_miniaturas'] / e['descargas'] / 1024:.1f} KB")
+        print(json.dumps(e, indent=2))
+        print(f"Peticiones al origen: {origen.peticiones} ({origen.no_modificadas} respondidas con 304)")
+    origen.detener()
@@ -0,0 +1,307 @@
+import asyncio
+import contextvars
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+import metricas
+import prompts
+import streaming
+from cache_embeddings import normalizar_consulta
+from ruteo_modelos import REESCRITURA, RESPUESTA, SALUDO
+
+# --- PIPELINE ASÍNCRONO DEL TURNO ---
+# Con muchas sesiones simultáneas, el camino síncrono deja un hilo de Streamlit
+# bloqueado en cada llamada HTTP a Groq o Supabase. Aquí las mismas etapas
+# (reescritura, búsqueda, generación) son corrutinas que corren en UN event loop
+# compartido por el proceso, sobre clientes HTTP con pool de conexiones acotado.
+# El script de cada sesión solo espera el resultado; el trabajo de CPU
+# (embeddings) va a un pool pequeño de hilos.
+
+FIN = object()
+
+
+def _descartar_error(tarea):
+    if not tarea.cancelled():
+        tarea.exception()
+
+
+class BucleCompartido:
+    """Event loop en un hilo daemon al que los scripts de Streamlit mandan corrutinas."""
+
+    def __init__(self, nombre="pipeline-async"):
+        self.loop = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self.loop.run_forever, name=nombre, daemon=True)
+        self._hilo.start()
+
+    def enviar(self, corrutina):
+        """
+        Agenda `corrutina` y devuelve un concurrent.futures.Future (ver `cancelar`).
+        La tarea hereda el contexto del hilo que llama (la traza del turno en curso).
+        """
+        contexto = contextvars.copy_context()
+        resultado = Future()
+
+        def lanzar():
+            if not resultado.set_running_or_notify_cancel():
+                corrutina.close()
+                return
+            tarea = resultado.tarea = contexto.run(self.loop.create_task, corrutina)
+
+            def copiar(t):
+                if t.cancelled():
+                    resultado.cancel()
+                elif t.exception() is not None:
+                    resultado.set_exception(t.exception())
+                else:
+                    resultado.set_result(t.result())
+            tarea.add_done_callback(copiar)
+
+        self.loop.call_soon_threadsafe(lanzar)
+        return resultado
+
+    def cancelar(self, futuro):
+        """
+        Cancela la tarea detrás de un Future de `enviar`. `Future.cancel()` solo no
+        alcanza: una vez en marcha, el Future ya no se puede cancelar y la tarea sigue.
+        """
+        if futuro.cancel():
+            return  # todavía no arrancaba: `lanzar` cierra la corrutina
+        def cancelar_tarea():
+            tarea = getattr(futuro, "tarea", None)
+            if tarea is not None:
+                tarea.cancel()
+        self.loop.call_soon_threadsafe(cancelar_tarea)  # corre después de `lanzar`: la tarea ya existe
+
+    def correr(self, corrutina, timeout=None):
+        pendiente = self.enviar(corrutina)
+        try:
+            return pendiente.result(timeout)
+        except TimeoutError:
+            self.cancelar(pendiente)
+            raise
+
+    def iterar(self, generador):
+        """Consume un generador asíncrono desde un hilo síncrono (p. ej. para `renderizar_stream`)."""
+        cola = queue.Queue()
+
+        async def bombear():
+            try:
+                async for elemento in generador:
+                    cola.put(elemento)
+            except Exception as e:
+                cola.put(e)
+            finally:
+                await generador.aclose()  # cierra el stream HTTP aunque nos cancelen a la mitad
+                cola.put(FIN)
+
+        pendiente = self.enviar(bombear())
+        try:
+            while True:
+                elemento = cola.get()
+                if elemento is FIN:
+                    return
+                if isinstance(elemento, Exception):
+                    raise elemento
+                yield elemento
+        finally:
+            if not pendiente.done():
+                self.cancelar(pendiente)  # el lector abandonó: dejar de pedir tokens al LLM
+
+
+def crear_clientes_async(supabase_url, supabase_key, groq_api_key, max_conexiones=100, timeout=30.0):
+    """
+    (http_db, groq_async): un cliente httpx contra PostgREST de Supabase y un
+    `AsyncGroq`, cada uno con su pool de conexiones keep-alive acotado.
+    """
+    from groq import AsyncGroq
+
+    limites = httpx.Limits(max_connections=max_conexiones, max_keepalive_connections=max_conexiones)
+    http_db = httpx.AsyncClient(
+        base_url=f"{supabase_url.rstrip('/')}/rest/v1",
+        headers={"apikey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+        limits=limites, timeout=timeout,
+    )
+    groq_async = AsyncGroq(api_key=groq_api_key, max_retries=0,  # los reintentos los hace GatewayLLM
+                           http_client=httpx.AsyncClient(limits=limites, timeout=timeout))
+    return http_db, groq_async
+
+
+class PipelineAsync:
+    """
+    Versiones asíncronas de contextualizar_consulta, buscar_productos_vectorial,
+    generar_charla_social y generar_respuesta_tecnica.
+
+    - `vectorizar(texto)`: función síncrona de la app (caché + modelo); corre en el pool de CPU.
+    - `buscar_local(vector, n, filtro)`: opcional, reemplaza el RPC (BUSQUEDA_LOCAL=1).
+    - `reescritura_local(actual, previo)`: opcional, el router local; None si hace falta el LLM.
+    - `al_reescribir_llm(segundos)`: opcional, para llevar la latencia del LLM en el router.
+    - `ruteador`: opcional, RuteadorModelos (modelo, cobertura y respaldo por tarea).
+    """
+
+    def __init__(self, http_db, groq_async, vectorizar, buscar_local=None, reescritura_local=None,
+                 al_reescribir_llm=None, ruteador=None, tarjetas_servidor=True, match_threshold=0.25,
+                 umbral_especulacion=0.97, hilos_cpu=4, bucle=None):
+        self.http_db = http_db
+        self.groq = groq_async
+        self.ruteador = ruteador
+        self._vectorizar = vectorizar
+        self._buscar_local = buscar_local
+        self._reescritura_local = reescritura_local
+        self._al_reescribir_llm = al_reescribir_llm
+        self.tarjetas_servidor = tarjetas_servidor
+        self.match_threshold = match_threshold
+        self.umbral_especulacion = umbral_especulacion
+        self._cpu = ThreadPoolExecutor(max_workers=hilos_cpu, thread_name_prefix="pipeline-cpu")
+        self.bucle = bucle or BucleCompartido()
+
+    # --- Puente para los scripts síncronos ---
+
+    def correr(self, corrutina, timeout=None):
+        return self.bucle.correr(corrutina, timeout)
+
+    def texto_o_iterador(self, resultado):
+        """Texto tal cual, o un iterador síncrono si la corrutina devolvió un stream."""
+        return resultado if isinstance(resultado, str) else self.bucle.iterar(resultado)
+
+    # --- Etapas ---
+
+    async def _en_hilo(self, funcion, *args):
+        contexto = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._cpu, functools.partial(contexto.run, funcion, *args))
+
+    async def _completar(self, tarea, peticion):
+        if self.ruteador is not None:
+            return await self.ruteador.completar_async(tarea, peticion, self.groq)
+        return await self.groq.chat.completions.create(**peticion)
+
+    async def vectorizar(self, texto):
+        return await self._en_hilo(self._vectorizar, texto)
+
+    async def buscar_por_vector(self, vector, n_resultados=3, filtro=None):
+        """Como `buscar_por_vector` de la app: no atrapa errores."""
+        if self._buscar_local is not None:
+            filas = await self._en_hilo(self._buscar_local, vector, n_resultados, filtro)
+            if filas is not None:
+                return filas
+        parametros = {
+            'query_embedding': np.asarray(vector).tolist(),
+            'match_threshold': self.match_threshold,
+            'match_count': n_resultados
+        }
+        if filtro: parametros.update(filtro.a_parametros_rpc())
+        with metricas.span("busqueda_rpc"):
+            respuesta = await self.http_db.post("/rpc/buscar_productos", json=parametros)
+            respuesta.raise_for_status()
+        return respuesta.json()
+
+    async def buscar_productos_vectorial(self, query_usuario, n_resultados=3, filtro=None):
+        try:
+            return await self.buscar_por_vector(await self.vectorizar(query_usuario), n_resultados, filtro)
+        except Exception as e:
+            metricas.registrar_error("busqueda", e)
+            return []
+
+    async def reescritura_sin_llm(self, query_actual, historial_mensajes):
+        """La consulta si se resuelve sin Groq; None si hace falta el LLM."""
+        if len(query_actual.split()) > 12: return query_actual
+        ultimo_msg_usuario = prompts.ultimo_mensaje_usuario(historial_mensajes, query_actual)
+        if not ultimo_msg_usuario: return query_actual
+        if self._reescritura_local is None: return None
+        # El router puede calcular embeddings: fuera del event loop
+        return await self._en_hilo(self._reescritura_local, query_actual, ultimo_msg_usuario)
+
+    async def reescritura_llm(self, query_actual, ultimo_msg_usuario):
+        try:
+            inicio = time.perf_counter()
+            with metricas.span("reescritura"):
+                chat = await self._completar(REESCRITURA, prompts.peticion_reescritura(query_actual, ultimo_msg_usuario))
+            if self._al_reescribir_llm is not None:
+                self._al_reescribir_llm(time.perf_counter() - inicio)
+            metricas.anotar("reescritura", "llm")
+            metricas.registrar_tokens("reescritura", chat.usage)
+            return prompts.limpiar_reescritura(chat.choices[0].message.content)
+        except Exception as e:
+            metricas.registrar_error("reescritura", e)
+            return query_actual
+
+    async def contextualizar_consulta(self, query_actual, historial_mensajes):
+        local = await self.reescritura_sin_llm(query_actual, historial_mensajes)
+        if local is not None: return local
+        return await self.reescritura_llm(query_actual, prompts.ultimo_mensaje_usuario(historial_mensajes, query_actual))
+
+    @staticmethod
+    def _texto_o_stream(chat, stream):
+        if not stream:
+            metricas.registrar_tokens("generacion", chat.usage)
+            return chat.choices[0].message.content
+        return streaming.deltas_groq_async(chat, al_terminar=lambda usage: metricas.registrar_tokens("generacion", usage))
+
+    async def generar_charla_social(self, mensaje_usuario, stream=False):
+        """Con stream=True devuelve un generador asíncrono de fragmentos (ver `texto_o_iterador`)."""
+        try:
+            with metricas.span("generacion"):
+                chat = await self._completar(SALUDO, prompts.peticion_charla_social(mensaje_usuario, stream))
+            return self._texto_o_stream(chat, stream)
+        except Exception as e:
+            metricas.registrar_error("generacion", e)
+            return prompts.SALUDO_RESPALDO
+
+    async def generar_respuesta_tecnica(self, query_usuario, productos, stream=False):
+        if not productos: return "No encontré coincidencias exactas."
+        peticion = prompts.peticion_respuesta_tecnica(query_usuario, productos, self.tarjetas_servidor, stream)
+        try:
+            with metricas.span("generacion"):
+                chat = await self._completar(RESPUESTA, peticion)
+            return self._texto_o_stream(chat, stream)
+        except Exception as e:
+            metricas.registrar_error("generacion", e)
+            return f"Error IA: {e}"
+
+    async def consultar(self, prompt, historial, top_k=3, filtro=None, especular=True):
+        """
+        Reescritura + búsqueda; solo si hace falta el LLM, la búsqueda del prompt
+        crudo corre en paralelo (misma regla que `consultar_con_especulacion`).
+        Retorna (query, productos).
+        """
+        query = await self.reescritura_sin_llm(prompt, historial)
+        if query is not None or not especular:
+            if query is None:
+                query = await self.reescritura_llm(prompt, prompts.ultimo_mensaje_usuario(historial, prompt))
+            return query, await self.buscar_productos_vectorial(query, top_k, filtro)
+
+        vec_prompt = asyncio.ensure_future(self.vectorizar(prompt))
+
+        async def especulacion():
+            return await self.buscar_por_vector(await vec_prompt, top_k, filtro)
+        prods_prompt = asyncio.ensure_future(especulacion())
+        for tarea in (vec_prompt, prods_prompt):
+            tarea.add_done_callback(_descartar_error)  # si se abandona, su error no ensucia el log
+
+        query = await self.reescritura_llm(prompt, prompts.ultimo_mensaje_usuario(historial, prompt))
+        try:
+            if normalizar_consulta(query) == normalizar_consulta(prompt):
+                metricas.anotar("especulacion", "reutilizada")
+                return query, await prods_prompt
+            a, b = await vec_prompt, await self.vectorizar(query)
+            norma = float(np.linalg.norm(a) * np.linalg.norm(b))
+            if norma and float(np.dot(a, b)) / norma >= self.umbral_especulacion:
+                metricas.anotar("especulacion", "reutilizada")
+                return query, await prods_prompt
+            metricas.anotar("especulacion", "descartada")
+            prods_prompt.cancel()
+        except Exception as e:
+            metricas.registrar_error("especulacion", e)
+        return query, await self.buscar_productos_vectorial(query, top_k, filtro)
+
+    async def cerrar(self):
+        await self.http_db.aclose()
+        cerrar = getattr(self.groq, "close", None)
+        if cerrar is not None:
+            await cerrar()
+        self._cpu.shutdown(wait=False)
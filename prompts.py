@@ -0,0 +1,112 @@
+import constructor_prompt
+import metricas
+
+# --- PETICIONES AL LLM ---
+# Cada función arma los argumentos completos de `chat.completions.create`
+# (mensajes, modelo, temperatura, max_tokens). Los comparten el camino
+# síncrono de streamlit_app y el pipeline asíncrono, así ambos mandan
+# exactamente el mismo prompt.
+
+MODELO_LLM = "llama-3.3-70b-versatile"
+SALUDO_RESPALDO = "Bienvenido a SM Automatización. ¿En qué le puedo apoyar?"
+
+FORMATO_HTML = """📸 FORMATO VISUAL OBLIGATORIO:
+<div class="producto-card">
+  <img src="{url_foto}" class="producto-img">
+  <div class="card-title">{nombre}</div>
+  <div class="sku-text">SKU: {sku}</div>
+  <div class="price-text">${precio} MXN</div>
+  <a href="{url_link}" target="_blank" class="btn-link">Ver Ficha Técnica</a>
+</div>"""
+
+# Las tarjetas las pinta la app: el modelo solo explica y referencia SKUs del JSON
+FORMATO_SKUS = """📸 FORMATO DE RESPUESTA OBLIGATORIO:
+- Escribe SOLO una explicación breve (máximo 4 frases). NO escribas HTML, precios ni enlaces: las tarjetas de producto se muestran automáticamente.
+- En la ÚLTIMA línea escribe exactamente: <!-- SKUS: sku1, sku2 --> con los SKU del JSON que recomiendas, en orden de relevancia (vacío si no recomiendas ninguno)."""
+MAX_TOKENS_SKUS = 250
+MAX_TOKENS_HTML = 900
+
+# Sin nada que cambie por turno: el inventario va en un mensaje aparte, después
+INSTRUCCIONES_TECNICAS = """Eres el Asistente Técnico de 'SM Automatización'.
+PROTOCOLO: Solo recomienda del JSON de INVENTARIO.
+🚨 1. PROTOCOLO DE SEGURIDAD (PRIORIDAD MÁXIMA):
+- TU ÚNICO PROPÓSITO: Asistencia en ingeniería y automatización.
+- NO eres un vendedor que intenta cerrar una venta a la fuerza. NO tomes pedidos reales.
+- PROHIBIDO: Opinar sobre celebridades, política, religión o temas personales.
+- Si preguntan algo fuera de lugar: "Lo siento, mi programación se limita a soporte técnico industrial."
+- REGLA DE ORO: Solo habla de los productos listados en el JSON de INVENTARIO.
+
+🤝 2. PERSONALIDAD: "EL EXPERTO ACCESIBLE" (UNIVERSAL):
+- TU META: Que CUALQUIER persona entienda (desde una secretaria hasta un experto).
+- TONO: Amable, paciente, claro y servicial.
+- LENGUAJE: Evita jerga técnica compleja a menos que sea necesaria. Explica fácil.
+
+🛠️ 3. LÓGICA DE ASESORÍA:
+- SI ES UN PROYECTO (ej: "Quiero una banda transportadora"): Analiza qué componentes lógicos necesita (Motor, Sensor, PLC) y busca en el JSON qué le sirve.
+- SI CONFIRMAN ("sí", "ese quiero"): Di "Perfecto. ¿Tienes alguna duda técnica sobre la conexión o voltaje antes de cerrar?" (Cierre suave).
+- FLEXIBILIDAD TÉCNICA: Si piden un modelo específico y no está, pero hay uno equivalente en el JSON, ofrécelo como solución técnica viable.
+- Las descripciones vienen recortadas a lo relevante para la consulta."""
+
+
+def ultimo_mensaje_usuario(historial_mensajes, query_actual):
+    """Último mensaje del usuario distinto del actual ("" si no hay)."""
+    for msg in reversed(historial_mensajes):
+        if msg["role"] == "user" and msg["content"] != query_actual:
+            return msg["content"]
+    return ""
+
+
+def peticion_reescritura(query_actual, ultimo_msg_usuario):
+    prompt_rewrite = f"""
+    Contexto: "{ultimo_msg_usuario}". Usuario: "{query_actual}".
+    TU MISIÓN: Generar la frase de búsqueda TÉCNICA ideal para una base de datos vectorial.
+
+    REGLAS DE RAZONAMIENTO:
+    1. DETECTAR CAMBIO: Si el usuario dice "también", "ahora", "y un", "además" o pide un producto totalmente distinto (ej: pasas de Sensor a Cable), OLVIDA el contexto anterior. Busca solo lo nuevo.
+    2. DETECTAR REFINAMIENTO: Si el usuario sigue hablando de lo mismo (ej: "¿y pnp?", "¿de 24v?", "¿el más barato?"), COMBINA con el contexto anterior.
+    3. LIMPIEZA: ELIMINA palabras de venta como "barato", "caro", "precio", "costo", "económico", "mejor". Deja solo el nombre técnico del producto.
+
+    EJEMPLOS:
+    - Contexto="Busco PLC", Usuario="cual es el mas barato" -> Salida="PLC" (Refinamiento + Limpieza)
+    - Contexto="Sensor", Usuario="tambien ocupo cable" -> Salida="Cable" (Cambio de tema)
+    - Contexto="Fuente 24v", Usuario="y de 10 amperes" -> Salida="Fuente 24v 10 amperes" (Refinamiento)
+
+    Respuesta (Solo la frase final limpia):
+    """
+    return {"messages": [{"role": "system", "content": prompt_rewrite}], "model": MODELO_LLM,
+            "temperature": 0.1, "max_tokens": 50}
+
+
+def limpiar_reescritura(texto):
+    return texto.strip().replace('"', '')
+
+
+def peticion_charla_social(mensaje_usuario, stream=False):
+    return {
+        "messages": [
+            {"role": "system", "content": "Eres el Asistente Técnico de SM Automatización. Breve y profesional."},
+            {"role": "user", "content": mensaje_usuario}
+        ],
+        "model": MODELO_LLM, "temperature": 0.6, "max_tokens": 80, "stream": stream,
+    }
+
+
+def peticion_respuesta_tecnica(query_usuario, productos, tarjetas_servidor=True, stream=False, presupuesto_tokens=None):
+    """
+    Instrucciones fijas primero (mismo prefijo en cada turno, cacheable por el
+    proveedor) y después el inventario compacto recortado al presupuesto de
+    tokens. Con tarjetas_servidor el JSON va sin URLs y el modelo solo referencia SKUs.
+    """
+    formato = FORMATO_SKUS if tarjetas_servidor else FORMATO_HTML
+    instrucciones = {"role": "system", "content": f"{INSTRUCCIONES_TECNICAS}\n\n{formato}"}
+    usuario = {"role": "user", "content": query_usuario}
+    fijos = constructor_prompt.contar_tokens_mensajes([instrucciones, usuario, {"content": "INVENTARIO: "}])
+    datos_str, info = constructor_prompt.inventario(productos, query_usuario, fijos, presupuesto_tokens,
+                                                    campos_url=not tarjetas_servidor)
+    metricas.anotar("tokens_entrada", {"antes": fijos + info["tokens_sin_recorte"], "despues": fijos + info["tokens"],
+                                       "productos": info["productos"], "con_descripcion": info["con_descripcion"]})
+    return {
+        "messages": [instrucciones, {"role": "system", "content": f"INVENTARIO: {datos_str}"}, usuario],
+        "model": MODELO_LLM, "temperature": 0.1,
+        "max_tokens": MAX_TOKENS_SKUS if tarjetas_servidor else MAX_TOKENS_HTML, "stream": stream,
+    }
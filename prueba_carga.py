@@ -0,0 +1,392 @@
+"""
+Prueba de carga: cuántas conversaciones simultáneas aguanta UNA instancia de
+streamlit_app.py antes de que la latencia se dispare o la memoria se acabe.
+
+Levanta `streamlit run streamlit_app.py` con SM_BACKEND=falso (Groq y Supabase
+son los dobles de fakes.py, con latencia configurable) y abre sesiones sin
+navegador por el websocket de Streamlit (/_stcore/stream), como lo haría el
+frontend: un rerun con el estado del chat_input por turno, y el turno termina
+con `script_finished`. Cada sesión reproduce una conversación guionizada de
+bench/conversaciones.json. El modelo de embeddings es el falso o, con
+--embeddings, uno real en servidor_embeddings.py (otro proceso).
+
+Por escalón de concurrencia (1, 2, 4, ... sesiones a la vez) reporta p50/p95/p99
+del turno, turnos por segundo, RSS por sesión e hilos del proceso del servidor,
+y guarda todo en un JSON comparable entre corridas.
+
+    python prueba_carga.py                                  # escalones 1,2,4,8,16,32
+    python prueba_carga.py --niveles 8,16,32,64 --pausa 2   # con tiempo de lectura entre turnos
+    python prueba_carga.py --slo-p95-ms 3000                # se detiene al pasar el SLO
+    python prueba_carga.py --comparar logs/carga/carga-20261017-120000.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from benchmark import DIR_BENCH
+from metricas import percentil
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proceso(pid):
+    """RSS (MB) e hilos de un proceso, de /proc (None fuera de Linux)."""
+    datos = {"rss_mb": None, "hilos": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                clave, _, valor = linea.partition(":")
+                if clave == "VmRSS":
+                    datos["rss_mb"] = int(valor.split()[0]) / 1024
+                elif clave == "Threads":
+                    datos["hilos"] = int(valor)
+    except OSError:
+        pass
+    return datos
+
+
+# --- PROCESOS BAJO PRUEBA ---
+
+class Instancia:
+    """`streamlit run` (y, opcional, el servidor de embeddings) en segundo plano con el entorno de prueba."""
+
+    def __init__(self, args):
+        self.args = args
+        self.puerto = _puerto_libre()
+        self.url = f"http://127.0.0.1:{self.puerto}"
+        self.app = None
+        self.embeddings = None
+
+    def __enter__(self):
+        args = self.args
+        entorno = dict(
+            os.environ,
+            SM_BACKEND="falso",
+            SM_CATALOGO_FALSO=args.catalogo,
+            STREAMING_RESPUESTAS="1" if args.streaming else "0",
+            METRICAS_ARCHIVO="",
+            REGISTRO_CONSULTAS="",  # sin precalentamiento: cada corrida arranca en frío
+            FALSO_LATENCIA_DB=str(args.latencia_db),
+            FALSO_LATENCIA_LLM=str(args.latencia_llm),
+            FALSO_LATENCIA_TOKEN=str(args.latencia_token),
+            FALSO_LATENCIA_EMBEDDING=str(args.latencia_embedding),
+            GROQ_RPM="100000000",
+            GROQ_TPM="100000000",
+        )
+        if args.embeddings != "falso":
+            socket_embeddings = os.path.join(tempfile.mkdtemp(prefix="sm_carga_"), "embeddings.sock")
+            self.embeddings = subprocess.Popen(
+                [sys.executable, os.path.join(RAIZ, "servidor_embeddings.py"),
+                 "--direccion", f"unix:{socket_embeddings}", "--backend", args.embeddings],
+                cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            self._esperar(lambda: os.path.exists(socket_embeddings), "servidor de embeddings", proceso=self.embeddings)
+            entorno["EMBEDDINGS_SERVIDOR"] = f"unix:{socket_embeddings}"
+        self.app = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", os.path.join(RAIZ, "streamlit_app.py"),
+             "--server.headless", "true", "--server.port", str(self.puerto),
+             "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+            cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self._esperar(self._sano, "streamlit", proceso=self.app)
+        return self
+
+    def _sano(self):
+        try:
+            with urllib.request.urlopen(f"{self.url}/_stcore/health", timeout=1) as respuesta:
+                return respuesta.status == 200
+        except OSError:
+            return False
+
+    def _esperar(self, condicion, nombre, proceso, timeout=300):
+        limite = time.monotonic() + timeout
+        while not condicion():
+            if proceso.poll() is not None:
+                raise RuntimeError(f"{nombre} terminó al arrancar (código {proceso.returncode})")
+            if time.monotonic() > limite:
+                raise TimeoutError(f"{nombre} no arrancó en {timeout}s")
+            time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        for proceso in (self.app, self.embeddings):
+            if proceso is not None:
+                proceso.terminate()
+                try:
+                    proceso.wait(10)
+                except subprocess.TimeoutExpired:
+                    proceso.kill()
+
+
+# --- SESIONES SIN NAVEGADOR ---
+
+class Sesion:
+    """Una pestaña del chat: websocket propio, session_state propio en el servidor."""
+
+    def __init__(self, url, timeout):
+        self.url = url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.timeout = timeout
+        self.ws = None
+        self.chat_input = None
+
+    async def abrir(self):
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        return await self._rerun()
+
+    async def turno(self, texto):
+        estado = WidgetState(id=self.chat_input)
+        estado.chat_input_value.data = texto
+        return await self._rerun(estado)
+
+    async def _rerun(self, *widgets):
+        """Pide un rerun y espera `script_finished`. Devuelve la lista de errores del rerun."""
+        mensaje = BackMsg()
+        mensaje.rerun_script.query_string = ""
+        mensaje.rerun_script.widget_states.widgets.extend(widgets)
+        await self.ws.send(mensaje.SerializeToString())
+        errores = []
+        async with asyncio.timeout(self.timeout):
+            while True:
+                recibido = ForwardMsg()
+                recibido.ParseFromString(await self.ws.recv())
+                tipo = recibido.WhichOneof("type")
+                if tipo == "delta" and recibido.delta.WhichOneof("type") == "new_element":
+                    elemento = recibido.delta.new_element
+                    if elemento.WhichOneof("type") == "chat_input":
+                        self.chat_input = elemento.chat_input.id
+                    elif elemento.WhichOneof("type") == "exception":
+                        errores.append(f"{elemento.exception.type}: {elemento.exception.message}"[:300])
+                elif tipo == "script_finished":
+                    if recibido.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY:
+                        errores.append(f"script_finished={recibido.script_finished}")
+                    return errores
+
+    async def cerrar(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+
+async def _correr_sesion(url, conversaciones, args, resultado, avisos, arranque, fin):
+    """Abre la sesión, espera el arranque común, reproduce sus guiones y la cierra al fin del escalón."""
+    abiertas, terminadas = avisos
+    sesion = Sesion(url, args.timeout)
+    try:
+        inicio = time.perf_counter()
+        resultado["errores"] += await sesion.abrir()
+        resultado["apertura_ms"] = (time.perf_counter() - inicio) * 1000
+    except Exception as e:
+        resultado["errores"].append(f"apertura: {type(e).__name__}: {e}"[:300])
+    abiertas.release()
+    await arranque.wait()
+    if sesion.chat_input is not None:
+        for conversacion in conversaciones:
+            for turno in conversacion["turnos"]:
+                inicio = time.perf_counter()
+                try:
+                    resultado["errores"] += await sesion.turno(turno["usuario"])
+                except Exception as e:
+                    resultado["errores"].append(f"{type(e).__name__}: {e}"[:300])
+                resultado["turnos_ms"].append((time.perf_counter() - inicio) * 1000)
+                if args.pausa:
+                    await asyncio.sleep(args.pausa)
+    terminadas.release()
+    await fin.wait()  # la pestaña sigue abierta hasta el fin del escalón: cuenta en el RSS
+    await sesion.cerrar()
+
+
+async def _muestrear(pid, maximos, intervalo=0.2):
+    while True:
+        proceso = _proceso(pid)
+        maximos["rss_mb"] = max(maximos["rss_mb"], proceso["rss_mb"] or 0.0)
+        maximos["hilos"] = max(maximos["hilos"], proceso["hilos"] or 0)
+        await asyncio.sleep(intervalo)
+
+
+async def escalon(instancia, n_sesiones, conversaciones, args):
+    """Abre `n_sesiones`, las suelta a la vez sobre sus guiones y resume el escalón."""
+    pid = instancia.app.pid
+    base = _proceso(pid)
+    maximos = {"rss_mb": 0.0, "hilos": 0}
+    muestreo = asyncio.create_task(_muestrear(pid, maximos))
+    resultados = [{"turnos_ms": [], "errores": [], "apertura_ms": None} for _ in range(n_sesiones)]
+    abiertas, terminadas = asyncio.Semaphore(0), asyncio.Semaphore(0)
+    arranque, fin = asyncio.Event(), asyncio.Event()
+    por_sesion = args.conversaciones_por_sesion
+    tareas = [
+        asyncio.create_task(_correr_sesion(
+            instancia.url, [conversaciones[(i * por_sesion + j) % len(conversaciones)] for j in range(por_sesion)],
+            args, resultados[i], (abiertas, terminadas), arranque, fin,
+        ))
+        for i in range(n_sesiones)
+    ]
+    for _ in range(n_sesiones):
+        await abiertas.acquire()
+    con_sesiones = _proceso(pid)
+    inicio = time.perf_counter()
+    arranque.set()
+    for _ in range(n_sesiones):
+        await terminadas.acquire()
+    duracion = time.perf_counter() - inicio
+    final = _proceso(pid)
+    fin.set()
+    await asyncio.gather(*tareas)
+    muestreo.cancel()
+
+    turnos = sorted(ms for r in resultados for ms in r["turnos_ms"])
+    aperturas = sorted(r["apertura_ms"] for r in resultados if r["apertura_ms"] is not None)
+    errores = [e for r in resultados for e in r["errores"]]
+
+    def por_sesion_mb(medicion):
+        if medicion["rss_mb"] is None or base["rss_mb"] is None:
+            return None
+        return round((medicion["rss_mb"] - base["rss_mb"]) / n_sesiones, 2)
+
+    return {
+        "sesiones": n_sesiones,
+        "turnos": len(turnos),
+        "segundos": round(duracion, 3),
+        "turnos_por_segundo": round(len(turnos) / duracion, 2) if duracion else None,
+        **{f"p{q}_ms": round(percentil(turnos, q), 1) for q in (50, 95, 99)},
+        "max_ms": round(turnos[-1], 1) if turnos else None,
+        "apertura_p50_ms": round(percentil(aperturas, 50), 1),
+        "apertura_p95_ms": round(percentil(aperturas, 95), 1),
+        "rss_base_mb": base["rss_mb"] and round(base["rss_mb"], 1),
+        "rss_final_mb": final["rss_mb"] and round(final["rss_mb"], 1),
+        "rss_max_mb": round(maximos["rss_mb"], 1),
+        # Lo que cuesta una sesión: recién abierta, y con su conversación en session_state
+        "rss_por_sesion_abierta_mb": por_sesion_mb(con_sesiones),
+        "rss_por_sesion_mb": por_sesion_mb(final),
+        "hilos_base": base["hilos"],
+        "hilos_max": maximos["hilos"],
+        "errores": len(errores),
+        "ejemplos_error": sorted(set(errores))[:5],
+        "turnos_ms": [round(ms, 1) for ms in turnos],
+    }
+
+
+# --- REPORTE ---
+
+def _version_git():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _num(valor, formato):
+    return format(valor, formato) if valor is not None else "—".rjust(len(format(0, formato)))
+
+
+def imprimir(niveles):
+    print(f"\n{'sesiones':>8s} {'turnos/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+          f"{'MB/sesión':>10s} {'RSS máx':>8s} {'hilos':>6s} {'errores':>8s}")
+    for n in niveles:
+        print(f"{n['sesiones']:8d} {n['turnos_por_segundo']:9.2f} {n['p50_ms']:8.0f} {n['p95_ms']:8.0f} {n['p99_ms']:8.0f} "
+              f"{_num(n['rss_por_sesion_mb'], '10.2f')} {n['rss_max_mb']:8.0f} {n['hilos_max']:6d} {n['errores']:8d}")
+
+
+def comparar(actual, anterior):
+    """Diferencias por escalón con la misma concurrencia."""
+    previos = {n["sesiones"]: n for n in anterior["niveles"]}
+    print(f"\nContra {anterior.get('git') or '?'} ({anterior.get('fecha')}):")
+    print(f"{'sesiones':>8s} {'turnos/s':>18s} {'p95 ms':>18s} {'MB/sesión':>18s}")
+    for n in actual["niveles"]:
+        p = previos.get(n["sesiones"])
+        if p is None:
+            continue
+        print(f"{n['sesiones']:8d} {p['turnos_por_segundo']:8.2f} → {n['turnos_por_segundo']:7.2f} "
+              f"{p['p95_ms']:8.0f} → {n['p95_ms']:7.0f} "
+              f"{_num(p['rss_por_sesion_mb'], '8.2f')} → {_num(n['rss_por_sesion_mb'], '7.2f')}")
+
+
+async def correr(args, conversaciones, niveles):
+    import streamlit
+
+    corrida = {
+        "fecha": time.strftime("%Y%m%d-%H%M%S"),
+        "git": _version_git(),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "cpus": os.cpu_count(),
+        "configuracion": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")},
+        "niveles": [],
+    }
+    with Instancia(args) as instancia:
+        # Una sesión de calentamiento: los @st.cache_resource (conexiones, índices) no cuentan en el primer escalón
+        calentamiento = argparse.Namespace(**{**vars(args), "conversaciones_por_sesion": 1, "pausa": 0})
+        await escalon(instancia, 1, conversaciones[:1], calentamiento)
+        for n in niveles:
+            nivel = await escalon(instancia, n, conversaciones, args)
+            corrida["niveles"].append(nivel)
+            print(f"{n:4d} sesiones: {nivel['turnos']} turnos en {nivel['segundos']:.1f}s · p95 {nivel['p95_ms']:.0f} ms · "
+                  f"RSS {_num(nivel['rss_final_mb'], '.0f')} MB · {nivel['hilos_max']} hilos · {nivel['errores']} errores",
+                  flush=True)
+            if args.slo_p95_ms and nivel["p95_ms"] > args.slo_p95_ms:
+                print(f"p95 {nivel['p95_ms']:.0f} ms > SLO {args.slo_p95_ms:.0f} ms: fin de la rampa")
+                break
+    if args.slo_p95_ms:
+        dentro = [n["sesiones"] for n in corrida["niveles"] if n["p95_ms"] <= args.slo_p95_ms and not n["errores"]]
+        corrida["capacidad_sesiones"] = max(dentro) if dentro else 0
+    return corrida
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones concurrentes de streamlit_app.py")
+    parser.add_argument("--niveles", default="1,2,4,8,16,32", help="sesiones simultáneas por escalón")
+    parser.add_argument("--conversaciones", default=os.path.join(DIR_BENCH, "conversaciones.json"))
+    parser.add_argument("--catalogo", default=os.path.join(DIR_BENCH, "catalogo.json"))
+    parser.add_argument("--conversaciones-por-sesion", type=int, default=1)
+    parser.add_argument("--pausa", type=float, default=0.0, help="segundos de lectura entre turnos de una sesión")
+    parser.add_argument("--slo-p95-ms", type=float, help="detiene la rampa en el primer escalón que lo supere")
+    parser.add_argument("--timeout", type=float, default=120.0, help="segundos máximos por rerun")
+    parser.add_argument("--streaming", action="store_true", help="respuestas en streaming (como en producción)")
+    parser.add_argument("--embeddings", default="falso",
+                        help="falso, o un backend real (torch, int8, onnx, onnx-int8) en servidor_embeddings.py")
+    parser.add_argument("--latencia-llm", type=float, default=0.25, help="segundos al primer token del LLM falso")
+    parser.add_argument("--latencia-token", type=float, default=0.004)
+    parser.add_argument("--latencia-db", type=float, default=0.05)
+    parser.add_argument("--latencia-embedding", type=float, default=0.005)
+    parser.add_argument("--salida", help="JSON de resultados (por defecto logs/carga/carga-<fecha>.json)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    args = parser.parse_args(argv)
+
+    with open(args.conversaciones, encoding="utf-8") as f:
+        conversaciones = json.load(f)
+    niveles = [int(n) for n in args.niveles.split(",") if n.strip()]
+    corrida = asyncio.run(correr(args, conversaciones, niveles))
+
+    imprimir(corrida["niveles"])
+    if "capacidad_sesiones" in corrida:
+        print(f"\nCapacidad dentro del SLO (p95 <= {args.slo_p95_ms:.0f} ms): {corrida['capacidad_sesiones']} sesiones")
+    salida = args.salida or os.path.join(RAIZ, "logs", "carga", f"carga-{corrida['fecha']}.json")
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(corrida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {salida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(corrida, json.load(f))
+    return 1 if any(n["errores"] for n in corrida["niveles"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
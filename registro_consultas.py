@@ -0,0 +1,156 @@
+"""
+Registro de consultas para precalentar cachés y encontrar huecos del catálogo.
+
+Por turno técnico se guarda solo la consulta reescrita (salida de
+`contextualizar_consulta`) normalizada, su latencia y cuántos productos
+devolvió; nada de sesión, usuario ni prompt original. Si la consulta o el
+prompt traen correo, teléfono o números largos, el turno no se registra, y el resumen para
+precalentar solo toma consultas repetidas (`min_frecuencia`).
+
+    python registro_consultas.py                      # reporte de logs/consultas.jsonl
+    python registro_consultas.py otra/ruta.jsonl --top 30
+"""
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from cache_embeddings import normalizar_consulta
+from metricas import percentil
+
+MAX_PALABRAS = 20  # más largo que esto ya es texto libre, no una consulta de catálogo
+_DATO_PERSONAL = re.compile(
+    r"\S+@\S+"                                        # correo (o lo que quede de él tras reescribir)
+    r"|(?<![\w-])\+?\d(?:[\s().-]*\d){7,}(?![\w-])"  # teléfono, cuenta, tarjeta: 8+ dígitos sueltos
+    r"|https?://\S+"
+)
+
+
+def es_registrable(consulta):
+    """False si la consulta podría identificar a alguien (o no es una consulta de catálogo)."""
+    return bool(consulta) and len(consulta.split()) <= MAX_PALABRAS and not _DATO_PERSONAL.search(consulta)
+
+
+class _Agregado:
+    __slots__ = ("n", "sin_resultados", "latencias", "ultima")
+
+    def __init__(self):
+        self.n = 0
+        self.sin_resultados = 0
+        self.latencias = []  # ms de los últimos turnos (acotado)
+        self.ultima = 0.0
+
+    def sumar(self, ms, productos, ts, max_latencias=50):
+        self.n += 1
+        self.sin_resultados += productos == 0
+        self.latencias.append(ms)
+        del self.latencias[:-max_latencias]
+        self.ultima = max(self.ultima, ts)
+
+
+class RegistroConsultas:
+    """JSONL rotativo (una línea por turno) + agregados en memoria por consulta normalizada."""
+
+    def __init__(self, ruta="logs/consultas.jsonl", max_bytes=10 * 1024 * 1024, respaldos=3, max_consultas=20000,
+                 solo_lectura=False):
+        self.ruta = ruta
+        self.respaldos = respaldos
+        self.max_consultas = max_consultas
+        self._agregados = defaultdict(_Agregado)
+        self._candado = threading.Lock()
+        self._log = None
+        if ruta:
+            self._cargar()
+        if ruta and not solo_lectura:
+            os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+            log = logging.getLogger(f"sm.consultas.{ruta}")
+            log.setLevel(logging.INFO)
+            log.propagate = False
+            if not log.handlers:
+                manejador = logging.handlers.RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=respaldos, encoding="utf-8")
+                manejador.setFormatter(logging.Formatter("%(message)s"))
+                log.addHandler(manejador)
+            self._log = log
+
+    def _cargar(self):
+        """Agrega el archivo vigente y sus respaldos (el más viejo primero). Líneas corruptas se ignoran."""
+        for ruta in [f"{self.ruta}.{i}" for i in range(self.respaldos, 0, -1)] + [self.ruta]:
+            try:
+                with open(ruta, encoding="utf-8") as f:
+                    for linea in f:
+                        try:
+                            fila = json.loads(linea)
+                            self._sumar(fila["consulta"], float(fila["ms"]), int(fila["productos"]), float(fila.get("ts", 0)))
+                        except (ValueError, KeyError, TypeError):
+                            continue
+            except OSError:
+                continue
+
+    def _sumar(self, consulta, ms, productos, ts):
+        if consulta not in self._agregados and len(self._agregados) >= self.max_consultas:
+            # Tope de memoria: sale la consulta menos frecuente (y más vieja)
+            del self._agregados[min(self._agregados, key=lambda c: (self._agregados[c].n, self._agregados[c].ultima))]
+        self._agregados[consulta].sumar(ms, productos, ts)
+
+    def registrar(self, consulta, ms, productos, prompt=None):
+        """
+        Anota un turno. Devuelve False si la consulta no se guardó (vacía o con datos
+        personales en ella o en el `prompt` original, que nunca se escribe).
+        """
+        consulta = normalizar_consulta(consulta or "")
+        if not es_registrable(consulta) or (prompt and _DATO_PERSONAL.search(prompt)):
+            return False
+        ts = round(time.time() / 3600) * 3600  # a la hora: sin marca exacta que cruzar con otros logs
+        with self._candado:
+            self._sumar(consulta, ms, productos, ts)
+        if self._log is not None:
+            self._log.info(json.dumps({"ts": ts, "consulta": consulta, "ms": round(ms, 1), "productos": productos},
+                                      ensure_ascii=False))
+        return True
+
+    def frecuentes(self, n=50, min_frecuencia=2):
+        """Las `n` consultas más repetidas que sí devolvieron productos (candidatas a precalentar)."""
+        with self._candado:
+            filas = [(c, a.n) for c, a in self._agregados.items()
+                     if a.n >= min_frecuencia and a.sin_resultados < a.n]
+        return [c for c, _ in sorted(filas, key=lambda f: (-f[1], f[0]))[:n]]
+
+    def reporte(self, n=20, min_frecuencia=1):
+        """Consultas con peor latencia (p95) y las que más veces quedaron sin resultados."""
+        with self._candado:
+            agregados = [(c, a.n, a.sin_resultados, sorted(a.latencias)) for c, a in self._agregados.items()
+                         if a.n >= min_frecuencia]
+        lentas = sorted(agregados, key=lambda f: -percentil(f[3], 95))[:n]
+        vacias = sorted((f for f in agregados if f[2]), key=lambda f: (-f[2], f[0]))[:n]
+        return {
+            "consultas": len(agregados),
+            "turnos": sum(f[1] for f in agregados),
+            "mas_lentas": [{"consulta": c, "n": k, "p50_ms": round(percentil(l, 50), 1), "p95_ms": round(percentil(l, 95), 1)}
+                           for c, k, _, l in lentas],
+            "sin_resultados": [{"consulta": c, "n": k, "sin_resultados": v} for c, k, v, _ in vacias],
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reporte del registro de consultas")
+    parser.add_argument("ruta", nargs="?", default=os.getenv("REGISTRO_CONSULTAS", "logs/consultas.jsonl"))
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--min-frecuencia", type=int, default=1)
+    args = parser.parse_args()
+
+    registro = RegistroConsultas(args.ruta, max_consultas=10 ** 9, solo_lectura=True)
+    reporte = registro.reporte(args.top, args.min_frecuencia)
+    print(f"{reporte['consultas']} consultas distintas en {reporte['turnos']} turnos\n")
+    print("Peor latencia:")
+    for fila in reporte["mas_lentas"]:
+        print(f"  {fila['p95_ms']:9.1f} ms p95 {fila['p50_ms']:9.1f} ms p50  x{fila['n']:<4d} {fila['consulta']}")
+    print("\nSin resultados (huecos del catálogo o del umbral):")
+    for fila in reporte["sin_resultados"]:
+        print(f"  {fila['sin_resultados']:4d}/{fila['n']:<4d} {fila['consulta']}")
+    print("\nPara precalentar:", ", ".join(registro.frecuentes(10)) or "(ninguna repetida aún)")
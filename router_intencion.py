@@ -0,0 +1,160 @@
+import re
+import threading
+from dataclasses import dataclass
+
+from cache_embeddings import normalizar_consulta
+
+# --- ROUTER LOCAL DE REESCRITURA ---
+# `contextualizar_consulta` solo decide entre COMBINAR con el mensaje anterior,
+# CAMBIAR de tema (olvidarlo) y LIMPIAR palabras de venta. Los casos claros se
+# resuelven aquí con las mismas reglas del prompt; el LLM queda para los dudosos.
+
+CAMBIO = "cambio"
+COMBINAR = "combinar"
+
+# Mismas pistas que el prompt de reescritura (texto ya normalizado: sin acentos)
+PISTAS_CAMBIO = ("tambien", "ahora", "ademas", "y un ", "y una ", "otro producto", "aparte")
+PALABRAS_VENTA = {
+    "barato", "barata", "baratos", "baratas", "caro", "cara", "caros", "caras", "precio", "precios", "costo",
+    "costos", "cuesta", "cuestan", "economico", "economica", "economicos", "mejor", "mejores", "mas", "menos",
+    "menor", "mayor", "premium", "oferta", "promocion",
+}
+RELLENO = {
+    "cual", "cuales", "es", "son", "el", "la", "los", "las", "un", "una", "unos", "unas", "y", "de", "del", "que",
+    "quiero", "busco", "necesito", "ocupo", "tienes", "tienen", "hay", "me", "das", "da", "muestra", "muestrame",
+    "pasame", "dame", "tambien", "ahora", "ademas", "por", "favor", "porfa", "cuanto", "con", "en", "para", "pero",
+    "sea", "otro", "otra", "aparte", "algo", "ese", "esa", "este", "esta", "pesos", "mxn",
+    # Verbos de la pregunta, no del producto ("el más caro que tengan de PLC")
+    "tengan", "tenga", "tiene", "tendran", "tendras", "manejan", "maneja", "manejen", "venden", "vende", "vendan",
+    "ofrecen", "ofrece", "quisiera", "requiero", "puedes", "podrias", "dime", "sabes", "existe", "existen",
+    "conseguir", "comprar", "cotizar", "ver", "recomiendas", "recomienda", "sirve", "sirva", "funcione",
+}
+# Especificaciones sueltas típicas de un refinamiento ("¿y pnp?", "¿de 24v?")
+# "no" queda fuera: "no, mejor capacitivo" corrige al anterior, no pide un contacto NO
+_NEGACION = re.compile(r"^\s*no\b")
+_ESPECIFICACION = re.compile(r"^(?:\d+(?:\.\d+)?\s*(?:v|vac|vdc|a|amp|amperes|w|hp|mm|m|hz|rpm|kg|polos)?|pnp|npn|nc|ip\d+|trifasic[oa]|monofasic[oa])$")
+
+
+@dataclass
+class Decision:
+    accion: str
+    consulta: str
+    confianza: float
+
+
+def palabras_tecnicas(texto):
+    """Palabras que quedan tras quitar signos, números de precio, relleno y palabras de venta."""
+    texto = re.sub(r"[¿?¡!.,;:\"$]", " ", normalizar_consulta(texto))
+    return [p for p in texto.split() if p not in RELLENO and p not in PALABRAS_VENTA and not (p.isdigit() and int(p) > 50)]
+
+
+def limpiar_consulta(texto):
+    return " ".join(palabras_tecnicas(texto))
+
+
+def _raiz(palabra):
+    return palabra[:-1] if len(palabra) > 3 and palabra.endswith("s") else palabra
+
+
+def vocabulario_catalogo(productos):
+    """Palabras (normalizadas, sin plural) de nombres y descripciones del catálogo."""
+    vocabulario = set()
+    for p in productos:
+        texto = re.sub(r"[^\w]+", " ", normalizar_consulta(f"{p.get('nombre') or ''} {p.get('descripcion') or ''}"))
+        vocabulario.update(_raiz(w) for w in texto.split())
+    return vocabulario
+
+
+class RouterReescritura:
+    """Decide localmente la reescritura y lleva la cuenta de llamadas LLM evitadas."""
+
+    def __init__(self, umbral_confianza=0.75, similitud_refinamiento=0.55, similitud_cambio=0.25):
+        self.umbral_confianza = umbral_confianza
+        self.similitud_refinamiento = similitud_refinamiento
+        self.similitud_cambio = similitud_cambio
+        self.decisiones_locales = 0
+        self.llamadas_llm = 0
+        self.latencia_llm_s = 0.6  # estimación inicial; se ajusta con un promedio móvil
+        self.segundos_ahorrados = 0.0
+        self.vocabulario = frozenset()  # vacío: sin catálogo no se puede revisar un cambio de tema
+        self._candado = threading.Lock()
+
+    def actualizar_vocabulario(self, productos):
+        self.vocabulario = frozenset(vocabulario_catalogo(productos))
+
+    def _fuera_de_catalogo(self, tecnicas):
+        """True si alguna palabra que quedó no es del catálogo (probablemente relleno que no conocemos)."""
+        vocabulario = self.vocabulario
+        return bool(vocabulario) and any(
+            _raiz(p) not in vocabulario and not _ESPECIFICACION.match(p) for p in tecnicas)
+
+    def _cambio(self, tecnicas, confianza):
+        """Un CAMBIO busca solo con `tecnicas`: si alguna no es del catálogo, que decida el LLM."""
+        if self._fuera_de_catalogo(tecnicas):
+            confianza = min(confianza, self.umbral_confianza - 0.15)
+        return Decision(CAMBIO, " ".join(tecnicas), confianza)
+
+    def decidir(self, actual, previo, similitud=None):
+        """
+        `similitud` es una función opcional sin argumentos (coseno actual vs previo);
+        solo se evalúa si las reglas no bastan. Retorna Decision.
+        """
+        norm = " " + re.sub(r"[¿?¡!]", " ", normalizar_consulta(actual)).strip() + " "
+        tecnicas = palabras_tecnicas(actual)
+        tecnicas_previo = palabras_tecnicas(previo)
+        combinada = " ".join(dict.fromkeys(tecnicas_previo + tecnicas))
+
+        # 0. Corrección ("no, mejor capacitivo"): qué se conserva del anterior lo decide el LLM
+        if _NEGACION.match(norm):
+            return Decision(CAMBIO, " ".join(p for p in tecnicas if p != "no"), 0.4)
+
+        # 1. Pistas explícitas de cambio de tema
+        if any(f" {p}" in norm for p in PISTAS_CAMBIO):
+            if tecnicas:
+                return self._cambio(tecnicas, 0.9)
+            return Decision(COMBINAR, combinada, 0.4)  # "¿y ahora el más barato?": dudoso
+
+        # 2. Solo palabras de venta / relleno: refinamiento puro del producto anterior
+        if not tecnicas:
+            return Decision(COMBINAR, combinada, 0.95 if tecnicas_previo else 0.3)
+
+        # 3. Refinamiento corto de solo especificaciones ("¿y pnp?", "de 24v")
+        if len(tecnicas) <= 3 and all(_ESPECIFICACION.match(p) for p in tecnicas):
+            return Decision(COMBINAR, combinada, 0.9)
+
+        # 4. Reglas no concluyentes: similitud semántica con el mensaje anterior. Un
+        # conector inicial no basta: "¿y el relevador?" tras "contactor" es otro producto
+        if similitud is not None:
+            try:
+                s = similitud()
+            except Exception:
+                s = None
+            if s is not None and s >= self.similitud_refinamiento and len(tecnicas) <= 3:
+                return Decision(COMBINAR, combinada, 0.8)
+            if s is not None and s <= self.similitud_cambio and len(tecnicas) >= 2:
+                return self._cambio(tecnicas, 0.8)
+        return Decision(CAMBIO, " ".join(tecnicas), 0.5)
+
+    def es_confiable(self, decision):
+        return decision.confianza >= self.umbral_confianza
+
+    def registrar_local(self):
+        with self._candado:
+            self.decisiones_locales += 1
+            self.segundos_ahorrados += self.latencia_llm_s
+
+    def registrar_llm(self, segundos):
+        with self._candado:
+            self.llamadas_llm += 1
+            self.latencia_llm_s = 0.8 * self.latencia_llm_s + 0.2 * segundos
+
+    def estadisticas(self):
+        with self._candado:
+            total = self.decisiones_locales + self.llamadas_llm
+            return {
+                "llamadas_evitadas": self.decisiones_locales,
+                "llamadas_llm": self.llamadas_llm,
+                "tasa_local": self.decisiones_locales / total if total else 0.0,
+                "latencia_llm_estimada_s": self.latencia_llm_s,
+                "segundos_ahorrados": self.segundos_ahorrados,
+            }
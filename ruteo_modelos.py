@@ -0,0 +1,324 @@
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+import metricas
+from gateway_llm import Despacho
+
+# --- RUTEO DE MODELOS POR TAREA ---
+# Cada tarea tiene un modelo primario, un modelo de respaldo (más rápido) y un
+# presupuesto de latencia:
+#   - Cobertura (hedging): si el primario no responde dentro de su p95
+#     observado, se lanza la misma petición al respaldo y gana la primera.
+#   - Respaldo: si el primario falla, se intenta el respaldo con el tiempo que
+#     quede del presupuesto.
+#   - Si nada responde dentro del presupuesto se lanza SinRespuesta y el
+#     llamador usa su salida degradada (consulta original, saludo fijo...).
+# Los streams solo usan respaldo ante error: una respuesta a medio pintar no se
+# puede cubrir con otra.
+# El presupuesto y el umbral de cobertura corren desde que la primera petición
+# sale de la fila del gateway: esperar cupo no es lentitud del modelo, y una
+# cobertura lanzada por eso solo haría más fila. Lo que sigue en la fila cuando
+# ya hay ganador (o se acabó el presupuesto) se abandona sin llegar a Groq.
+
+MODELO_GRANDE = "llama-3.3-70b-versatile"
+MODELO_INSTANTANEO = "llama-3.1-8b-instant"
+
+REESCRITURA = "reescritura"
+SALUDO = "saludo"
+RESPUESTA = "respuesta"
+
+MUESTRAS_MIN_P95 = 20  # antes de esto la cobertura usa `cobertura_inicial_s`
+
+
+class SinRespuesta(Exception):
+    """Ni el primario ni el respaldo respondieron dentro del presupuesto."""
+
+
+@dataclass(frozen=True)
+class Ruta:
+    primario: str
+    respaldo: str = None
+    presupuesto_s: float = 10.0
+    cobertura: bool = True
+    cobertura_inicial_s: float = 2.0
+
+
+def rutas_desde_entorno():
+    """Rutas por tarea; MODELO_<TAREA>, RESPALDO_<TAREA> y PRESUPUESTO_<TAREA> las ajustan."""
+    base = {
+        # 50 tokens de salida: el modelo instantáneo basta y la cobertura es otra llamada igual de barata
+        # (el gateway no la coalesce con el primario, aunque la petición sea idéntica)
+        REESCRITURA: Ruta(MODELO_INSTANTANEO, MODELO_INSTANTANEO, presupuesto_s=3.0, cobertura_inicial_s=0.8),
+        SALUDO: Ruta(MODELO_INSTANTANEO, MODELO_INSTANTANEO, presupuesto_s=3.0, cobertura_inicial_s=0.8),
+        RESPUESTA: Ruta(MODELO_GRANDE, MODELO_INSTANTANEO, presupuesto_s=20.0, cobertura_inicial_s=4.0),
+    }
+    rutas = {}
+    for tarea, ruta in base.items():
+        sufijo = tarea.upper()
+        rutas[tarea] = Ruta(
+            primario=os.getenv(f"MODELO_{sufijo}", ruta.primario),
+            respaldo=os.getenv(f"RESPALDO_{sufijo}", ruta.respaldo) or None,
+            presupuesto_s=float(os.getenv(f"PRESUPUESTO_{sufijo}", ruta.presupuesto_s)),
+            cobertura=os.getenv("COBERTURA_LLM", "1") == "1",
+            cobertura_inicial_s=ruta.cobertura_inicial_s,
+        )
+    return rutas
+
+
+class RuteadorModelos:
+    def __init__(self, cliente, rutas=None, hilos=16, ventana=500):
+        self.cliente = cliente
+        self.rutas = rutas or rutas_desde_entorno()
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="ruteo-llm")
+        self._latencias = defaultdict(lambda: deque(maxlen=ventana))  # modelo -> segundos
+        self._contadores = defaultdict(lambda: defaultdict(int))  # tarea -> evento -> n
+        self._candado = threading.Lock()
+
+    # --- Registro ---
+
+    def _contar(self, tarea, evento):
+        with self._candado:
+            self._contadores[tarea][evento] += 1
+        metricas.METRICAS.incrementar(f"llm_{evento}:{tarea}")
+
+    def _observar(self, modelo, segundos):
+        with self._candado:
+            self._latencias[modelo].append(segundos)
+        metricas.METRICAS.observar(f"modelo:{modelo}", segundos)
+
+    def umbral_cobertura(self, ruta):
+        """p95 observado del primario (o el valor inicial mientras hay pocas muestras)."""
+        with self._candado:
+            muestras = sorted(self._latencias[ruta.primario])
+        if len(muestras) < MUESTRAS_MIN_P95:
+            return ruta.cobertura_inicial_s
+        return metricas.percentil(muestras, 95)
+
+    def _ganador(self, tarea, modelo, es_segundo):
+        self._contar(tarea, "llamadas")
+        if es_segundo:
+            self._contar(tarea, "gana_respaldo")
+        metricas.anotar(f"modelo_{tarea}", modelo)
+
+    def _peticion(self, peticion, modelo, restante):
+        return dict(peticion, model=modelo, timeout=max(restante, 0.1))
+
+    def _preparar(self, cliente, peticion, ruta, modelo, es_segundo, despachos):
+        """
+        Petición para `modelo` con el presupuesto que queda y su Despacho (que
+        se agrega a `despachos`). La cobertura no se coalesce: si es idéntica al
+        primario, esperaría al mismo primario lento.
+        """
+        inicio = self._inicio(despachos)
+        restante = ruta.presupuesto_s - (0.0 if inicio is None else time.monotonic() - inicio)
+        peticion_modelo = self._peticion(peticion, modelo, restante)
+        despacho = Despacho(coalescer=not es_segundo)
+        if getattr(cliente.chat.completions, "gateway", None) is None:
+            despacho.instante = time.monotonic()  # sin gateway no hay fila: sale en el acto
+        else:
+            peticion_modelo["despacho"] = despacho
+        despachos.append(despacho)
+        return peticion_modelo
+
+    @staticmethod
+    def _latencia(peticion, inicio):
+        """Segundos desde que la petición salió de la fila (o desde `inicio` si no pasó por el gateway)."""
+        despacho = peticion.get("despacho")
+        return time.monotonic() - (despacho.instante if despacho and despacho.instante else inicio)
+
+    @staticmethod
+    def _inicio(despachos):
+        """Instante en que salió de la fila la primera petición (None si todas siguen esperando)."""
+        instantes = [d.instante for d in despachos if d.instante is not None]
+        return min(instantes) if instantes else None
+
+    def _siguiente_paso(self, tarea, ruta, inicio, pendientes, segundo_lanzado, umbral):
+        """
+        Decide qué hacer en el bucle de espera: ("fin", None) si se acabó el
+        presupuesto, ("lanzar", None) si toca el respaldo / la cobertura, o
+        ("esperar", segundos). Con `inicio` None nada ha salido de la fila: el
+        reloj no corre y la espera se recalcula al despertar.
+        """
+        transcurrido = 0.0 if inicio is None else time.monotonic() - inicio
+        restante = ruta.presupuesto_s - transcurrido
+        if restante <= 0:
+            return "fin", None
+        if not segundo_lanzado and (not pendientes or (umbral is not None and transcurrido >= umbral)):
+            self._contar(tarea, "coberturas" if pendientes else "respaldos")
+            return "lanzar", None
+        if not segundo_lanzado and umbral is not None:
+            restante = min(restante, umbral - transcurrido)
+        return "esperar", restante
+
+    # --- Camino síncrono ---
+
+    def _medir(self, cliente, peticion):
+        inicio = time.monotonic()
+        respuesta = cliente.chat.completions.create(**peticion)
+        if not peticion.get("stream"):
+            self._observar(peticion["model"], self._latencia(peticion, inicio))
+        return respuesta
+
+    def completar(self, tarea, peticion, cliente=None):
+        """Como `chat.completions.create(**peticion)` con el modelo, cobertura y respaldo de `tarea`."""
+        cliente = cliente or self.cliente
+        ruta = self.rutas[tarea]
+        if peticion.get("stream"):
+            return self._stream_con_respaldo(tarea, ruta, peticion, cliente, time.monotonic())
+        despachos = []
+
+        def lanzar(modelo, es_segundo):
+            peticion_modelo = self._preparar(cliente, peticion, ruta, modelo, es_segundo, despachos)
+            return self._ejecutor.submit(metricas.con_contexto(self._medir), cliente, peticion_modelo)
+
+        pendientes = {lanzar(ruta.primario, False): (ruta.primario, False)}  # futuro -> (modelo, es_segundo)
+        umbral = self.umbral_cobertura(ruta) if ruta.respaldo and ruta.cobertura else None
+        segundo_lanzado = ruta.respaldo is None
+        error = None
+        try:
+            while pendientes or not segundo_lanzado:
+                paso, espera = self._siguiente_paso(tarea, ruta, self._inicio(despachos), pendientes, segundo_lanzado, umbral)
+                if paso == "fin":
+                    break
+                if paso == "lanzar":
+                    pendientes[lanzar(ruta.respaldo, True)] = (ruta.respaldo, True)
+                    segundo_lanzado = True
+                    continue
+                hechos, _ = wait(pendientes, timeout=espera, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    modelo, es_segundo = pendientes.pop(futuro)
+                    try:
+                        respuesta = futuro.result()
+                    except Exception as e:
+                        error = e
+                        self._contar(tarea, "errores")
+                        continue
+                    self._ganador(tarea, modelo, es_segundo)
+                    return respuesta
+        finally:
+            for despacho in despachos:
+                despacho.abandonar()  # solo afecta a lo que sigue en la fila del gateway
+        self._contar(tarea, "sin_respuesta")
+        raise SinRespuesta(f"{tarea}: sin respuesta en {ruta.presupuesto_s:.1f}s") from error
+
+    def _stream_con_respaldo(self, tarea, ruta, peticion, cliente, inicio):
+        try:
+            respuesta = cliente.chat.completions.create(**self._peticion(peticion, ruta.primario, ruta.presupuesto_s))
+            self._ganador(tarea, ruta.primario, False)
+            return respuesta
+        except Exception as e:
+            error = e
+            self._contar(tarea, "errores")
+        restante = ruta.presupuesto_s - (time.monotonic() - inicio)
+        if ruta.respaldo and restante > 0:
+            self._contar(tarea, "respaldos")
+            try:
+                respuesta = cliente.chat.completions.create(**self._peticion(peticion, ruta.respaldo, restante))
+                self._ganador(tarea, ruta.respaldo, True)
+                return respuesta
+            except Exception as e:
+                error = e
+                self._contar(tarea, "errores")
+        self._contar(tarea, "sin_respuesta")
+        raise SinRespuesta(f"{tarea}: {error}") from error
+
+    # --- Camino asíncrono (PipelineAsync) ---
+
+    async def _medir_async(self, cliente, peticion):
+        despacho = peticion.get("despacho")
+        inicio = time.monotonic()
+        try:
+            respuesta = await cliente.chat.completions.create(**peticion)
+        except asyncio.CancelledError:
+            # perdió contra la cobertura: lo que tardó es cota inferior, sin ella el p95 se sesga a la baja
+            if not despacho or despacho.instante is not None:  # cancelada en la fila no dice nada del modelo
+                self._observar(peticion["model"], self._latencia(peticion, inicio))
+            raise
+        if not peticion.get("stream"):
+            self._observar(peticion["model"], self._latencia(peticion, inicio))
+        return respuesta
+
+    async def completar_async(self, tarea, peticion, cliente):
+        ruta = self.rutas[tarea]
+        if peticion.get("stream"):
+            return await self._stream_con_respaldo_async(tarea, ruta, peticion, cliente, time.monotonic())
+        despachos = []
+
+        def lanzar(modelo, es_segundo):
+            peticion_modelo = self._preparar(cliente, peticion, ruta, modelo, es_segundo, despachos)
+            return asyncio.ensure_future(self._medir_async(cliente, peticion_modelo))
+
+        pendientes = {lanzar(ruta.primario, False): (ruta.primario, False)}
+        umbral = self.umbral_cobertura(ruta) if ruta.respaldo and ruta.cobertura else None
+        segundo_lanzado = ruta.respaldo is None
+        error = None
+        try:
+            while pendientes or not segundo_lanzado:
+                paso, espera = self._siguiente_paso(tarea, ruta, self._inicio(despachos), pendientes, segundo_lanzado, umbral)
+                if paso == "fin":
+                    break
+                if paso == "lanzar":
+                    pendientes[lanzar(ruta.respaldo, True)] = (ruta.respaldo, True)
+                    segundo_lanzado = True
+                    continue
+                hechos, _ = await asyncio.wait(pendientes, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+                for tarea_llm in hechos:
+                    modelo, es_segundo = pendientes.pop(tarea_llm)
+                    if tarea_llm.cancelled() or tarea_llm.exception() is not None:
+                        error = None if tarea_llm.cancelled() else tarea_llm.exception()
+                        self._contar(tarea, "errores")
+                        continue
+                    self._ganador(tarea, modelo, es_segundo)
+                    return tarea_llm.result()
+        finally:
+            for tarea_llm in pendientes:
+                tarea_llm.cancel()  # la petición perdedora se corta de verdad
+        self._contar(tarea, "sin_respuesta")
+        raise SinRespuesta(f"{tarea}: sin respuesta en {ruta.presupuesto_s:.1f}s") from error
+
+    async def _stream_con_respaldo_async(self, tarea, ruta, peticion, cliente, inicio):
+        try:
+            respuesta = await cliente.chat.completions.create(**self._peticion(peticion, ruta.primario, ruta.presupuesto_s))
+            self._ganador(tarea, ruta.primario, False)
+            return respuesta
+        except Exception as e:
+            error = e
+            self._contar(tarea, "errores")
+        restante = ruta.presupuesto_s - (time.monotonic() - inicio)
+        if ruta.respaldo and restante > 0:
+            self._contar(tarea, "respaldos")
+            try:
+                respuesta = await cliente.chat.completions.create(**self._peticion(peticion, ruta.respaldo, restante))
+                self._ganador(tarea, ruta.respaldo, True)
+                return respuesta
+            except Exception as e:
+                error = e
+                self._contar(tarea, "errores")
+        self._contar(tarea, "sin_respuesta")
+        raise SinRespuesta(f"{tarea}: {error}") from error
+
+    def estadisticas(self):
+        with self._candado:
+            contadores = {tarea: dict(c) for tarea, c in self._contadores.items()}
+            latencias = {modelo: sorted(v) for modelo, v in self._latencias.items() if v}
+        por_tarea = {}
+        for tarea, ruta in self.rutas.items():
+            c = contadores.get(tarea, {})
+            llamadas = c.get("llamadas", 0) + c.get("sin_respuesta", 0)
+            por_tarea[tarea] = {
+                "primario": ruta.primario, "respaldo": ruta.respaldo, "presupuesto_s": ruta.presupuesto_s,
+                "umbral_cobertura_s": round(self.umbral_cobertura(ruta), 3),
+                **c,
+                "tasa_respaldo": (c.get("gana_respaldo", 0) / llamadas) if llamadas else 0.0,
+            }
+        return {
+            "tareas": por_tarea,
+            "modelos": {modelo: {"n": len(v), "p50_ms": round(metricas.percentil(v, 50) * 1000, 1),
+                                 "p95_ms": round(metricas.percentil(v, 95) * 1000, 1)}
+                        for modelo, v in latencias.items()},
+        }
@@ -0,0 +1,291 @@
+"""
+Servidor local de embeddings compartido por las réplicas de Streamlit del host.
+
+Cada réplica cargaba su propia copia de SentenceTransformer + torch; con este
+servidor el modelo vive en UN proceso y las réplicas usan `ClienteEmbeddings`
+(mismo contrato que ModeloEmbeddings.encode). Las peticiones concurrentes de
+todas las réplicas se agrupan en micro-lotes: un solo forward por lote.
+
+    python servidor_embeddings.py                              # unix:/tmp/sm_embeddings.sock, backend torch
+    python servidor_embeddings.py --direccion 127.0.0.1:8765 --backend onnx
+    EMBEDDINGS_SERVIDOR=unix:/tmp/sm_embeddings.sock streamlit run streamlit_app.py
+
+Protocolo (por conexión persistente): 4 bytes big-endian de longitud + JSON
+({"op": "encode", "textos": [...]} | {"op": "ping"} | {"op": "estadisticas"}).
+Respuesta: 4 bytes de longitud + encabezado JSON ({"n", "dim"} o {"error"}),
+seguido de n * dim float32 crudos en el caso de encode.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from embeddings import crear_modelo
+
+DIRECCION_DEFECTO = "unix:/tmp/sm_embeddings.sock"
+_LONGITUD = struct.Struct(">I")
+
+
+def _parsear_direccion(direccion):
+    """"unix:/ruta" o "/ruta" -> (AF_UNIX, ruta); "host:puerto" -> (AF_INET, (host, puerto))."""
+    if direccion.startswith("unix:"):
+        return socket.AF_UNIX, direccion[len("unix:"):]
+    if direccion.startswith("/"):
+        return socket.AF_UNIX, direccion
+    host, _, puerto = direccion.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(puerto))
+
+
+def _recibir_exacto(conexion, n):
+    partes = []
+    while n:
+        parte = conexion.recv(n)
+        if not parte:
+            raise ConnectionError("conexión cerrada")
+        partes.append(parte)
+        n -= len(parte)
+    return b"".join(partes)
+
+
+def _enviar_mensaje(conexion, encabezado, cuerpo=b""):
+    datos = json.dumps(encabezado).encode()
+    conexion.sendall(_LONGITUD.pack(len(datos)) + datos + cuerpo)
+
+
+def _recibir_mensaje(conexion):
+    (longitud,) = _LONGITUD.unpack(_recibir_exacto(conexion, _LONGITUD.size))
+    return json.loads(_recibir_exacto(conexion, longitud))
+
+
+# --- MICRO-LOTES ---
+
+class _Pendiente:
+    __slots__ = ("textos", "listo", "resultado", "error")
+
+    def __init__(self, textos):
+        self.textos = textos
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class MicroLotes:
+    """
+    Un hilo consume la cola: toma lo que ya espera (hasta `max_textos`) y lo
+    codifica junto. Sin carga no añade latencia; con carga, mientras un lote se
+    codifica se acumula el siguiente.
+    """
+
+    def __init__(self, modelo, max_textos=256, espera_max=0.0):
+        self.modelo = modelo
+        self.max_textos = max_textos
+        self.espera_max = espera_max
+        self._cola = queue.Queue()
+        self._candado = threading.Lock()
+        self.lotes = 0
+        self.textos = 0
+        self.peticiones = 0
+        threading.Thread(target=self._bucle, name="micro-lotes", daemon=True).start()
+
+    def encode(self, textos):
+        pendiente = _Pendiente(list(textos))
+        self._cola.put(pendiente)
+        pendiente.listo.wait()
+        if pendiente.error is not None:
+            raise pendiente.error
+        return pendiente.resultado
+
+    def _tomar_lote(self):
+        lote = [self._cola.get()]
+        n = len(lote[0].textos)
+        limite = time.monotonic() + self.espera_max
+        while n < self.max_textos:
+            try:
+                restante = limite - time.monotonic()
+                siguiente = self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait()
+            except queue.Empty:
+                break
+            lote.append(siguiente)
+            n += len(siguiente.textos)
+        return lote
+
+    def _bucle(self):
+        while True:
+            lote = self._tomar_lote()
+            textos = [t for p in lote for t in p.textos]
+            try:
+                matriz = np.asarray(self.modelo.encode(textos, batch_size=max(len(textos), 32)), dtype=np.float32)
+                inicio = 0
+                for p in lote:
+                    p.resultado = matriz[inicio:inicio + len(p.textos)]
+                    inicio += len(p.textos)
+            except Exception as e:
+                for p in lote:
+                    p.error = e
+            with self._candado:
+                self.lotes += 1
+                self.textos += len(textos)
+                self.peticiones += len(lote)
+            for p in lote:
+                p.listo.set()
+
+    def estadisticas(self):
+        with self._candado:
+            return {
+                "lotes": self.lotes,
+                "peticiones": self.peticiones,
+                "textos": self.textos,
+                "textos_por_lote": self.textos / self.lotes if self.lotes else 0.0,
+                "en_cola": self._cola.qsize(),
+            }
+
+
+# --- SERVIDOR ---
+
+def crear_servidor(direccion, modelo, max_textos=256, espera_max=0.0):
+    familia, destino = _parsear_direccion(direccion)
+    lotes = MicroLotes(modelo, max_textos, espera_max)
+
+    class Manejador(socketserver.BaseRequestHandler):
+        def handle(self):
+            if familia == socket.AF_INET:
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                try:
+                    peticion = _recibir_mensaje(self.request)
+                except (ConnectionError, OSError, struct.error):
+                    return
+                op = peticion.get("op")
+                try:
+                    if op == "encode":
+                        matriz = lotes.encode(peticion["textos"])
+                        _enviar_mensaje(self.request, {"n": int(matriz.shape[0]), "dim": int(matriz.shape[1])},
+                                        np.ascontiguousarray(matriz, dtype="<f4").tobytes())
+                    elif op == "ping":
+                        _enviar_mensaje(self.request, {"listo": modelo.listo(), "backend": getattr(modelo, "backend", None)})
+                    elif op == "estadisticas":
+                        _enviar_mensaje(self.request, {**lotes.estadisticas(), "modelo": modelo.estadisticas()})
+                    else:
+                        _enviar_mensaje(self.request, {"error": f"op desconocida: {op}"})
+                except Exception as e:
+                    _enviar_mensaje(self.request, {"error": f"{type(e).__name__}: {e}"})
+
+    if familia == socket.AF_UNIX:
+        if os.path.exists(destino):
+            os.unlink(destino)  # socket huérfano de una ejecución anterior
+        base = socketserver.ThreadingUnixStreamServer
+    else:
+        base = socketserver.ThreadingTCPServer
+
+    class Servidor(base):
+        allow_reuse_address = True
+        daemon_threads = True
+        request_queue_size = 256  # todas las réplicas conectan a la vez al arrancar
+
+    servidor = Servidor(destino, Manejador)
+    servidor.lotes = lotes
+    return servidor
+
+
+# --- CLIENTE ---
+
+class ClienteEmbeddings:
+    """
+    Mismo contrato que ModeloEmbeddings: encode(str) -> (dim,), encode(lista) -> (n, dim), float32.
+    Una conexión persistente por hilo; si se cae, reconecta una vez.
+    """
+
+    def __init__(self, direccion=DIRECCION_DEFECTO, timeout=30.0):
+        self.direccion = direccion
+        self.timeout = timeout
+        self.backend = "servidor"
+        self._familia, self._destino = _parsear_direccion(direccion)
+        self._local = threading.local()
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = socket.socket(self._familia, socket.SOCK_STREAM)
+            conexion.settimeout(self.timeout)
+            conexion.connect(self._destino)
+            if self._familia == socket.AF_INET:
+                conexion.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.conexion = conexion
+        return conexion
+
+    def _cerrar(self):
+        conexion = getattr(self._local, "conexion", None)
+        self._local.conexion = None
+        if conexion is not None:
+            conexion.close()
+
+    def _pedir(self, peticion):
+        for intento in (0, 1):
+            try:
+                conexion = self._conexion()
+                _enviar_mensaje(conexion, peticion)
+                encabezado = _recibir_mensaje(conexion)
+                if "error" in encabezado:
+                    raise RuntimeError(f"Servidor de embeddings: {encabezado['error']}")
+                if peticion["op"] != "encode":
+                    return encabezado, None
+                cuerpo = _recibir_exacto(conexion, encabezado["n"] * encabezado["dim"] * 4)
+                return encabezado, cuerpo
+            except (ConnectionError, OSError):
+                self._cerrar()
+                if intento:
+                    raise
+
+    def encode(self, textos, **kwargs):
+        unico = isinstance(textos, str)
+        lista = [textos] if unico else list(textos)
+        encabezado, cuerpo = self._pedir({"op": "encode", "textos": lista})
+        matriz = np.frombuffer(cuerpo, dtype="<f4").reshape(encabezado["n"], encabezado["dim"]).astype(np.float32)
+        return matriz[0] if unico else matriz
+
+    def calentar(self):
+        return self
+
+    def listo(self):
+        try:
+            return bool(self._pedir({"op": "ping"})[0].get("listo"))
+        except Exception:
+            return False
+
+    def estadisticas(self):
+        try:
+            return {"backend": self.backend, "direccion": self.direccion, **self._pedir({"op": "estadisticas"})[0]}
+        except Exception as e:
+            return {"backend": self.backend, "direccion": self.direccion, "error": str(e)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de embeddings compartido (micro-lotes)")
+    parser.add_argument("--direccion", default=os.getenv("EMBEDDINGS_SERVIDOR", DIRECCION_DEFECTO),
+                        help="unix:/ruta.sock o host:puerto")
+    parser.add_argument("--backend", default=os.getenv("EMBEDDINGS_BACKEND", "torch"))
+    parser.add_argument("--max-lote", type=int, default=256, help="textos máximos por forward")
+    parser.add_argument("--espera-ms", type=float, default=0.0, help="espera extra para llenar el lote")
+    args = parser.parse_args(argv)
+
+    modelo = crear_modelo(args.backend).calentar()
+    modelo.encode("calentamiento")  # no aceptar peticiones hasta que el modelo esté cargado
+    servidor = crear_servidor(args.direccion, modelo, args.max_lote, args.espera_ms / 1000)
+    print(f"Servidor de embeddings ({args.backend}) en {args.direccion}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
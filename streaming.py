@@ -0,0 +1,132 @@
+import re
+import time
+
+# --- STREAMING DE RESPUESTAS ---
+# Renderiza la respuesta del modelo conforme llegan los tokens, sin mostrar
+# nunca etiquetas HTML a medio escribir ni tarjetas `producto-card` incompletas.
+
+_ETIQUETA_DIV = re.compile(r"<div\b[^>]*>|</div\s*>", re.IGNORECASE)
+CURSOR = "▌"
+
+
+def prefijo_seguro(texto):
+    """
+    Devuelve la parte de `texto` que ya se puede pintar:
+    - corta antes de una etiqueta sin cerrar ('<img src="...')
+    - corta antes de una `producto-card` cuyo </div> final aún no llega
+    """
+    abierta = texto.rfind("<")
+    if abierta > texto.rfind(">"):
+        texto = texto[:abierta]
+
+    profundidad = 0
+    inicio_tarjeta = None
+    profundidad_tarjeta = 0
+    for m in _ETIQUETA_DIV.finditer(texto):
+        if m.group().startswith("</"):
+            profundidad = max(profundidad - 1, 0)
+            if inicio_tarjeta is not None and profundidad == profundidad_tarjeta:
+                inicio_tarjeta = None
+        else:
+            if inicio_tarjeta is None and "producto-card" in m.group():
+                inicio_tarjeta = m.start()
+                profundidad_tarjeta = profundidad
+            profundidad += 1
+    if inicio_tarjeta is not None:
+        texto = texto[:inicio_tarjeta]
+    return texto
+
+
+def deltas_groq(stream, al_terminar=None):
+    """
+    Itera los fragmentos de texto de un `chat.completions.create(..., stream=True)`.
+    `al_terminar(usage)` recibe el conteo de tokens que Groq manda en el último chunk.
+    """
+    usage = None
+    try:
+        for chunk in stream:
+            extra = getattr(chunk, "x_groq", None)
+            if extra is not None and getattr(extra, "usage", None) is not None:
+                usage = extra.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    except Exception as e:
+        yield f"\n\nError IA: {e}"
+    finally:
+        if al_terminar is not None:
+            al_terminar(usage)
+
+
+async def deltas_groq_async(stream, al_terminar=None):
+    """Igual que `deltas_groq` para el stream de `AsyncGroq` (async for)."""
+    usage = None
+    try:
+        async for chunk in stream:
+            extra = getattr(chunk, "x_groq", None)
+            if extra is not None and getattr(extra, "usage", None) is not None:
+                usage = extra.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    except Exception as e:
+        yield f"\n\nError IA: {e}"
+    finally:
+        if al_terminar is not None:
+            al_terminar(usage)
+
+
+def renderizar_stream(deltas, contenedor, intervalo=0.05, inicio=None):
+    """
+    Pinta `deltas` en `contenedor` (un st.empty()) y devuelve (texto_final, tiempos).
+    `tiempos` incluye ttft (tiempo al primer token) y total, en segundos desde `inicio`.
+    """
+    inicio = time.perf_counter() if inicio is None else inicio
+    partes = []
+    ttft = None
+    ultimo_pintado = 0.0
+    visible = ""
+    for delta in deltas:
+        if ttft is None:
+            ttft = time.perf_counter() - inicio
+        partes.append(delta)
+        ahora = time.perf_counter()
+        if ahora - ultimo_pintado < intervalo:
+            continue
+        seguro = prefijo_seguro("".join(partes))
+        if seguro != visible:
+            visible = seguro
+            contenedor.markdown(visible + CURSOR, unsafe_allow_html=True)
+            ultimo_pintado = ahora
+    texto = "".join(partes)
+    contenedor.markdown(texto, unsafe_allow_html=True)
+    return texto, {"ttft": ttft, "total": time.perf_counter() - inicio}
+
+
+def medir_ttft(cliente, mensajes, modelo, max_tokens=900):
+    """Mide tiempo al primer token vs. tiempo total contra cualquier cliente tipo Groq."""
+    inicio = time.perf_counter()
+    stream = cliente.chat.completions.create(messages=mensajes, model=modelo, max_tokens=max_tokens, stream=True)
+    ttft = None
+    for _ in deltas_groq(stream):
+        if ttft is None:
+            ttft = time.perf_counter() - inicio
+    return {"ttft": ttft, "total": time.perf_counter() - inicio}
+
+
+# --- EJEMPLO DE USO ---
+if __name__ == "__main__":
+    from fakes import GroqFalso
+
+    cliente = GroqFalso(latencia_primer_token=0.3, latencia_por_token=0.02)
+    mensajes = [{"role": "user", "content": "sensor inductivo"}]
+    con_stream = medir_ttft(cliente, mensajes, "llama-3.3-70b-versatile")
+    inicio = time.perf_counter()
+    cliente.chat.completions.create(messages=mensajes, model="llama-3.3-70b-versatile", max_tokens=900)
+    sin_stream = time.perf_counter() - inicio
+    print(f"Sin streaming: primer texto visible a los {sin_stream * 1000:.0f} ms")
+    print(f"Con streaming: TTFT {con_stream['ttft'] * 1000:.0f} ms (total {con_stream['total'] * 1000:.0f} ms)")
@@ -1,30 +1,100 @@
 import streamlit as st
 import os
-import json
 import unicodedata
 import re
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from groq import Groq
 from supabase import create_client
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 
 # --- IMPORTAMOS EL DISEÑO SM ---
 import style
+import estaticos
+from embeddings import ModeloEmbeddings
+from servidor_embeddings import ClienteEmbeddings
+from indice_ann import CODIFICACIONES, IndiceANN
+from indice_local import CAMPOS_PRODUCTO, IndiceLocal, leer_paginado
+from indice_lexico import UMBRAL_CONFIANZA, IndiceLexico, fusionar
+from router_intencion import RouterReescritura
+from filtros import FiltroPrecio
+from cache_embeddings import AlmacenDisco, CacheEmbeddings, normalizar_consulta
+from cache_respuestas import CacheRespuestas
+from historial import Historial
+from miniaturas import CacheMiniaturas
+from registro_consultas import RegistroConsultas
+from gateway_llm import GatewayLLM
+from ruteo_modelos import REESCRITURA, RESPUESTA, SALUDO, RuteadorModelos
+import bom
+import prompts
+import streaming
+import metricas
 
 # 1. CONFIGURACIÓN
 st.set_page_config(page_title="SM Automatización", page_icon="⚙️", layout="wide")
 load_dotenv()
 
+# CSS, logo, avatares y fuente como estáticos con hash (estaticos.py); RECURSOS_ESTATICOS=0 los manda en línea
+@st.cache_resource
+def init_estaticos():
+    if os.getenv("RECURSOS_ESTATICOS", "1") != "1" or not st.get_option("server.enableStaticServing"):
+        return {}
+    try:
+        return estaticos.urls(estaticos.construir())
+    except OSError as e:
+        st.warning(f"Recursos estáticos deshabilitados: {e}")
+        return {}
+
+recursos = init_estaticos()
+# st.chat_message solo reconoce como estáticas las URLs "/app/static/..." (el HTML usa la forma relativa)
+ICONO_BOT = "/" + recursos["avatar_bot"] if recursos else style.ICONO_BOT
+ICONO_USER = "/" + recursos["avatar_usuario"] if recursos else style.ICONO_USER
+
 # INYECTAR CSS PREMIUM
-style.cargar_estilos_premium()
+style.cargar_estilos_premium(recursos.get("css"))
 
 # 2. CONEXIONES
+@st.cache_resource
+def init_metricas():
+    # Un registro JSONL por turno (rotativo) y, opcional, /metrics estilo Prometheus en METRICAS_PUERTO
+    metricas.METRICAS.configurar_archivo(os.getenv("METRICAS_ARCHIVO", "logs/turnos.jsonl"))
+    if os.getenv("METRICAS_PUERTO"):
+        try:
+            metricas.iniciar_servidor_prometheus(int(os.getenv("METRICAS_PUERTO")))
+        except OSError:
+            pass  # otro proceso del host ya lo sirve
+    return metricas.METRICAS
+
+init_metricas()
+
+# Todas las llamadas a Groq del proceso pasan por un gateway: single-flight de peticiones
+# idénticas, límite compartido de peticiones/tokens por minuto (GROQ_RPM / GROQ_TPM) y reintentos en 429
+@st.cache_resource
+def init_gateway_llm():
+    return GatewayLLM(rpm=int(os.getenv("GROQ_RPM", "30")), tpm=int(os.getenv("GROQ_TPM", "12000")))
+
+gateway = init_gateway_llm()
+
 @st.cache_resource
 def init_connections():
+    if os.getenv("SM_BACKEND") == "falso":
+        # Benchmarks y pruebas de carga: Groq, Supabase y embeddings locales y deterministas
+        import fakes
+        # Con EMBEDDINGS_SERVIDOR el catálogo falso se vectoriza con el mismo modelo que las consultas
+        servidor = ClienteEmbeddings(os.getenv("EMBEDDINGS_SERVIDOR")) if os.getenv("EMBEDDINGS_SERVIDOR") else None
+        db, ia, model = fakes.crear_clientes_falsos(model=servidor)
+        return db, gateway.envolver(ia), model
     try:
         supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-        groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        model = SentenceTransformer('all-MiniLM-L6-v2')
+        groq = gateway.envolver(Groq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0))  # reintenta el gateway
+        if os.getenv("EMBEDDINGS_SERVIDOR"):
+            # Modelo compartido por todas las réplicas del host (python servidor_embeddings.py)
+            model = ClienteEmbeddings(os.getenv("EMBEDDINGS_SERVIDOR"))
+        else:
+            # El modelo carga en un hilo de fondo: header e historial se pintan sin esperarlo
+            model = ModeloEmbeddings(backend=os.getenv("EMBEDDINGS_BACKEND", "torch")).calentar()
         return supabase, groq, model
     except Exception as e:
         st.error(f"❌ Error conexión: {e}")
@@ -32,186 +102,786 @@ def init_connections():
 
 client_db, client_ia, model_embedding = init_connections()
 
+# Modelo por tarea (reescritura y saludo con el 8B instantáneo), presupuesto de latencia,
+# cobertura contra el p95 del primario y modelo de respaldo (MODELO_*, PRESUPUESTO_*, COBERTURA_LLM)
+@st.cache_resource
+def init_ruteador_modelos():
+    return RuteadorModelos(client_ia)
+
+ruteador = init_ruteador_modelos()
+
+# Índice vectorial local (opcional): BUSQUEDA_LOCAL=1 reemplaza el RPC por un espejo en memoria
+BUSQUEDA_LOCAL = os.getenv("BUSQUEDA_LOCAL") == "1"
+INDICE_SNAPSHOT = os.getenv("INDICE_SNAPSHOT")
+INDICE_DESDE_SUPABASE = os.getenv("INDICE_DESDE_SUPABASE") == "1"
+MATCH_THRESHOLD = 0.25
+
+@st.cache_resource
+def init_indice_local():
+    if not BUSQUEDA_LOCAL: return None
+    try:
+        indice = IndiceLocal(intervalo_refresco=int(os.getenv("INDICE_REFRESCO_SEG", "300")))
+        indice.refrescar(INDICE_SNAPSHOT, client_db if INDICE_DESDE_SUPABASE else None, forzar=True)
+        return indice
+    except Exception as e:
+        st.error(f"❌ Error índice local: {e}")
+        return None
+
+indice_local = init_indice_local()
+
+# Índice aproximado sobre el local (catálogos de 100k+ SKUs): INDICE_ANN=int8|binario.
+# Listas IVF con códigos comprimidos y recalificación exacta contra la matriz del índice local.
+INDICE_ANN = os.getenv("INDICE_ANN", "0")
+
+@st.cache_resource
+def init_indice_ann():
+    estado = {"indice": None, "reconstruyendo": False}
+    if indice_local is None or INDICE_ANN not in CODIFICACIONES: return estado
+    try:
+        estado["indice"] = IndiceANN.desde_indice(indice_local, codificacion=INDICE_ANN,
+                                                  n_sondeo=int(os.getenv("INDICE_ANN_SONDEO", "16")))
+    except Exception as e:
+        st.warning(f"Índice aproximado deshabilitado: {e}")
+    return estado
+
+estado_ann = init_indice_ann()
+
+def _buscador_local():
+    """El índice aproximado si está al día con el local; si no, el barrido exacto (y lo reconstruye en segundo plano)."""
+    ann = estado_ann["indice"]
+    if ann is None: return indice_local
+    if ann.version == indice_local.version: return ann
+    if not estado_ann["reconstruyendo"]:
+        estado_ann["reconstruyendo"] = True
+        def reconstruir():
+            try:
+                estado_ann["indice"] = IndiceANN.desde_indice(indice_local, ann.centroides, codificacion=ann.codificacion,
+                                                              n_sondeo=ann.n_sondeo)
+            except Exception as e:
+                metricas.registrar_error("indice_ann", e)
+            finally:
+                estado_ann["reconstruyendo"] = False
+        ejecutor.submit(reconstruir)
+    return indice_local
+
+# Caché de embeddings: LRU en memoria + almacén en disco compartido (CACHE_EMBEDDINGS_DIR)
+@st.cache_resource
+def init_cache_embeddings():
+    directorio = os.getenv("CACHE_EMBEDDINGS_DIR")
+    almacen = None
+    if directorio:
+        try:
+            almacen = AlmacenDisco(directorio, max_entradas=int(os.getenv("CACHE_EMBEDDINGS_DISCO_MAX", "50000")))
+        except Exception as e:
+            st.warning(f"Caché en disco deshabilitada: {e}")
+    return CacheEmbeddings(
+        max_entradas=int(os.getenv("CACHE_EMBEDDINGS_MAX", "2048")),
+        max_bytes=int(os.getenv("CACHE_EMBEDDINGS_MAX_MB", "16")) * 1024 * 1024,
+        almacen=almacen,
+    )
+
+cache_embeddings = init_cache_embeddings()
+
+# Caché semántica de respuestas (CACHE_RESPUESTAS=0 para desactivar)
+CACHE_RESPUESTAS = os.getenv("CACHE_RESPUESTAS", "1") == "1"
+
+@st.cache_resource
+def init_cache_respuestas():
+    cache = CacheRespuestas(
+        umbral=float(os.getenv("UMBRAL_CACHE_RESPUESTAS", "0.95")),
+        max_entradas=int(os.getenv("CACHE_RESPUESTAS_MAX", "500")),
+        ttl=int(os.getenv("CACHE_RESPUESTAS_TTL", "3600")),
+    )
+    if indice_local is not None:
+        indice_local.suscribir(cache.invalidar_productos)  # precio/URL nuevos -> fuera las respuestas viejas
+    return cache
+
+cache_respuestas = init_cache_respuestas()
+
+# Streaming de tokens en las respuestas técnicas (STREAMING_RESPUESTAS=0 para desactivar)
+STREAMING_RESPUESTAS = os.getenv("STREAMING_RESPUESTAS", "1") == "1"
+
+# Tarjetas de producto: "servidor" (la app las pinta con style.crear_tarjeta_producto) o "llm" (HTML del modelo)
+RENDER_TARJETAS = os.getenv("RENDER_TARJETAS", "servidor")
+
+# Miniaturas WebP locales de url_imagen para las tarjetas del servidor (MINIATURAS=0 para desactivar).
+# En modo "llm" la URL queda escrita en la respuesta (y en la caché), así que ahí se usa la original.
+@st.cache_resource
+def init_miniaturas():
+    # Con SM_BACKEND=falso las URLs del catálogo de prueba no existen: apagado salvo que se pida
+    por_defecto = "0" if os.getenv("SM_BACKEND") == "falso" else "1"
+    if os.getenv("MINIATURAS", por_defecto) != "1" or not st.get_option("server.enableStaticServing"):
+        return None
+    try:
+        return CacheMiniaturas(
+            os.path.join(estaticos.DIRECTORIO_ESTATICO, "miniaturas"),
+            max_bytes=int(os.getenv("MINIATURAS_MAX_MB", "64")) * 1024 * 1024,
+        )
+    except OSError as e:
+        st.warning(f"Miniaturas deshabilitadas: {e}")
+        return None
+
+miniaturas = init_miniaturas()
+url_miniatura = miniaturas.url if miniaturas is not None else None
+
+# Búsqueda especulativa en paralelo a la reescritura (BUSQUEDA_ESPECULATIVA=0 para desactivar)
+BUSQUEDA_ESPECULATIVA = os.getenv("BUSQUEDA_ESPECULATIVA", "1") == "1"
+UMBRAL_ESPECULACION = float(os.getenv("UMBRAL_ESPECULACION", "0.97"))
+
+@st.cache_resource
+def init_ejecutor():
+    # Compartido por todas las sesiones del proceso: acota los hilos en vuelo
+    return ThreadPoolExecutor(max_workers=int(os.getenv("HILOS_ESPECULACION", "8")), thread_name_prefix="especulacion")
+
+ejecutor = init_ejecutor()
+
+# Modo lista de materiales: "PLC, 3 sensores inductivos, fuente 24V" se cotiza partida por partida (MODO_BOM=0 para desactivar)
+MODO_BOM = os.getenv("MODO_BOM", "1") == "1"
+
+# Router local de reescritura: evita la llamada a Groq en los casos claros (ROUTER_LOCAL=0 para desactivar)
+ROUTER_LOCAL = os.getenv("ROUTER_LOCAL", "1") == "1"
+
+@st.cache_resource
+def init_router_reescritura():
+    return RouterReescritura(umbral_confianza=float(os.getenv("UMBRAL_ROUTER", "0.75")))
+
+router_reescritura = init_router_reescritura()
+
+# Índice léxico de SKU / números de parte (INDICE_LEXICO=0 para desactivar)
+INDICE_LEXICO = os.getenv("INDICE_LEXICO", "1") == "1"
+
+def _cargar_catalogo():
+    """Productos sin embeddings: del índice local si existe, si no de Supabase (paginado)."""
+    if indice_local is not None and len(indice_local):
+        return indice_local.productos, indice_local.version
+    tabla = os.getenv("TABLA_PRODUCTOS", "productos")
+    return leer_paginado(lambda: client_db.table(tabla).select(",".join(CAMPOS_PRODUCTO)).order("id")), None
+
+@st.cache_resource
+def init_indice_lexico():
+    estado = {"indice": None, "version": None, "construido": 0.0, "reconstruyendo": False}
+    if not INDICE_LEXICO: return estado
+    try:
+        productos, estado["version"] = _cargar_catalogo()
+        estado["indice"], estado["construido"] = IndiceLexico(productos), time.monotonic()
+        router_reescritura.actualizar_vocabulario(productos)
+    except Exception as e:
+        st.warning(f"Índice de SKU deshabilitado: {e}")
+    return estado
+
+estado_lexico = init_indice_lexico()
+
+def obtener_indice_lexico():
+    """Devuelve el índice vigente y, si el catálogo cambió o caducó, lo reconstruye en segundo plano."""
+    if not INDICE_LEXICO: return None
+    caduco = time.monotonic() - estado_lexico["construido"] > int(os.getenv("INDICE_REFRESCO_SEG", "300"))
+    cambio_local = indice_local is not None and estado_lexico["version"] != indice_local.version
+    if (cambio_local or (indice_local is None and caduco)) and not estado_lexico["reconstruyendo"]:
+        estado_lexico["reconstruyendo"] = True
+        def reconstruir():
+            try:
+                productos, version = _cargar_catalogo()
+                estado_lexico.update(indice=IndiceLexico(productos), version=version, construido=time.monotonic())
+                router_reescritura.actualizar_vocabulario(productos)
+            except Exception:
+                estado_lexico["construido"] = time.monotonic()  # reintenta en el siguiente intervalo
+            finally:
+                estado_lexico["reconstruyendo"] = False
+        ejecutor.submit(reconstruir)
+    return estado_lexico["indice"]
+
 # 3. LÓGICA (CEREBRO)
 
+# Números que parecen precio: sueltos (no "1AG40" ni "214-1"), sin unidad técnica detrás ("120v", "240 vac")
+# ni un código delante ("s7 1200"), y solo si el texto habla de dinero (`_SENAL_PRECIO`)
+_NUMERO_PRECIO = re.compile(r'(?<![\w.-])(\$?)\s*(\d[\d,]*(?:\.\d+)?)(?![\w-])')
+_UNIDAD_DESPUES = re.compile(r'\s*(?:v|vac|vdc|amp|amperes|w|kw|hp|mm|cm|m|hz|rpm|kg|mts|metros|pulgadas|fases?|polos|hilos)\b')
+_CODIGO_ANTES = re.compile(r'(?<![\w-])[a-z]+\d[\w-]*\s+$')
+# "de unos 4000 pesos" filtra a ±TOLERANCIA_PRECIO del objetivo y ordena por cercanía
+TOLERANCIA_PRECIO = float(os.getenv("TOLERANCIA_PRECIO", "0.3"))
+_SENAL_PRECIO = re.compile(r'\$|\b(?:pesos?|mxn|precios?|cuest[ae]n?|presupuesto)\b|\bentre\s+\$?\s*\d[\d,.]*\s+y\s')
+
+def _precios_en(texto, inicio=0, fin=None):
+    """Números de texto[inicio:fin] que pueden ser precio; la unidad y el código vecino se buscan en todo el texto."""
+    precios = []
+    for m in _NUMERO_PRECIO.finditer(texto, inicio, len(texto) if fin is None else fin):
+        if _UNIDAD_DESPUES.match(texto, m.end()):
+            continue
+        if not m.group(1) and _CODIGO_ANTES.search(texto, 0, m.start()):
+            continue
+        valor = float(m.group(2).replace(',', ''))
+        if valor > 50: precios.append(valor)  # evita confundir con modelos o cantidades pequeñas
+    return precios
+
 def analizar_filtro_precio(texto):
     """
     Analiza si el usuario quiere filtrar por precio.
-    Retorna:
-    - 'barato': Ordenar asc
-    - 'caro': Ordenar desc
-    - ('especifico', 4000): Buscar precio cercano a 4000
-    - None: Búsqueda normal
+    Retorna un FiltroPrecio (se aplica dentro del RPC / índice local) o None:
+    - "entre 500 y 1000"            -> precio_min=500, precio_max=1000
+    - "menos de 2000 pesos"         -> precio_max=2000
+    - "precio de más de 500"        -> precio_min=500
+    - "de unos 4000 pesos"          -> precio_objetivo=4000 ±TOLERANCIA_PRECIO, orden por cercanía
+    - "barato" / "caro"             -> orden asc / desc (combinable con los rangos)
+    Sin señal de dinero ($, pesos, mxn, precio, "entre X y Y") los números son
+    especificaciones o modelos ("fuente de 100 a 240 vac", "plc 1200").
     """
     texto = texto.lower()
-    
-    # 1. Detección de número específico (ej: "de 4000 pesos", "unos 500")
-    # Buscamos números mayores a 50 (para evitar confundir con modelos o cantidades pequeñas)
-    numeros = re.findall(r'\d+', texto.replace(',', '').replace('$', ''))
-    numeros = [int(n) for n in numeros if int(n) > 50]
-    
-    if numeros:
-        return ('especifico', numeros[0]) # Retorna el primer precio grande que encuentre
-
-    # 2. Detección de Barato/Caro
-    if any(x in texto for x in ["barato", "económico", "economico", "menor precio", "menos cuesta", "bajo costo"]):
-        return "barato"
-    if any(x in texto for x in ["caro", "costoso", "mayor precio", "mejor calidad", "premium", "top"]):
-        return "caro"
-    
-    return None
-
-def buscar_productos_vectorial(query_usuario, n_resultados=3):
+    precio_min = precio_max = objetivo = tolerancia = orden = None
+
+    if _SENAL_PRECIO.search(texto):
+        # 1. Rangos y cotas explícitas
+        rango = re.search(r'(?:entre|de)\s+\$?\s*([\d,.]+)\s+(?:y|a)\s+\$?\s*([\d,.]+)', texto)
+        if rango and len(_precios_en(texto, rango.start(), rango.end())) == 2:
+            precio_min, precio_max = sorted(_precios_en(texto, rango.start(), rango.end()))
+        else:
+            cota_max = re.search(r'(?:menos de|menor a|menor que|hasta|máximo|maximo|no más de|no mas de|debajo de)\s+(\$?\s*[\d,.]+)', texto)
+            cota_min = re.search(r'(?:más de|mas de|mayor a|mayor que|mínimo|minimo|desde|arriba de|encima de)\s+(\$?\s*[\d,.]+)', texto)
+            if cota_max and _precios_en(texto, cota_max.start(), cota_max.end()):
+                precio_max = _precios_en(texto, cota_max.start(), cota_max.end())[0]
+            if cota_min and _precios_en(texto, cota_min.start(), cota_min.end()):
+                precio_min = _precios_en(texto, cota_min.start(), cota_min.end())[0]
+            # 2. Número suelto (ej: "de 4000 pesos", "unos 500"): el más cercano primero
+            if precio_min is None and precio_max is None:
+                numeros = _precios_en(texto)
+                if numeros:
+                    objetivo, tolerancia, orden = numeros[0], TOLERANCIA_PRECIO, "cercania"
+
+    # 3. Detección de Barato/Caro
+    if any(x in texto for x in ["barat", "económico", "economico", "menor precio", "menos cuesta", "bajo costo"]):
+        orden = "asc"
+    elif any(x in texto for x in ["caro", "costoso", "mayor precio", "mejor calidad", "premium", "top"]):
+        orden = "desc"
+
+    filtro = FiltroPrecio(precio_min=precio_min, precio_max=precio_max, precio_objetivo=objetivo, tolerancia=tolerancia, orden=orden)
+    return filtro or None
+
+def vectorizar(texto):
+    """Embedding de la consulta pasando por la caché (texto normalizado como clave)."""
+    vector = cache_embeddings.obtener(texto)
+    metricas.registrar_cache("embedding", vector is not None)
+    if vector is None:
+        with metricas.span("embedding"):
+            vector = model_embedding.encode(texto)
+        cache_embeddings.guardar(texto, vector)
+    return vector
+
+def _indice_local_listo():
+    """True si la búsqueda va contra el índice en memoria (y lo refresca si tocó)."""
+    if indice_local is None or not len(indice_local): return False
+    try:
+        indice_local.refrescar(INDICE_SNAPSHOT, client_db if INDICE_DESDE_SUPABASE else None)
+    except Exception as e:
+        metricas.registrar_error("refresco_indice", e)
+        st.warning(f"Índice local sin refrescar: {e}")
+    return True
+
+def buscar_por_vector(vector, n_resultados=3, filtro=None):
+    """
+    Pide a Supabase (o al índice local) los productos más cercanos a `vector`.
+    `filtro` (FiltroPrecio) se resuelve en la base: rango y orden por precio.
+    No atrapa errores: lo usan tanto el camino normal como el especulativo.
+    """
+    if _indice_local_listo():
+        with metricas.span("busqueda_local"):
+            return _buscador_local().buscar(vector, MATCH_THRESHOLD, n_resultados, filtro)
+
+    parametros = {
+        'query_embedding': vector.tolist(),
+        'match_threshold': MATCH_THRESHOLD, 
+        'match_count': n_resultados 
+    }
+    if filtro: parametros.update(filtro.a_parametros_rpc())
+    with metricas.span("busqueda_rpc"):
+        response = client_db.rpc('buscar_productos', parametros).execute()
+    return response.data
+
+def buscar_productos_vectorial(query_usuario, n_resultados=3, filtro=None):
     """
     Convierte texto a vector y pide a Supabase.
-    n_resultados es dinámico: Pedimos más si vamos a filtrar por precio.
-    """
-    try:
-        vector = model_embedding.encode(query_usuario).tolist()
-        response = client_db.rpc(
-            'buscar_productos', 
-            {
-                'query_embedding': vector,
-                'match_threshold': 0.25, 
-                'match_count': n_resultados 
-            }
-        ).execute()
-        return response.data
+    El filtro de precio viaja al RPC: ya no pedimos filas de más para ordenar aquí.
+    Con BUSQUEDA_LOCAL=1 se resuelve contra el índice en memoria (sin red).
+    """
+    if pipeline is not None:
+        return pipeline.correr(pipeline.buscar_productos_vectorial(query_usuario, n_resultados, filtro))
+    try:
+        return buscar_por_vector(vectorizar(query_usuario), n_resultados, filtro)
     except Exception as e:
+        metricas.registrar_error("busqueda", e)
         st.error(f"Error en búsqueda: {e}")
         return []
 
-def contextualizar_consulta(query_actual, historial_mensajes):
+def similitud_coseno(a, b):
+    norma = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(np.dot(a, b)) / norma if norma else 0.0
+
+def consultar_con_especulacion(prompt, historial, top_k, filtro=None):
+    """
+    Si la consulta sale sin LLM (router local, sin contexto) se busca directo.
+    Si hace falta la reescritura (Groq), mientras está en vuelo ya calculamos
+    embedding y búsqueda del prompt crudo. Si la consulta reescrita es igual o
+    casi igual (coseno >= UMBRAL_ESPECULACION) reutilizamos esos resultados; si
+    no, se descartan. Retorna (query, productos).
+    """
+    if pipeline is not None:
+        return pipeline.correr(pipeline.consultar(prompt, historial, top_k, filtro, especular=BUSQUEDA_ESPECULATIVA))
+    query = reescritura_sin_llm(prompt, historial)
+    if query is not None or not BUSQUEDA_ESPECULATIVA:
+        if query is None:
+            query = reescritura_llm(prompt, prompts.ultimo_mensaje_usuario(historial, prompt))
+        return query, buscar_productos_vectorial(query, top_k, filtro)
+
+    # Una sola tarea por turno (embedding -> búsqueda); el vector se publica en cuanto existe
+    vec_prompt = Future()
+    def especular():
+        try:
+            vector = vectorizar(prompt)
+        except Exception as e:
+            vec_prompt.set_exception(e)
+            raise
+        vec_prompt.set_result(vector)
+        return buscar_por_vector(vector, top_k, filtro)
+    prods_prompt = ejecutor.submit(metricas.con_contexto(especular))
+
+    query = reescritura_llm(prompt, prompts.ultimo_mensaje_usuario(historial, prompt))
+    try:
+        if normalizar_consulta(query) == normalizar_consulta(prompt):
+            metricas.anotar("especulacion", "reutilizada")
+            return query, prods_prompt.result()
+        vec_query = vectorizar(query)
+        if similitud_coseno(vec_prompt.result(), vec_query) >= UMBRAL_ESPECULACION:
+            metricas.anotar("especulacion", "reutilizada")
+            return query, prods_prompt.result()
+        metricas.anotar("especulacion", "descartada")
+        prods_prompt.cancel()  # si ya está corriendo, su resultado simplemente se ignora
+    except Exception as e:
+        metricas.registrar_error("especulacion", e)  # la especulación falló: seguimos por el camino normal, que sí reporta el error
+    return query, buscar_productos_vectorial(query, top_k, filtro)
+
+def buscar_hibrido(prompt, historial, top_k, filtro=None):
+    """
+    Capa híbrida delante de la búsqueda vectorial.
+    - Si el prompt trae un SKU / número de parte con coincidencia confiable, responde
+      directo del índice léxico (sin reescritura LLM ni embedding).
+    - Si hay coincidencias dudosas, las fusiona con los resultados vectoriales.
+    Retorna (query, productos).
+    """
+    hits = buscar_lexico(prompt, top_k)
+    confiables = [p for p, puntaje in hits if puntaje >= UMBRAL_CONFIANZA]
+    if confiables:
+        metricas.anotar("ruta", "sku")
+        return prompt, confiables
+
+    query, prods = consultar_con_especulacion(prompt, historial, top_k, filtro)
+    return query, mezclar_lexico(hits, prods, top_k, filtro)
+
+def buscar_lexico(texto, top_k):
+    lexico = obtener_indice_lexico()
+    with metricas.span("lexico"):
+        return lexico.buscar(texto, top_k) if lexico is not None else []
+
+def mezclar_lexico(hits, prods, top_k, filtro=None):
+    """Productos finales de `buscar_hibrido` dados los hits léxicos y las filas vectoriales."""
+    confiables = [p for p, puntaje in hits if puntaje >= UMBRAL_CONFIANZA]
+    if confiables:
+        return confiables
+    hits = [(p, puntaje) for p, puntaje in hits if not filtro or filtro.admite(p.get('precio'))]
+    return fusionar(hits, prods, limite=top_k) if hits else prods
+
+# --- LISTA DE MATERIALES ---
+
+def vectorizar_lote(textos):
+    """Embeddings de varias consultas: las que no están en caché salen de UNA llamada a encode."""
+    vectores = [cache_embeddings.obtener(t) for t in textos]
+    faltantes = [i for i, v in enumerate(vectores) if v is None]
+    for v in vectores: metricas.registrar_cache("embedding", v is not None)
+    if faltantes:
+        with metricas.span("embedding"):
+            matriz = np.asarray(model_embedding.encode([textos[i] for i in faltantes]), dtype=np.float32)
+        for i, vector in zip(faltantes, matriz):
+            vectores[i] = np.array(vector)  # copia: la caché no debe retener la matriz completa
+            cache_embeddings.guardar(textos[i], vectores[i])
+    return vectores
+
+def buscar_por_vectores(vectores, n_resultados=1):
+    """
+    Búsqueda en lote: un producto matriz-matriz en el índice local o un solo RPC
+    `buscar_productos_lote` (supabase/buscar_productos_lote.sql). Si el RPC no
+    existe aún, cae a un `buscar_productos` por vector en paralelo.
+    """
+    if _indice_local_listo():
+        with metricas.span("busqueda_local"):
+            return _buscador_local().buscar_lote(vectores, MATCH_THRESHOLD, n_resultados)
+    try:
+        with metricas.span("busqueda_rpc"):
+            filas = client_db.rpc('buscar_productos_lote', {
+                'query_embeddings': [np.asarray(v).tolist() for v in vectores],
+                'match_threshold': MATCH_THRESHOLD,
+                'match_count': n_resultados,
+            }).execute().data
+        resultados = [[] for _ in vectores]
+        for fila in filas:
+            resultados[fila.pop('partida')].append(fila)
+        return resultados
+    except Exception as e:
+        metricas.registrar_error("busqueda_lote", e)
+    futuros = [ejecutor.submit(metricas.con_contexto(buscar_por_vector), v, n_resultados) for v in vectores]
+    return [f.result() for f in futuros]
+
+def cotizar_lista(partidas):
+    """
+    Modo lista de materiales: un turno, una cotización. Los SKU exactos salen del
+    índice léxico; el resto se vectoriza en un lote y se busca en un solo viaje.
+    Retorna (texto Markdown, productos cotizados).
+    """
+    resultados = [None] * len(partidas)
+    lexico = obtener_indice_lexico()
+    if lexico is not None:
+        with metricas.span("lexico"):
+            for i, partida in enumerate(partidas):
+                confiables = [p for p, puntaje in lexico.buscar(partida.descripcion, 1) if puntaje >= UMBRAL_CONFIANZA]
+                if confiables: resultados[i] = confiables
+    pendientes = [i for i, r in enumerate(resultados) if r is None]
+    if pendientes:
+        try:
+            vectores = vectorizar_lote([partidas[i].consulta for i in pendientes])
+            for i, filas in zip(pendientes, buscar_por_vectores(vectores)):
+                resultados[i] = filas
+        except Exception as e:
+            metricas.registrar_error("busqueda", e)
+            st.error(f"Error en búsqueda: {e}")
+    resultados = [r or [] for r in resultados]
+    cotizacion = bom.armar_cotizacion(partidas, resultados)
+    metricas.anotar("partidas", len(partidas))
+    metricas.anotar("productos", sum(1 for linea in cotizacion["lineas"] if linea["producto"]))
+    return bom.tabla_cotizacion(cotizacion), [linea["producto"] for linea in cotizacion["lineas"] if linea["producto"]]
+
+def reescritura_local(query_actual, ultimo_msg_usuario):
+    """Consulta reescrita por el router local si el caso es claro, o None si hace falta el LLM."""
+    if not ROUTER_LOCAL: return None
+    def similitud():
+        actual, previo = vectorizar_lote([query_actual, ultimo_msg_usuario])  # un solo encode para los dos
+        return similitud_coseno(actual, previo)
+    decision = router_reescritura.decidir(query_actual, ultimo_msg_usuario, similitud=similitud)
+    if not router_reescritura.es_confiable(decision): return None
+    router_reescritura.registrar_local()
+    metricas.anotar("reescritura", "local")
+    return decision.consulta
+
+def reescritura_sin_llm(query_actual, historial_mensajes):
+    """La consulta si se resuelve sin Groq (larga, sin contexto o caso claro del router); None si hace falta el LLM."""
     if len(query_actual.split()) > 12: return query_actual
-    ultimo_msg_usuario = ""
-    for msg in reversed(historial_mensajes):
-        if msg["role"] == "user" and msg["content"] != query_actual:
-            ultimo_msg_usuario = msg["content"]; break
+    ultimo_msg_usuario = prompts.ultimo_mensaje_usuario(historial_mensajes, query_actual)
     if not ultimo_msg_usuario: return query_actual
+    # Casos claros (cambio de tema, refinamiento, limpieza) sin llamar al LLM
+    return reescritura_local(query_actual, ultimo_msg_usuario)
 
-    prompt_rewrite = f"""
-    Contexto: "{ultimo_msg_usuario}". Usuario: "{query_actual}".
-    TU MISIÓN: Generar la frase de búsqueda TÉCNICA ideal para una base de datos vectorial.
-    
-    REGLAS DE RAZONAMIENTO:
-    1. DETECTAR CAMBIO: Si el usuario dice "también", "ahora", "y un", "además" o pide un producto totalmente distinto (ej: pasas de Sensor a Cable), OLVIDA el contexto anterior. Busca solo lo nuevo.
-    2. DETECTAR REFINAMIENTO: Si el usuario sigue hablando de lo mismo (ej: "¿y pnp?", "¿de 24v?", "¿el más barato?"), COMBINA con el contexto anterior.
-    3. LIMPIEZA: ELIMINA palabras de venta como "barato", "caro", "precio", "costo", "económico", "mejor". Deja solo el nombre técnico del producto.
-    
-    EJEMPLOS:
-    - Contexto="Busco PLC", Usuario="cual es el mas barato" -> Salida="PLC" (Refinamiento + Limpieza)
-    - Contexto="Sensor", Usuario="tambien ocupo cable" -> Salida="Cable" (Cambio de tema)
-    - Contexto="Fuente 24v", Usuario="y de 10 amperes" -> Salida="Fuente 24v 10 amperes" (Refinamiento)
-    
-    Respuesta (Solo la frase final limpia):
-    """
-    try:
-        chat = client_ia.chat.completions.create(messages=[{"role": "system", "content": prompt_rewrite}], model="llama-3.3-70b-versatile", temperature=0.1, max_tokens=50)
-        return chat.choices[0].message.content.strip().replace('"', '')
-    except: return query_actual
-
-def generar_charla_social(mensaje_usuario):
-    try:
-        chat = client_ia.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "Eres el Asistente Técnico de SM Automatización. Breve y profesional."},
-                {"role": "user", "content": mensaje_usuario}
-            ],
-            model="llama-3.3-70b-versatile", temperature=0.6, max_tokens=80
-        )
+def reescritura_llm(query_actual, ultimo_msg_usuario):
+    try:
+        inicio = time.perf_counter()
+        with metricas.span("reescritura"):
+            chat = ruteador.completar(REESCRITURA, prompts.peticion_reescritura(query_actual, ultimo_msg_usuario), client_ia)
+        router_reescritura.registrar_llm(time.perf_counter() - inicio)
+        metricas.anotar("reescritura", "llm")
+        metricas.registrar_tokens("reescritura", chat.usage)
+        return prompts.limpiar_reescritura(chat.choices[0].message.content)
+    except Exception as e:
+        metricas.registrar_error("reescritura", e)
+        return query_actual
+
+def contextualizar_consulta(query_actual, historial_mensajes):
+    if pipeline is not None:
+        return pipeline.correr(pipeline.contextualizar_consulta(query_actual, historial_mensajes))
+    local = reescritura_sin_llm(query_actual, historial_mensajes)
+    if local is not None: return local
+    return reescritura_llm(query_actual, prompts.ultimo_mensaje_usuario(historial_mensajes, query_actual))
+
+def _texto_o_stream(chat, stream):
+    """Texto de la respuesta (o iterador de fragmentos) registrando los tokens usados."""
+    if not stream:
+        metricas.registrar_tokens("generacion", chat.usage)
         return chat.choices[0].message.content
-    except: return "Bienvenido a SM Automatización. ¿En qué le puedo apoyar?"
+    return streaming.deltas_groq(chat, al_terminar=lambda usage: metricas.registrar_tokens("generacion", usage))
+
+def generar_charla_social(mensaje_usuario, stream=False):
+    """Con stream=True devuelve un iterador de fragmentos de texto en lugar del texto."""
+    if pipeline is not None:
+        return pipeline.texto_o_iterador(pipeline.correr(pipeline.generar_charla_social(mensaje_usuario, stream)))
+    try:
+        with metricas.span("generacion"):
+            chat = ruteador.completar(SALUDO, prompts.peticion_charla_social(mensaje_usuario, stream), client_ia)
+        return _texto_o_stream(chat, stream)
+    except Exception as e:
+        metricas.registrar_error("generacion", e)
+        return prompts.SALUDO_RESPALDO
+
+_MARCA_SKUS = re.compile(r"<!--\s*SKUS:(.*?)-->", re.DOTALL)
 
-def generar_respuesta_tecnica(query_usuario, productos):
+def separar_skus(texto):
+    """Separa la explicación de la marca <!-- SKUS: ... -->. Retorna (explicacion, skus o None si no hay marca)."""
+    m = _MARCA_SKUS.search(texto)
+    if not m: return texto.strip(), None
+    skus = [s.strip() for s in m.group(1).split(",") if s.strip()]
+    return (texto[:m.start()] + texto[m.end():]).strip(), skus
+
+def elegir_tarjetas(texto, productos):
+    """(explicación sin la marca, productos que el modelo recomendó en orden)."""
+    explicacion, skus = separar_skus(texto)
+    if skus is None:
+        return explicacion, list(productos)  # el modelo omitió la marca: mostramos lo que recuperamos
+    por_sku = {str(p.get('sku')): p for p in productos}
+    return explicacion, [por_sku[s] for s in dict.fromkeys(skus) if s in por_sku]
+
+def componer_con_tarjetas(texto, productos):
+    """Explicación del modelo + rejilla de tarjetas con datos (y precios) directos de la base."""
+    explicacion, elegidos = elegir_tarjetas(texto, productos)
+    if not elegidos: return explicacion
+    return explicacion + "\n\n" + style.crear_grid_productos(elegidos, url_miniatura)
+
+def generar_respuesta_tecnica(query_usuario, productos, stream=False):
+    """Con stream=True devuelve un iterador de fragmentos de texto en lugar del texto."""
     if not productos: return "No encontré coincidencias exactas."
+    if pipeline is not None:
+        return pipeline.texto_o_iterador(pipeline.correr(pipeline.generar_respuesta_tecnica(query_usuario, productos, stream)))
+    peticion = prompts.peticion_respuesta_tecnica(query_usuario, productos, RENDER_TARJETAS == "servidor", stream)
+    try:
+        with metricas.span("generacion"):
+            chat = ruteador.completar(RESPUESTA, peticion, client_ia)
+        return _texto_o_stream(chat, stream)
+    except Exception as e:
+        metricas.registrar_error("generacion", e)
+        return f"Error IA: {e}"
 
-    contexto_json = []
-    for p in productos:
-        contexto_json.append({
-            "nombre": p['nombre'], "precio": p['precio'], "sku": p.get('sku', 'S/N'),
-            "url_link": p['url_web'], "url_foto": p['url_imagen'], "descripcion": p['descripcion'][:250]
-        })
-    
-    datos_str = json.dumps(contexto_json, indent=2)
-    total = len(productos)
-
-    system_prompt = f"""
-            Eres el Asistente Técnico de 'SM Automatización'. INVENTARIO: {datos_str}
-            PROTOCOLO: Solo recomienda del JSON.
-            🚨 1. PROTOCOLO DE SEGURIDAD (PRIORIDAD MÁXIMA):
-            - TU ÚNICO PROPÓSITO: Asistencia en ingeniería y automatización.
-            - NO eres un vendedor que intenta cerrar una venta a la fuerza. NO tomes pedidos reales.
-            - PROHIBIDO: Opinar sobre celebridades, política, religión o temas personales.
-            - Si preguntan algo fuera de lugar: "Lo siento, mi programación se limita a soporte técnico industrial."
-            - REGLA DE ORO: Solo habla de los productos listados arriba en el JSON.
-            
-            🤝 2. PERSONALIDAD: "EL EXPERTO ACCESIBLE" (UNIVERSAL):
-            - TU META: Que CUALQUIER persona entienda (desde una secretaria hasta un experto).
-            - TONO: Amable, paciente, claro y servicial.
-            - LENGUAJE: Evita jerga técnica compleja a menos que sea necesaria. Explica fácil.
-            
-            🛠️ 3. LÓGICA DE ASESORÍA:
-            - SI ES UN PROYECTO (ej: "Quiero una banda transportadora"): Analiza qué componentes lógicos necesita (Motor, Sensor, PLC) y busca en el JSON qué le sirve.
-            - SI CONFIRMAN ("sí", "ese quiero"): Di "Perfecto. ¿Tienes alguna duda técnica sobre la conexión o voltaje antes de cerrar?" (Cierre suave).
-            - FLEXIBILIDAD TÉCNICA: Si piden un modelo específico y no está, pero hay uno equivalente en el JSON, ofrécelo como solución técnica viable.
-            
-            
-            📸 FORMATO VISUAL OBLIGATORIO:
-            <div class="producto-card">
-                <img src="{{url_foto}}" class="producto-img">
-                <div class="card-title">{{nombre}}</div>
-                <div class="sku-text">SKU: {{sku}}</div>
-                <div class="price-text">${{precio}} MXN</div>
-                <a href="{{url_link}}" target="_blank" class="btn-link">Ver Ficha Técnica</a>
-            </div>
-    """
-    try:
-        chat = client_ia.chat.completions.create(messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": query_usuario}], model="llama-3.3-70b-versatile", temperature=0.1, max_tokens=900)
-        return chat.choices[0].message.content
-    except Exception as e: return f"Error IA: {e}"
+def mostrar_respuesta(resp, productos=None):
+    """
+    Pinta texto completo o un stream de fragmentos; devuelve el texto del modelo.
+    Con `productos` (modo RENDER_TARJETAS=servidor) agrega las tarjetas al terminar.
+    """
+    contenedor = st.empty()
+    if isinstance(resp, str):
+        texto = resp
+    else:
+        texto, tiempos = streaming.renderizar_stream(resp, contenedor)
+        metricas.registrar_duracion("stream_ttft", tiempos["ttft"])
+        metricas.registrar_duracion("stream", tiempos["total"])
+    contenedor.markdown(componer_con_tarjetas(texto, productos) if productos is not None else texto, unsafe_allow_html=True)
+    return texto
 
 def es_saludo_simple(texto):
     triggers = ["hola", "ola", "buenos", "buenas", "que tal", "saludos"]
     return any(t in unicodedata.normalize('NFD', texto.lower()) for t in triggers) and len(texto.split()) < 6
 
+# Pipeline asíncrono (PIPELINE_ASYNC=1): las llamadas a Groq y Supabase del turno corren en un
+# event loop compartido con pools de conexiones acotados, en vez de bloquear un hilo por sesión
+PIPELINE_ASYNC = os.getenv("PIPELINE_ASYNC") == "1"
+
+def _buscar_local(vector, n_resultados, filtro):
+    if indice_local is None or not len(indice_local): return None  # sin índice: el pipeline usa el RPC
+    return buscar_por_vector(vector, n_resultados, filtro)
+
+@st.cache_resource
+def init_pipeline_async():
+    if not PIPELINE_ASYNC: return None
+    import pipeline_async
+    try:
+        if os.getenv("SM_BACKEND") == "falso":
+            import fakes
+            http_db, groq_async = fakes.crear_clientes_falsos_async(client_db, client_ia.cliente)
+        else:
+            http_db, groq_async = pipeline_async.crear_clientes_async(
+                os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"), os.getenv("GROQ_API_KEY"),
+                max_conexiones=int(os.getenv("CONEXIONES_ASYNC", "100")),
+            )
+        return pipeline_async.PipelineAsync(
+            http_db, gateway.envolver_async(groq_async), vectorizar,
+            ruteador=ruteador,
+            buscar_local=_buscar_local,
+            reescritura_local=reescritura_local,
+            al_reescribir_llm=router_reescritura.registrar_llm,
+            tarjetas_servidor=RENDER_TARJETAS == "servidor",
+            match_threshold=MATCH_THRESHOLD,
+            umbral_especulacion=UMBRAL_ESPECULACION,
+            hilos_cpu=int(os.getenv("HILOS_PIPELINE", "4")),
+        )
+    except Exception as e:
+        st.warning(f"Pipeline asíncrono deshabilitado: {e}")
+        return None
+
+pipeline = init_pipeline_async()
+
+# Registro de consultas reescritas sin datos personales (REGISTRO_CONSULTAS="" para desactivar);
+# al arrancar, sus consultas más frecuentes precalientan las cachés en segundo plano
+@st.cache_resource
+def init_registro_consultas():
+    try:
+        return RegistroConsultas(os.getenv("REGISTRO_CONSULTAS", "logs/consultas.jsonl"))
+    except OSError as e:
+        st.warning(f"Registro de consultas deshabilitado: {e}")
+        return RegistroConsultas(None)
+
+registro_consultas = init_registro_consultas()
+
+def precalentar(consultas, n_respuestas=0):
+    """
+    Un solo encode para todas las consultas + una búsqueda en lote: caché de embeddings,
+    índices y miniaturas listos. Las `n_respuestas` más frecuentes además dejan su
+    respuesta en la caché semántica (una completion cada una, en serie), con los
+    productos que armaría el turno en vivo: filtro de precio y fusión léxica.
+    """
+    traza = metricas.iniciar_turno(tipo="precalentamiento", consultas=len(consultas))
+    try:
+        with metricas.span("recuperacion"):
+            vectores = vectorizar_lote(consultas)
+            resultados = buscar_por_vectores(vectores, 3)
+        if miniaturas is not None and RENDER_TARJETAS == "servidor":
+            miniaturas.precargar(p.get('url_imagen') for filas in resultados for p in filas)
+        if CACHE_RESPUESTAS:
+            candidatas = [(c, v, prods) for c, v, prods in zip(consultas, vectores, resultados) if prods][:n_respuestas]
+            for consulta, vector, prods in candidatas:
+                # La caché exige la misma firma de productos que tendrá `buscar_hibrido`
+                filtro = analizar_filtro_precio(consulta)
+                if filtro:
+                    prods = buscar_por_vector(vector, 3, filtro)
+                prods = mezclar_lexico(buscar_lexico(consulta, 3), prods, 3, filtro)
+                if prods and cache_respuestas.buscar(vector, prods) is None:
+                    resp = generar_respuesta_tecnica(consulta, prods)
+                    if "Error IA:" not in resp:
+                        cache_respuestas.guardar(vector, prods, resp)
+        return sum(1 for filas in resultados if filas)
+    finally:
+        metricas.finalizar_turno(traza)
+
+@st.cache_resource
+def init_precalentamiento():
+    estado = {"consultas": 0, "con_resultados": None, "segundos": None}
+    consultas = registro_consultas.frecuentes(int(os.getenv("PRECALENTAR_CONSULTAS", "50")))
+    if not consultas or model_embedding is None: return estado
+    estado["consultas"] = len(consultas)
+    def correr():
+        inicio = time.perf_counter()
+        try:
+            # Las respuestas son opcionales (PRECALENTAR_RESPUESTAS=n): cada una es una completion de 70B
+            estado["con_resultados"] = precalentar(consultas, int(os.getenv("PRECALENTAR_RESPUESTAS", "0")))
+        except Exception as e:
+            metricas.registrar_error("precalentamiento", e)
+        estado["segundos"] = round(time.perf_counter() - inicio, 3)
+    # Hilo propio: el primer usuario no espera ni comparte el ejecutor con esto
+    threading.Thread(target=correr, name="precalentamiento", daemon=True).start()
+    return estado
+
+estado_precalentamiento = init_precalentamiento()
+
 # --- 4. UI PRINCIPAL ---
 
 # CAMBIO AQUÍ: Usamos el header limpio
-style.mostrar_header_limpio()
+style.mostrar_header_limpio(recursos.get("logo"))
+
+# Historial compacto: texto + referencias a productos, turnos viejos comprimidos y tope de memoria por sesión
+VENTANA_HISTORIAL = int(os.getenv("VENTANA_HISTORIAL", "20"))
+
+if "historial" not in st.session_state:
+    st.session_state.historial = Historial(max_bytes=int(os.getenv("HISTORIAL_MAX_KB", "256")) * 1024)
+    st.session_state.historial.agregar("assistant", "Bienvenido a SM Automatización. ¿En qué podemos ayudarle hoy?")
+    st.session_state.ventana_historial = VENTANA_HISTORIAL
+historial = st.session_state.historial
 
-if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Bienvenido a SM Automatización. ¿En qué podemos ayudarle hoy?"}]
+# Solo se pintan los últimos N mensajes: el costo de cada rerun no crece con la conversación
+def _cargar_anteriores():
+    st.session_state.ventana_historial += VENTANA_HISTORIAL
 
-for msg in st.session_state.messages:
-    # Los avatares ahora se cargan desde las rutas definidas en style.py
-    avatar = style.ICONO_BOT if msg["role"] == "assistant" else style.ICONO_USER
+ocultos = len(historial) - st.session_state.ventana_historial
+if ocultos > 0:
+    st.button(f"⬆️ Cargar anteriores ({ocultos})", on_click=_cargar_anteriores)
+if historial.descartados and len(historial) <= st.session_state.ventana_historial:
+    st.caption(f"{historial.descartados} mensajes antiguos ya no se conservan.")
+
+for msg in historial.ultimos(st.session_state.ventana_historial):
+    # Avatares servidos como estáticos (o las rutas de style.py si no hay static serving)
+    avatar = ICONO_BOT if msg["role"] == "assistant" else ICONO_USER
     with st.chat_message(msg["role"], avatar=avatar):
-        st.markdown(msg["content"], unsafe_allow_html=True)
+        contenido = msg["content"]
+        if msg["productos"]:
+            contenido += "\n\n" + style.crear_grid_productos(msg["productos"], url_miniatura)
+        st.markdown(contenido, unsafe_allow_html=True)
+
+# Panel oculto de métricas: ?admin=<ADMIN_TOKEN>
+if os.getenv("ADMIN_TOKEN") and st.query_params.get("admin") == os.getenv("ADMIN_TOKEN"):
+    with st.expander("📊 Métricas por etapa (p50 / p95 / p99)"):
+        st.table(metricas.METRICAS.resumen())
+        st.json({
+            "cache_embeddings": cache_embeddings.estadisticas(),
+            "router_reescritura": router_reescritura.estadisticas(),
+            "cache_respuestas": cache_respuestas.estadisticas(),
+            "historial_sesion": historial.estadisticas(),
+            "miniaturas": miniaturas.estadisticas() if miniaturas is not None else None,
+            "indice_ann": estado_ann["indice"].memoria() if estado_ann["indice"] is not None else None,
+            "precalentamiento": estado_precalentamiento,
+            "gateway_llm": gateway.estadisticas(),
+            "ruteo_modelos": ruteador.estadisticas(),
+            "modelo_embeddings": model_embedding.estadisticas() if model_embedding else None,
+            "contadores": dict(metricas.METRICAS.contadores),
+        })
+    with st.expander("🔎 Consultas más lentas y sin resultados"):
+        st.json(registro_consultas.reporte(10))
 
 # 5. BUCLE
 if prompt := st.chat_input("Escriba su consulta..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    consulta_turno = None  # (consulta reescrita, productos) de los turnos técnicos, para el registro
+    partidas = bom.detectar_lista(prompt) if MODO_BOM and not es_saludo_simple(prompt) else None
+    traza = metricas.iniciar_turno(tipo="saludo" if es_saludo_simple(prompt) else "bom" if partidas else "tecnico")
+    historial.agregar("user", prompt)
     # Tu avatar será el logo SM
-    with st.chat_message("user", avatar=style.ICONO_USER): st.markdown(prompt)
+    with st.chat_message("user", avatar=ICONO_USER): st.markdown(prompt)
 
-    with st.chat_message("assistant", avatar=style.ICONO_BOT):
+    with st.chat_message("assistant", avatar=ICONO_BOT):
         if es_saludo_simple(prompt):
-            resp = generar_charla_social(prompt)
+            # Sin stream: 80 tokens del modelo instantáneo salen en un parpadeo, y así los
+            # saludos idénticos de varias sesiones se coalescen en el gateway
+            resp = mostrar_respuesta(generar_charla_social(prompt))
+            historial.agregar("assistant", resp)
+        elif partidas:
+            # Sin LLM: la tabla sale directo del catálogo, un solo viaje por turno
+            with st.spinner("Cotizando lista..."):
+                with metricas.span("recuperacion"):
+                    resp, _ = cotizar_lista(partidas)
             st.markdown(resp)
-            st.session_state.messages.append({"role": "assistant", "content": resp})
+            historial.agregar("assistant", resp)
         else:
             with st.spinner("Procesando..."):
-                filtro = analizar_filtro_precio(prompt)
-                query = contextualizar_consulta(prompt, st.session_state.messages)
-                top_k = 12 if filtro else 3
-                prods = buscar_productos_vectorial(query, top_k)
-                
-                if prods and filtro:
-                    if filtro == "barato": prods.sort(key=lambda x: x['precio'])
-                    elif filtro == "caro": prods.sort(key=lambda x: x['precio'], reverse=True)
-                    elif isinstance(filtro, tuple): prods.sort(key=lambda x: abs(x['precio'] - filtro[1]))
-                    prods = prods[:3]
-                
-                resp = generar_respuesta_tecnica(query, prods)
-                st.markdown(resp, unsafe_allow_html=True)
-                st.session_state.messages.append({"role": "assistant", "content": resp})
\ No newline at end of file
+                with metricas.span("filtro_precio"):
+                    filtro = analizar_filtro_precio(prompt)
+                with metricas.span("recuperacion"):
+                    query, prods = buscar_hibrido(prompt, historial.mensajes_para_contexto(), 3, filtro)
+                metricas.anotar("productos", len(prods))
+                consulta_turno = (query, len(prods))
+                if miniaturas is not None and RENDER_TARJETAS == "servidor":
+                    miniaturas.precargar(p.get('url_imagen') for p in prods)  # listas para cuando termine la respuesta
+
+                vector_query = cacheada = None
+                if CACHE_RESPUESTAS and prods:
+                    try:
+                        vector_query = vectorizar(query)
+                        cacheada = cache_respuestas.buscar(vector_query, prods)
+                    except Exception as e:
+                        metricas.registrar_error("cache_respuestas", e)
+                    metricas.registrar_cache("respuesta", cacheada is not None)
+
+                if cacheada is None:
+                    resp = generar_respuesta_tecnica(query, prods, stream=STREAMING_RESPUESTAS)
+
+            tarjetas = prods if RENDER_TARJETAS == "servidor" else None
+            if cacheada is not None:
+                # Mismos productos y precios que la respuesta guardada: se sirve tal cual
+                resp = mostrar_respuesta(cacheada, tarjetas)
+            else:
+                # Fuera del spinner: el texto aparece conforme llegan los tokens
+                resp = mostrar_respuesta(resp, tarjetas)
+                if vector_query is not None and "Error IA:" not in resp:
+                    cache_respuestas.guardar(vector_query, prods, resp)
+            # En el historial: la explicación y referencias a los productos, no el HTML de las tarjetas
+            if tarjetas is not None:
+                historial.agregar("assistant", *elegir_tarjetas(resp, tarjetas))
+            else:
+                historial.agregar("assistant", resp)
+    registro = metricas.finalizar_turno(traza)
+    if consulta_turno is not None and registro is not None:
+        registro_consultas.registrar(consulta_turno[0], registro["total_ms"], consulta_turno[1], prompt)
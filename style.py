@@ -1,6 +1,8 @@
 import streamlit as st
 import base64
+import html
 import os
+import re
 
 # --- PALETA SM AUTOMATIZACIÓN (Minimalista) ---
 COLOR_NAVY = "#14213D"
@@ -25,14 +27,27 @@ LOGO_B64 = get_image_base64(LOGO_PATH_LOCAL)
 
 # --- AVATARES DE CHAT ---
 ICONO_BOT = LOGO_PATH_LOCAL
-ICONO_USER = "https://cdn-icons-png.flaticon.com/512/1077/1077114.png"
+ICONO_USER = "images/usuario.svg"
 
-def cargar_estilos_premium():
-    st.markdown(f"""
-        <style>
-        /* --- TIPOGRAFÍA MINIMALISTA --- */
+def css_premium(fuente_inter=None):
+    """
+    Hoja de estilos completa (sin etiquetas <style>). `fuente_inter` es la URL del
+    subconjunto de Inter autohospedado; sin ella Inter se sigue pidiendo a Google Fonts.
+    """
+    fuente = f"""
+        /* --- TIPOGRAFÍA MINIMALISTA (Inter autohospedada) --- */
+        @font-face {{
+            font-family: 'Inter';
+            font-style: normal;
+            font-weight: 400 700;
+            font-display: swap;
+            src: url('{fuente_inter}') format('woff2');
+        }}
+    """ if fuente_inter else """
+        /* --- TIPOGRAFÍA MINIMALISTA (sin fuentes/ : Inter desde Google Fonts) --- */
         @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
-        
+    """
+    return fuente + f"""
         :root {{
             --navy: {COLOR_NAVY};
             --orange: {COLOR_ORANGE};
@@ -133,6 +148,17 @@ def cargar_estilos_premium():
             transition: all 0.25s cubic-bezier(0.4, 0, 0.2, 1);
         }}
         
+        .producto-grid {{
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(220px, 1fr));
+            gap: 16px;
+            margin: 16px 0;
+        }}
+
+        .producto-grid .producto-card {{
+            margin: 0;
+        }}
+
         .producto-card:hover {{
             border-color: var(--navy);
             transform: translateY(-2px);
@@ -329,20 +355,36 @@ def cargar_estilos_premium():
             background: #FEF3C7;
             color: #D97706;
         }}
+    """
 
-        </style>
-    """, unsafe_allow_html=True)
+def minificar_css(css):
+    """Quita comentarios y espacios sobrantes (conservador: no toca selectores ni valores)."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
 
-def mostrar_header_limpio():
-    """Header minimalista con logo centrado."""
-    if LOGO_B64:
+def cargar_estilos_premium(hoja_url=None):
+    """
+    Con `hoja_url` (CSS minificado y con hash, ver estaticos.py) cada rerun envía
+    solo una etiqueta <link>; sin ella, el CSS va en línea como antes.
+    """
+    if hoja_url:
+        st.markdown(f'<link rel="stylesheet" href="{hoja_url}">', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>{minificar_css(css_premium())}</style>", unsafe_allow_html=True)
+
+def mostrar_header_limpio(logo_url=None):
+    """Header minimalista con logo centrado (servido como estático si hay `logo_url`)."""
+    if logo_url or LOGO_B64:
         st.markdown(f"""
             <div style="
                 text-align: center;
                 padding: 8px 0 24px;
             ">
                 <img 
-                    src="data:image/png;base64,{LOGO_B64}" 
+                    src="{logo_url or f'data:image/png;base64,{LOGO_B64}'}" 
                     style="
                         height: 64px;
                         margin-bottom: 12px;
@@ -418,7 +460,7 @@ def crear_tarjeta_producto(imagen_url, titulo, sku, precio, link):
     """Genera HTML para una tarjeta de producto minimalista."""
     return f"""
         <div class="producto-card">
-            <img src="{imagen_url}" class="producto-img" alt="{titulo}">
+            <img src="{imagen_url}" class="producto-img" alt="{titulo}" loading="lazy" decoding="async">
             <span class="sku-text">{sku}</span>
             <h3 class="card-title">{titulo}</h3>
             <p class="price-text">${precio:,.2f}</p>
@@ -426,6 +468,29 @@ def crear_tarjeta_producto(imagen_url, titulo, sku, precio, link):
         </div>
     """
 
+def crear_grid_productos(productos, miniatura=None):
+    """
+    Rejilla de tarjetas a partir de filas del catálogo (precio tal cual viene de la base).
+    `miniatura` traduce url_imagen a la miniatura local (ver miniaturas.py).
+    """
+    tarjetas = []
+    for p in productos:
+        try:
+            precio = float(p.get('precio') or 0)
+        except (TypeError, ValueError):
+            precio = 0.0
+        imagen = p.get('url_imagen') or ''
+        if miniatura: imagen = miniatura(imagen)
+        tarjetas.append(crear_tarjeta_producto(
+            html.escape(imagen, quote=True),
+            html.escape(p.get('nombre') or ''),
+            html.escape(str(p.get('sku') or 'S/N')),
+            precio,
+            html.escape(p.get('url_web') or '#', quote=True),
+        ))
+    # Sin sangría ni líneas en blanco: markdown trataría el HTML indentado como bloque de código
+    return '<div class="producto-grid">' + "".join(" ".join(t.split()) for t in tarjetas) + "</div>"
+
 # --- EJEMPLO DE USO ---
 if __name__ == "__main__":
     st.set_page_config(
@@ -0,0 +1,45 @@
+-- RPC `buscar_productos` extendido con filtro y orden por precio.
+-- Los parámetros nuevos tienen default, así que las llamadas de 3 argumentos siguen funcionando.
+-- Se elimina la versión anterior para que la sobrecarga no sea ambigua.
+drop function if exists buscar_productos(vector, float, int);
+
+create or replace function buscar_productos(
+  query_embedding vector(384),
+  match_threshold float,
+  match_count int,
+  precio_min float default null,
+  precio_max float default null,
+  precio_objetivo float default null,
+  orden text default null,          -- 'asc' | 'desc' | 'cercania' | null (similitud)
+  pool_count int default 50         -- candidatos por similitud sobre los que se ordena por precio
+)
+returns table (
+  id bigint,
+  nombre text,
+  descripcion text,
+  sku text,
+  precio float,
+  url_web text,
+  url_imagen text,
+  similarity float
+)
+language sql stable
+as $$
+  with candidatos as (
+    select p.id, p.nombre, p.descripcion, p.sku, p.precio, p.url_web, p.url_imagen,
+           1 - (p.embedding <=> query_embedding) as similarity
+    from productos p
+    where 1 - (p.embedding <=> query_embedding) >= match_threshold
+      and (precio_min is null or p.precio >= precio_min)
+      and (precio_max is null or p.precio <= precio_max)
+    order by p.embedding <=> query_embedding
+    limit greatest(pool_count, match_count)
+  )
+  select * from candidatos c
+  order by
+    case when orden = 'asc' then c.precio end asc,
+    case when orden = 'desc' then c.precio end desc nulls last,  -- como FiltroPrecio.ordenar
+    case when orden = 'cercania' then abs(c.precio - precio_objetivo) end asc,
+    c.similarity desc
+  limit match_count;
+$$;
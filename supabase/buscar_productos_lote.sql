@@ -0,0 +1,32 @@
+-- RPC `buscar_productos_lote`: varias consultas vectoriales en un solo viaje (modo lista de materiales).
+-- query_embeddings es un arreglo JSON de vectores; cada fila indica a qué partida (0, 1, ...) responde.
+create or replace function buscar_productos_lote(
+  query_embeddings jsonb,
+  match_threshold float,
+  match_count int
+)
+returns table (
+  partida int,
+  id bigint,
+  nombre text,
+  descripcion text,
+  sku text,
+  precio float,
+  url_web text,
+  url_imagen text,
+  similarity float
+)
+language sql stable
+as $$
+  select (q.ord - 1)::int, r.*
+  from jsonb_array_elements(query_embeddings) with ordinality as q(vec, ord)
+  cross join lateral (
+    select p.id, p.nombre, p.descripcion, p.sku, p.precio, p.url_web, p.url_imagen,
+           1 - (p.embedding <=> (q.vec::text)::vector(384)) as similarity
+    from productos p
+    where 1 - (p.embedding <=> (q.vec::text)::vector(384)) >= match_threshold
+    order by p.embedding <=> (q.vec::text)::vector(384)
+    limit match_count
+  ) r
+  order by q.ord, r.similarity desc;
+$$;
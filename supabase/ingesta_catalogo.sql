@@ -0,0 +1,24 @@
+-- Columnas que usa ingesta_catalogo.py y el refresco incremental de IndiceLocal.
+-- hash_embedding: huella del texto vectorizado; si no cambia, el embedding no se recalcula.
+-- actualizado_en: se renueva en cada update para que los espejos traigan solo lo modificado.
+alter table productos add column if not exists hash_embedding text;
+alter table productos add column if not exists actualizado_en timestamptz not null default now();
+
+-- Upserts por SKU cuando el export no trae id
+create unique index if not exists productos_sku_key on productos (sku);
+create index if not exists productos_actualizado_en_idx on productos (actualizado_en, id);
+
+create or replace function tocar_actualizado_en()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.actualizado_en := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists productos_actualizado_en on productos;
+create trigger productos_actualizado_en
+  before update on productos
+  for each row execute function tocar_actualizado_en();